@@ -0,0 +1,301 @@
+"""
+backtester.py
+
+Назначение: Исторический бэктест правил signals_processor по сохранённым котировкам.
+Правила ВНИМАНИЕ → КУПИ → ДОКУПИ → ПРОДАЙ воспроизводятся по всей истории всех тикеров:
+сигнал по close дня, исполнение по open следующего торгового дня, комиссия COMMISSION,
+объём заявки — как в trader_executor (MAX_OPERATION_AMOUNT и MAX_SHARES_PER_TRADE),
+общий денежный счёт с начальным депозитом STARTING_DEPOSIT.
+
+Котировки складываются в панель (даты × тикеры). События, не зависящие от позиции
+(пересечение SMA, ВНИМАНИЕ), считаются сразу по всей панели; состояние позиций
+продвигается по датам, и каждый шаг — операции над массивами по всем тикерам.
+
+Результат — журнал сделок и ряд эквити (backtest_trades.csv, backtest_equity.csv).
+
+Отличия от живого прогона: ДОКУПИ сравнивает close со средней ценой исполнения,
+а не с open сигнальной свечи; в день сигнала ПРОДАЙ ДОКУПИ не выставляется.
+
+Запуск:
+    python backtester.py
+    python backtester.py --since 2020-01-01 --plot
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+from config import (TICKERS, BOLLINGER_CONFIG, COMMISSION, STARTING_DEPOSIT,
+                    MAX_OPERATION_AMOUNT, MAX_SHARES_PER_TRADE, COLUMNAR_STORE)
+from indicators import RollingWindows
+import quotes_storage
+import columnar_store
+import db
+
+N = 5  # Окно истории (свечей) живой проверки сигналов, как N в signals_processor
+HISTORY_COLUMNS = ['open', 'close', 'sma', 'upper_band', 'lower_band']
+EXIT_RULES = ('sma', 'upper_band')  # ПРОДАЙ: close выше SMA или выше верхней полосы
+
+TRADES_FILE = "backtest_trades.csv"
+EQUITY_FILE = "backtest_equity.csv"
+CHART_FILE = "backtest_equity.png"
+
+
+def read_columnar_history(tickers, interval='day'):
+    """
+    Читает всю историю котировок тикеров из колоночного хранилища
+    в том же виде, что quotes_storage.read_last_n_batch. Тикеры без файла пропускаются.
+    """
+    columns = ['date'] + HISTORY_COLUMNS
+    frames = {}
+    for ticker in tickers:
+        df = columnar_store.read_last_n(ticker, None, columns=columns, until_today=True, interval=interval)
+        if not df.empty:
+            frames[ticker] = df
+    if not frames:
+        return pd.DataFrame(columns=['ticker'] + columns).set_index(['ticker', 'date'])
+    history = pd.concat(frames, names=['ticker']).reset_index(level=1, drop=True)
+    return history.set_index('date', append=True).sort_index()
+
+
+def load_history(tickers=TICKERS, since=None, interval='day'):
+    """
+    Читает всю историю котировок тикеров одним запросом
+    (или из колоночного хранилища, если включено COLUMNAR_STORE['read']).
+
+    Returns:
+        DataFrame: индекс (ticker, date), колонки HISTORY_COLUMNS (float)
+    """
+    if COLUMNAR_STORE['read']:
+        history = read_columnar_history(tickers, interval)
+    else:
+        with db.connection() as conn:
+            history = quotes_storage.read_last_n_batch(conn, tickers, None, columns=HISTORY_COLUMNS,
+                                                       until_today=True, interval=interval)
+    history = history.astype(float)
+    if since is not None:
+        history = history[history.index.get_level_values('date') >= pd.Timestamp(since)]
+    return history
+
+
+def build_history_panel(history, tickers=TICKERS):
+    """
+    Раскладывает историю в массивы (даты × тикеры) по общему календарю.
+
+    Returns:
+        dict: 'dates', 'tickers', массивы HISTORY_COLUMNS, 'valid' (есть свеча),
+              'row' (номер свечи в истории тикера)
+    """
+    wide = history.unstack('ticker')
+    panel = {'dates': wide.index, 'tickers': list(tickers)}
+    for column in HISTORY_COLUMNS:
+        panel[column] = wide[column].reindex(columns=tickers).to_numpy(dtype=float)
+    panel['valid'] = np.isfinite(panel['close'])
+    panel['row'] = np.cumsum(panel['valid'], axis=0) - 1
+    return panel
+
+
+def rolling_bands(panel, window=BOLLINGER_CONFIG['window'], num_std=BOLLINGER_CONFIG['num_std']):
+    """
+    Полосы Боллинджера по close панели (по собственным свечам каждого тикера).
+
+    Returns:
+        (sma, upper_band, lower_band): массивы (даты × тикеры)
+    """
+    close, valid = panel['close'], panel['valid']
+    bands = [np.full(close.shape, np.nan) for _ in range(3)]
+    for column in range(close.shape[1]):
+        rows = valid[:, column]
+        if rows.sum() < window:
+            continue
+        windows = RollingWindows(close[rows, column])
+        sma = windows.mean(window)
+        deviation = num_std * windows.std(window)
+        for band, values in zip(bands, (sma, sma + deviation, sma - deviation)):
+            band[rows, column] = values
+    return tuple(bands)
+
+
+def attention_events(panel, sma, lower, n=N):
+    """
+    Дни сигнала ВНИМАНИЕ по всей панели: первая свеча с close ниже нижней полосы
+    после последнего пересечения SMA сверху вниз, когда пересечение ещё попадает
+    в окно из n свечей живой проверки.
+
+    Returns:
+        np.ndarray: bool (даты × тикеры)
+    """
+    close, valid, row = panel['close'], panel['valid'], panel['row']
+    previous = pd.DataFrame(np.where(valid, close, np.nan)).ffill().shift(1).to_numpy()
+    previous_sma = pd.DataFrame(np.where(valid, sma, np.nan)).ffill().shift(1).to_numpy()
+    with np.errstate(invalid='ignore'):
+        crossed = valid & (close < sma) & (previous >= previous_sma)
+        below = valid & (close < lower)
+    below_count = np.cumsum(below, axis=0)
+    cross_row = pd.DataFrame(np.where(crossed, row, np.nan)).ffill().to_numpy()
+    count_before_cross = pd.DataFrame(np.where(crossed, below_count - below, np.nan)).ffill().to_numpy()
+    # Пересечение определяется по паре свечей, поэтому в окне n свечей оно не старше n - 2 свечей
+    return below & (below_count - count_before_cross == 1) & (row - cross_row <= n - 2)
+
+
+def run_backtest(panel, sma=None, upper=None, lower=None, n=N, exit_rule='sma', record=True):
+    """
+    Прогоняет правила по панели.
+
+    Args:
+        panel: результат build_history_panel
+        sma, upper, lower: полосы (по умолчанию — сохранённые в БД колонки панели)
+        n: окно живой проверки сигналов (свечей)
+        exit_rule: правило ПРОДАЙ из EXIT_RULES
+        record: собирать журнал сделок
+
+    Returns:
+        dict: 'trades' (DataFrame журнала или None), 'equity' (Series по датам), 'sells' (число продаж)
+    """
+    sma = panel['sma'] if sma is None else sma
+    upper = panel['upper_band'] if upper is None else upper
+    lower = panel['lower_band'] if lower is None else lower
+    exit_band = sma if exit_rule == 'sma' else upper
+    close, open_, valid, row = panel['close'], panel['open'], panel['valid'], panel['row']
+    dates, tickers = panel['dates'], panel['tickers']
+    commission = float(COMMISSION)
+    attention = attention_events(panel, sma, lower, n)
+    last_close = pd.DataFrame(close).ffill().fillna(0.0).to_numpy()
+
+    count = close.shape[1]
+    cash = float(STARTING_DEPOSIT)
+    attention_active = np.zeros(count, dtype=bool)
+    attention_bought = np.zeros(count, dtype=bool)
+    attention_close = np.full(count, np.nan)
+    attention_row = np.zeros(count)
+    quantity = np.zeros(count)
+    avg_price = np.full(count, np.nan)
+    cost = np.zeros(count)
+    pending_buy = np.zeros(count, dtype=int)  # 0 — нет, 1 — КУПИ, 2 — ДОКУПИ
+    pending_sell = np.zeros(count, dtype=bool)
+    equity = np.empty(len(dates))
+    trades = []
+    sells = 0
+
+    for day in range(len(dates)):
+        price = open_[day]
+        tradable = np.isfinite(price)
+
+        # === Исполнение заявок прошлого дня по open ===
+        sell = pending_sell & tradable
+        if sell.any():
+            proceeds = price * quantity * (1 - commission)
+            cash += proceeds[sell].sum()
+            sells += int(sell.sum())
+            if record:
+                for i in np.flatnonzero(sell):
+                    trades.append((dates[day], tickers[i], "SELL", price[i], quantity[i],
+                                   proceeds[i], proceeds[i] - cost[i]))
+            quantity[sell], cost[sell], avg_price[sell] = 0.0, 0.0, np.nan
+            pending_sell &= ~tradable
+
+        buy = (pending_buy > 0) & tradable
+        if buy.any():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                lots = np.minimum(np.floor(MAX_OPERATION_AMOUNT / price), MAX_SHARES_PER_TRADE)
+            lots = np.where(buy & (lots > 0), lots, 0.0)
+            amount = np.nan_to_num(price * lots * (1 + commission))
+            # Заявки исполняются в порядке тикеров, пока хватает денег
+            filled = (lots > 0) & (np.cumsum(amount) <= cash)
+            cash -= amount[filled].sum()
+            if record:
+                for i in np.flatnonzero(filled):
+                    trades.append((dates[day], tickers[i], "BUY" if pending_buy[i] == 1 else "DCA",
+                                   price[i], lots[i], amount[i], 0.0))
+            held = np.where(filled, quantity, 0.0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                avg_price[filled] = ((np.nan_to_num(avg_price) * held + price * lots) / (held + lots))[filled]
+            quantity[filled] += lots[filled]
+            cost[filled] += amount[filled]
+            pending_buy[tradable] = 0
+
+        # === Сигналы по close дня ===
+        is_valid = valid[day]
+        today_close, today_row = close[day], row[day]
+        new_attention = attention[day]
+        attention_active |= new_attention
+        attention_bought &= ~new_attention
+        attention_close = np.where(new_attention, today_close, attention_close)
+        attention_row = np.where(new_attention, today_row, attention_row)
+
+        with np.errstate(invalid='ignore'):
+            entry = (is_valid & attention_active & ~attention_bought
+                     & (today_row > attention_row) & (today_row - attention_row <= n - 1)
+                     & (today_close < attention_close) & (today_close <= sma[day]))
+            held = quantity > 0
+            exit_signal = held & is_valid & (today_close > exit_band[day])
+            add = held & is_valid & ~exit_signal & (today_close < avg_price)
+        attention_bought |= entry
+        pending_buy = np.where(entry, 1, np.where(add, 2, pending_buy))
+        pending_sell |= exit_signal
+        attention_active &= ~exit_signal
+
+        equity[day] = cash + (quantity * last_close[day]).sum()
+
+    ledger = None
+    if record:
+        ledger = pd.DataFrame(trades, columns=['date', 'ticker', 'trade_type', 'price', 'quantity', 'amount', 'profit'])
+    return {'trades': ledger, 'equity': pd.Series(equity, index=dates, name='equity'), 'sells': sells}
+
+
+def summarize(result):
+    """Итоги бэктеста: доходность и максимальная просадка (%), число закрытых позиций"""
+    equity = result['equity']
+    if equity.empty:
+        return {'total_return': 0.0, 'max_drawdown': 0.0, 'trades': 0}
+    drawdown = equity / equity.cummax() - 1
+    return {
+        'total_return': (equity.iloc[-1] / STARTING_DEPOSIT - 1) * 100,
+        'max_drawdown': drawdown.min() * 100,
+        'trades': result['sells'],
+    }
+
+
+def plot_equity(equity, path=CHART_FILE):
+    """Сохраняет график эквити с закрашенной просадкой"""
+    import matplotlib.pyplot as plt
+    peak = equity.cummax()
+    plt.figure(figsize=(14, 7))
+    plt.plot(equity.index, equity.values, label='Эквити', color='blue')
+    plt.fill_between(equity.index, equity.values, peak.values, color='red', alpha=0.2, label='Просадка')
+    plt.title(f'Бэктест: начальный депозит {STARTING_DEPOSIT:,} ₽')
+    plt.xlabel('Дата')
+    plt.ylabel('Баланс (₽)')
+    plt.grid(True)
+    plt.legend()
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+
+def main(since=None, plot=False):
+    history = load_history(since=since)
+    if history.empty:
+        print("[X] Нет котировок для бэктеста")
+        return
+    panel = build_history_panel(history)
+    print(f"[i] Бэктест: {len(panel['tickers'])} тикеров, {len(panel['dates'])} дней "
+          f"({panel['dates'][0].date()} — {panel['dates'][-1].date()})")
+
+    result = run_backtest(panel)
+    result['trades'].to_csv(TRADES_FILE, index=False)
+    result['equity'].to_csv(EQUITY_FILE, index_label='date')
+    stats = summarize(result)
+    print(f"[i] Доходность: {stats['total_return']:.2f}%, максимальная просадка: {stats['max_drawdown']:.2f}%, "
+          f"закрытых позиций: {stats['trades']}, сделок в журнале: {len(result['trades'])}")
+    print(f"[i] Журнал сделок: {TRADES_FILE}, эквити: {EQUITY_FILE}")
+    if plot:
+        plot_equity(result['equity'])
+        print(f"[i] График эквити: {CHART_FILE}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бэктест правил signals_processor по истории котировок")
+    parser.add_argument("--since", help="начальная дата истории (YYYY-MM-DD)")
+    parser.add_argument("--plot", action="store_true", help="сохранить график эквити")
+    args = parser.parse_args()
+    main(since=args.since, plot=args.plot)
@@ -0,0 +1,123 @@
+"""
+broker_session.py
+
+Назначение: Сессия работы с брокером на один торговый прогон.
+Держит один открытый канал Tinkoff Invest API (Client или SandboxClient),
+определённый один раз идентификатор счёта и признак пополнения счёта песочницы,
+поэтому ордер стоит одного обращения к API, а не открытия нового канала,
+поиска счёта и пополнения на каждую сделку.
+
+Используется:
+- trader_executor.py
+- seller.py
+
+Использование:
+    with BrokerSession() as session:
+        session.post_order(figi, quantity, OrderDirection.ORDER_DIRECTION_BUY)
+"""
+
+from decimal import Decimal
+from tinkoff.invest import Client, OrderType
+from tinkoff.invest.sandbox.client import SandboxClient
+from config import TOKEN, SANDBOX_MODE, ACCOUNT_ID, SANDBOX_PAY_IN
+
+
+def money_to_float(value):
+    """MoneyValue / Quotation API → float"""
+    return value.units + value.nano / 1e9
+
+
+class BrokerSession:
+    """
+    Открытый канал API и состояние счёта на время прогона.
+
+    Args:
+        sandbox: работать со счётом песочницы (по умолчанию config.SANDBOX_MODE)
+        account_id: счёт для реального режима; если None — первый счёт пользователя
+    """
+
+    def __init__(self, sandbox=SANDBOX_MODE, account_id=ACCOUNT_ID):
+        self.sandbox = sandbox
+        self.account_id = None if sandbox else account_id
+        self.client = None
+        self.funded = False  # Счёт песочницы уже пополнен в этой сессии
+        self._channel = None
+
+    # === Открытие и закрытие канала ===
+
+    def open(self):
+        """Открывает канал и определяет счёт"""
+        self._channel = SandboxClient(TOKEN) if self.sandbox else Client(TOKEN)
+        self.client = self._channel.__enter__()
+        try:
+            self.account_id = self._resolve_account()
+        except Exception:
+            self.close()
+            raise
+        return self
+
+    def close(self):
+        """Закрывает канал"""
+        if self._channel is not None:
+            self._channel.__exit__(None, None, None)
+        self._channel = None
+        self.client = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _resolve_account(self):
+        if self.sandbox:
+            accounts = self.client.sandbox.get_sandbox_accounts().accounts
+            if accounts:
+                return accounts[0].id
+            return self.client.sandbox.open_sandbox_account().account_id
+        if self.account_id:
+            return self.account_id
+        accounts = self.client.users.get_accounts().accounts
+        if not accounts:
+            raise Exception("Нет активных счетов")
+        return accounts[0].id  # Берём первый счёт
+
+    # === Счёт ===
+
+    def ensure_funded(self):
+        """
+        Пополняет счёт песочницы до SANDBOX_PAY_IN, если денег меньше.
+        Остаток проверяется один раз за сессию; реальный счёт не пополняется.
+        """
+        if not self.sandbox or self.funded:
+            return
+        money = self.client.sandbox.get_sandbox_positions(account_id=self.account_id).money
+        rub = sum(money_to_float(value) for value in money if value.currency.lower() == 'rub')
+        if rub < SANDBOX_PAY_IN:
+            self.client.sandbox.sandbox_pay_in(account_id=self.account_id,
+                                               amount=Decimal(SANDBOX_PAY_IN - int(rub)))
+        self.funded = True
+
+    def get_operations_positions(self):
+        """Позиции из operations.get_operations по счёту сессии"""
+        return self.client.operations.get_operations(account_id=self.account_id).positions
+
+    # === Ордера и цены ===
+
+    def post_order(self, figi, quantity, direction):
+        """Рыночный ордер по счёту сессии"""
+        self.ensure_funded()
+        orders = self.client.sandbox if self.sandbox else self.client.orders
+        return orders.post_order(
+            figi=figi,
+            quantity=quantity,
+            direction=direction,
+            account_id=self.account_id,
+            order_type=OrderType.ORDER_TYPE_MARKET,
+            order_id=str(hash(figi))[:36]
+        )
+
+    def get_last_price(self, figi):
+        """Последняя цена инструмента"""
+        last_price = self.client.market_data.get_last_prices(figi=figi).last_prices[0].price
+        return float(money_to_float(last_price))
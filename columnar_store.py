@@ -0,0 +1,250 @@
+"""
+columnar_store.py
+
+Назначение: Локальное колоночное хранилище котировок для исследований и бэктестов.
+Котировки каждого тикера дублируются из PostgreSQL в отдельный файл Arrow IPC
+({COLUMNAR_STORE['path']}/{interval}/{ticker}.arrow) и обновляются инкрементально:
+последняя свеча файла перечитывается из БД (она могла дописываться потоком или загрузчиком),
+а после изменения истории (recompute_indicators, gap_planner) файл пересобирается целиком.
+Файлы читаются через memory map: числовые колонки возвращаются как массивы NumPy
+без копирования и без преобразования NUMERIC → Decimal.
+
+Требуется пакет pyarrow (pip install pyarrow).
+
+Запуск:
+    python columnar_store.py                 — синхронизировать файлы всех тикеров с БД
+    python columnar_store.py --interval hour
+"""
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from config import TICKERS, COLUMNAR_STORE, CANDLE_INTERVALS
+import quotes_storage
+import db
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:
+    pa = None
+    ipc = None
+
+# Типы колонок в файлах хранилища
+COLUMN_TYPES = {
+    'date': 'datetime64[us]',
+    'open': 'float64',
+    'high': 'float64',
+    'low': 'float64',
+    'close': 'float64',
+    'volume': 'int64',
+    'sma': 'float64',
+    'upper_band': 'float64',
+    'lower_band': 'float64',
+}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("Для колоночного хранилища нужен пакет pyarrow: pip install pyarrow")
+
+
+def store_path(ticker, interval=quotes_storage.DEFAULT_INTERVAL):
+    """Путь к файлу тикера"""
+    return os.path.join(COLUMNAR_STORE['path'], interval.lower(), f"{ticker.lower()}.arrow")
+
+
+def _to_table(df):
+    """
+    Строит таблицу Arrow из DataFrame с приведением к COLUMN_TYPES.
+    Пропуски хранятся как NaN (а не null), чтобы чтение оставалось без копирования.
+    """
+    arrays = {}
+    for column, dtype in COLUMN_TYPES.items():
+        values = df[column]
+        if dtype == 'float64':
+            values = pd.to_numeric(values, errors='coerce')
+        elif dtype == 'int64':
+            values = pd.to_numeric(values, errors='coerce').fillna(0)
+        else:
+            values = pd.to_datetime(values)
+        arrays[column] = pa.array(np.asarray(values, dtype=dtype))
+    return pa.table(arrays)
+
+
+def _open_table(path):
+    """Открывает файл хранилища через memory map (данные не читаются в память целиком)"""
+    source = pa.memory_map(path, 'r')
+    return ipc.open_file(source).read_all()
+
+
+def _read_into_memory(path):
+    """
+    Читает файл хранилища в память без memory map. Используется перед перезаписью файла:
+    в Windows файл, отображённый в память, нельзя заменить через os.replace.
+    """
+    with pa.OSFile(path, 'rb') as source:
+        return ipc.open_file(source).read_all()
+
+
+def read_table(ticker, interval=quotes_storage.DEFAULT_INTERVAL):
+    """Возвращает таблицу Arrow тикера или None, если файла нет"""
+    _require_pyarrow()
+    path = store_path(ticker, interval)
+    if not os.path.exists(path):
+        return None
+    return _open_table(path)
+
+
+def write_table(ticker, table, interval=quotes_storage.DEFAULT_INTERVAL):
+    """Атомарно записывает файл тикера (через временный файл и os.replace)"""
+    path = store_path(ticker, interval)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def merge_frame(ticker, df, interval=quotes_storage.DEFAULT_INTERVAL):
+    """
+    Записывает свечи df в файл тикера: строки файла начиная с первой даты df
+    заменяются свечами df, более ранние остаются.
+
+    Returns:
+        int: количество записанных (добавленных или обновлённых) свечей
+    """
+    _require_pyarrow()
+    if df.empty:
+        return 0
+    table = _to_table(df.sort_values('date'))
+    path = store_path(ticker, interval)
+    if os.path.exists(path):
+        existing = _read_into_memory(path)
+        dates = existing.column('date').to_numpy()
+        keep = int(np.searchsorted(dates, table.column('date').to_numpy()[0], side='left'))
+        # Файл переписывается одной порцией, чтобы чтение оставалось без копирования
+        table = pa.concat_tables([existing.slice(0, keep), table]).combine_chunks()
+        del existing
+    write_table(ticker, table, interval)
+    return len(df)
+
+
+def last_date(ticker, interval=quotes_storage.DEFAULT_INTERVAL):
+    """Дата последней свечи в файле тикера (None, если файла нет или он пуст)"""
+    path = store_path(ticker, interval)
+    if not os.path.exists(path):
+        return None
+    dates = _read_into_memory(path).column('date')
+    return dates[-1].as_py() if len(dates) else None
+
+
+def sync_ticker(conn, ticker, interval=quotes_storage.DEFAULT_INTERVAL, rebuild=False):
+    """
+    Синхронизирует файл тикера с БД: дописывает новые свечи и перечитывает
+    последнюю свечу файла (она могла обновиться после записи).
+
+    Args:
+        rebuild: пересобрать файл по всей истории из БД
+
+    Returns:
+        int: количество записанных свечей
+    """
+    _require_pyarrow()
+    since = None if rebuild else last_date(ticker, interval)
+    if since is None:
+        df = quotes_storage.read_since(conn, ticker, None, interval)
+        if df.empty:
+            return 0
+        write_table(ticker, _to_table(df), interval)
+        return len(df)
+    # lookback=1: вместе с новыми свечами читается и свеча за дату since
+    return merge_frame(ticker, quotes_storage.read_since(conn, ticker, since, interval, lookback=1), interval)
+
+
+def invalidate(conn, ticker, interval=quotes_storage.DEFAULT_INTERVAL):
+    """
+    Пересобирает файл тикера после изменения истории в БД (пересчёт полос,
+    заполнение пропусков), чтобы чтение из хранилища не возвращало устаревшие данные.
+    Если файла нет, ничего не делает.
+    """
+    if pa is None or not os.path.exists(store_path(ticker, interval)):
+        return 0
+    return sync_ticker(conn, ticker, interval, rebuild=True)
+
+
+def read_columns(ticker, columns=None, interval=quotes_storage.DEFAULT_INTERVAL):
+    """
+    Возвращает колонки тикера как массивы NumPy поверх memory map (без копирования).
+
+    Returns:
+        dict: колонка -> np.ndarray (пустой словарь, если файла нет)
+    """
+    table = read_table(ticker, interval)
+    if table is None:
+        return {}
+    columns = columns or list(COLUMN_TYPES)
+    result = {}
+    for column in columns:
+        chunked = table.column(column)
+        if chunked.num_chunks == 1:
+            result[column] = chunked.chunk(0).to_numpy(zero_copy_only=True)
+        else:
+            # Файл, записанный несколькими порциями: колонку приходится склеивать
+            result[column] = chunked.to_numpy()
+    return result
+
+
+def read_frame(ticker, columns=None, interval=quotes_storage.DEFAULT_INTERVAL):
+    """Возвращает котировки тикера как DataFrame (колонки — представления массивов read_columns)"""
+    columns = columns or list(COLUMN_TYPES)
+    return pd.DataFrame(read_columns(ticker, columns, interval), columns=columns)
+
+
+def read_last_n(ticker, n, columns=None, until_today=False, ascending=True,
+                interval=quotes_storage.DEFAULT_INTERVAL):
+    """
+    Аналог quotes_storage.read_last_n для колоночного хранилища.
+    Возвращает последние n свечей тикера (n=None — всю историю).
+    """
+    columns = columns or list(COLUMN_TYPES)
+    df = read_frame(ticker, columns, interval)
+    if until_today and not df.empty:
+        df = df[df['date'] <= pd.Timestamp.now().normalize()]  # как date <= CURRENT_DATE
+    if n is not None:
+        df = df.iloc[-n:]
+    # Копия: DataFrame не держит memory map файла, и его можно перезаписать
+    df = df.copy().reset_index(drop=True)
+    if not ascending:
+        df = df.iloc[::-1].reset_index(drop=True)
+    return df
+
+
+def main(interval=quotes_storage.DEFAULT_INTERVAL):
+    """Синхронизирует файлы всех тикеров с БД"""
+    _require_pyarrow()
+    conn = db.getconn()
+    try:
+        total = 0
+        for ticker in tqdm(TICKERS, desc="Синхронизация колоночного хранилища"):
+            try:
+                added = sync_ticker(conn, ticker, interval)
+            except Exception as e:
+                conn.rollback()
+                tqdm.write(f"[X] Ошибка при синхронизации {ticker}: {e}")
+                continue
+            total += added
+        print(f"[i] Записано {total} свечей в {COLUMNAR_STORE['path']}")
+    finally:
+        db.putconn(conn)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Синхронизация локального колоночного хранилища котировок с БД")
+    parser.add_argument("--interval", choices=list(CANDLE_INTERVALS), default=quotes_storage.DEFAULT_INTERVAL,
+                        help="интервал свечей (по умолчанию day)")
+    args = parser.parse_args()
+    main(interval=args.interval)
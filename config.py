@@ -36,9 +36,21 @@ DB_CONFIG = {
     'port': 5432,
 }
 
+# Пул соединений с БД (db.py)
+DB_POOL = {
+    'min_connections': 4,  # Столько соединений держится открытыми между запросами
+    'max_connections': 10  # Больше соединений не открывается: остальные потоки ждут свободного
+}
+
 # Строка подключения
 DATABASE_URI = f"postgresql://{DB_CONFIG['user']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['dbname']}"
 
+# Схема хранения котировок:
+# 'per_ticker'  — отдельная таблица quotes_{ticker} для каждого тикера
+# 'partitioned' — одна таблица quotes (ticker, date), секционированная по тикеру
+#                 (перенос данных из старых таблиц: python migrate_quotes.py)
+QUOTES_STORAGE = 'per_ticker'
+
 N_DAYS = 120 # Число дней тестирования
 
 # Параметры для Bollinger Bands
@@ -47,10 +59,74 @@ BOLLINGER_CONFIG = {
     'num_std': 2       # Количество стандартных отклонений для полос
 }
 
+# Сетка параметров для param_sweep.py (перебор настроек стратегии на бэктесте)
+PARAM_SWEEP = {
+    'windows': [10, 15, 20, 30, 50],  # Окно SMA полос Боллинджера
+    'num_std': [1.5, 2, 2.5, 3],  # Количество стандартных отклонений
+    'n': [3, 5, 7, 10],  # Окно проверки сигналов (N в signals_processor)
+    'exit_rules': ['sma', 'upper_band']  # ПРОДАЙ: close выше SMA или выше верхней полосы
+}
+
+# Дополнительные индикаторы (indicators.py), хранятся в таблице quote_indicators.
+# Все индикаторы тикера считаются за один проход по ценам.
+INDICATORS = [
+    {'name': 'bb_20_2', 'type': 'bollinger', 'window': 20, 'num_std': 2},
+    {'name': 'bb_50_2_5', 'type': 'bollinger', 'window': 50, 'num_std': 2.5},
+    {'name': 'bb_width_20', 'type': 'band_width', 'window': 20, 'num_std': 2},
+    {'name': 'atr_14', 'type': 'atr', 'window': 14},
+]
+
 # Лимиты запросов к API
 API_LIMITS = {
-    'candles_per_request': 30,  # Дней данных за один запрос
-    'delay_between_requests': 1   # Задержка (секунды) между запросами
+    'delay_between_requests': 1,  # Задержка (секунды) перед повтором при превышении квоты
+    'requests_per_minute': 300,  # Квота брокера на запросы свечей в минуту
+    'max_workers': 8,  # Количество одновременно загружаемых тикеров
+    'max_retries': 5  # Повторов запроса при ответе RESOURCE_EXHAUSTED
+}
+
+# Интервалы свечей: имя → максимальный период одного запроса get_candles (дней)
+CANDLE_INTERVALS = {
+    '1m': 1,
+    '5m': 1,
+    '15m': 1,
+    'hour': 7,
+    'day': 365
+}
+
+# Глубина первой загрузки внутридневных свечей (дней)
+INTRADAY_HISTORY_DAYS = 365
+
+# Загрузчик сохраняет свечи в БД порциями не больше этого числа строк
+LOAD_FLUSH_ROWS = 50_000
+
+# Прерванный запуск загрузчика продолжается, если начат или продолжен не раньше стольких часов назад
+RUN_JOURNAL_RESUME_HOURS = 24
+
+# Потоковая загрузка котировок (market_stream.py)
+STREAM_CONFIG = {
+    'interval': '1m',  # Интервал свечей подписки: '1m' или '5m'
+    'flush_rows': 500,  # Сброс буфера в БД после стольких обновлений свечей
+    'flush_seconds': 10,  # ...или не реже чем раз в столько секунд
+    'reconnect_delay': 5  # Пауза (секунды) перед переподключением при обрыве потока
+}
+
+# Очередь сообщений Telegram (telegram_outbox.py). Лимиты Telegram на один чат:
+# не больше ~1 сообщения в секунду и 20 сообщений в минуту для группы/канала
+TELEGRAM_OUTBOX = {
+    'messages_per_second': 1,
+    'messages_per_minute': 20,
+    'max_attempts': 5,  # После стольких неудачных попыток сообщение получает статус failed
+    'retry_delay': 30,  # Пауза (секунды) перед первым повтором, дальше удваивается
+    'batch_size': 50,  # Сообщений, забираемых из очереди за один запрос
+    'claim_timeout': 600,  # Через сколько секунд сообщение, забранное упавшим отправителем, снова доступно
+    'poll_interval': 5  # Проверка новых сообщений в режиме --watch (секунды)
+}
+
+# Локальное колоночное хранилище котировок (columnar_store.py, файлы Arrow IPC, нужен pyarrow)
+COLUMNAR_STORE = {
+    'enabled': False,  # data_loader дублирует котировки каждого тикера в локальный файл
+    'read': False,  # signals_processor и backtester читают котировки из файлов вместо PostgreSQL
+    'path': 'columnar'  # Каталог хранилища
 }
 
 STARTING_DEPOSIT = 300_000  # Начальный депозит
@@ -62,6 +138,12 @@ COMMISSION = Decimal('0.003')  # теперь это Decimal
 
 ACCOUNT_ID = "92b38166-c110-4801-b7b9-af65b8b3bd28"  # Твой фиксированный ID
 
+# Счёт песочницы пополняется до этой суммы (один раз за торговый прогон, если денег меньше)
+SANDBOX_PAY_IN = 1_000_000
+
 # Максимум акций на одну сделку
 MAX_SHARES_PER_TRADE = 10
 
+
+# Справочник инструментов: сколько часов кэш в БД считается свежим
+INSTRUMENTS_CATALOG_TTL_HOURS = 24
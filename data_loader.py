@@ -10,22 +10,58 @@ data_loader.py
 """
 import sys
 import time
+import argparse
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
-from datetime import datetime, timedelta
-import psycopg2
-from psycopg2 import sql
+from datetime import datetime, timedelta, timezone
 from tinkoff.invest import Client, CandleInterval
 from tinkoff.invest.utils import now
 from tinkoff.invest.exceptions import RequestError
-from psycopg2.extras import execute_batch
-from config import DB_CONFIG, TOKEN, TICKERS
+from config import (TOKEN, TICKERS, API_LIMITS, BOLLINGER_CONFIG, CANDLE_INTERVALS,
+                    INTRADAY_HISTORY_DAYS, LOAD_FLUSH_ROWS, COLUMNAR_STORE, INDICATORS)
+from instruments_catalog import get_instrument, load_catalog
+from rate_limiter import create_api_limiter, call_with_limits
+import quotes_storage
+import columnar_store
+import run_journal
+import indicators
+import migrations
+import db
+
+# Начиная с этого количества строк сохранение идёт через COPY, а не через execute_batch
+BULK_COPY_THRESHOLD = 500
+
+# Соответствие имён интервалов из CANDLE_INTERVALS интервалам API
+API_INTERVALS = {
+    '1m': CandleInterval.CANDLE_INTERVAL_1_MIN,
+    '5m': CandleInterval.CANDLE_INTERVAL_5_MIN,
+    '15m': CandleInterval.CANDLE_INTERVAL_15_MIN,
+    'hour': CandleInterval.CANDLE_INTERVAL_HOUR,
+    'day': CandleInterval.CANDLE_INTERVAL_DAY,
+}
+
+# Длительность свечи для интервалов из CANDLE_INTERVALS
+CANDLE_STEPS = {
+    '1m': timedelta(minutes=1),
+    '5m': timedelta(minutes=5),
+    '15m': timedelta(minutes=15),
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+}
+
+# Начало отсчёта для перевода времени свечей в datetime64
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
 
 def connect():
-    """Подключение к базе данных PostgreSQL"""
-    return psycopg2.connect(**DB_CONFIG)
+    """Соединение из общего пула (вернуть через db.putconn)"""
+    return db.getconn()
 
 def get_figi_for_ticker(client, ticker):
     
@@ -41,11 +77,10 @@ Returns:
     first_candle_date: дата первой доступной свечи
 """
     try:
-        instruments = client.instruments.shares().instruments
-        for instrument in instruments:
-            if instrument.ticker == ticker:
-                print(f"Для тикера {ticker} найдена дата первой свечи: {instrument.first_1day_candle_date}")
-                return instrument.figi, instrument.first_1day_candle_date
+        instrument = get_instrument(ticker, client)
+        if instrument:
+            print(f"Для тикера {ticker} найдена дата первой свечи: {instrument['first_1day_candle_date']}")
+            return instrument['figi'], instrument['first_1day_candle_date']
         print(f"Для тикера {ticker} не найдена информация о первой свече")
         return None, None
     except RequestError as e:
@@ -53,7 +88,7 @@ Returns:
         return None, None
 
 
-def find_earliest_available_date(client, figi, ticker):
+def find_earliest_available_date(client, figi, ticker, limiter=None):
     """
     Ищет самую раннюю доступную дату для получения данных по тикеру.
 
@@ -61,6 +96,7 @@ def find_earliest_available_date(client, figi, ticker):
         client: клиент Tinkoff Invest API
         figi: идентификатор инструмента
         ticker: тикер акции
+        limiter: общий ограничитель частоты запросов (TokenBucket)
 
     Returns:
         date: самая ранняя доступная дата
@@ -70,7 +106,9 @@ def find_earliest_available_date(client, figi, ticker):
     print(f"Поиск самой ранней доступной даты для FIGI {figi} (тикер: {ticker})")
 
     try:
-        candles = client.market_data.get_candles(
+        candles = call_with_limits(
+            limiter,
+            client.market_data.get_candles,
             figi=figi,
             from_=start_date,
             to=start_date + timedelta(days=1),
@@ -86,7 +124,9 @@ def find_earliest_available_date(client, figi, ticker):
     while start_date < end_date:
         mid_date = start_date + (end_date - start_date) // 2
         try:
-            candles = client.market_data.get_candles(
+            candles = call_with_limits(
+                limiter,
+                client.market_data.get_candles,
                 figi=figi,
                 from_=mid_date,
                 to=mid_date + timedelta(days=1),
@@ -108,7 +148,94 @@ def find_earliest_available_date(client, figi, ticker):
     return last_successful_date
 
 
-def get_candles(client, figi, from_date, ticker):
+def split_into_chunks(from_date, end_date, chunk_size):
+    """Разбивает период [from_date, end_date) на отрезки не длиннее chunk_size"""
+    chunks = []
+    current_date = from_date
+    while current_date < end_date:
+        next_date = min(current_date + chunk_size, end_date)
+        chunks.append((current_date, next_date))
+        current_date = next_date
+    return chunks
+
+
+def iter_candle_ranges(client, figi, from_date, interval='day', limiter=None, executor=None, to_date=None):
+    """
+    Загружает свечи за период отрезками и отдаёт их по одному, строго по порядку,
+    вместе с границами отрезка.
+
+    Длина отрезка — максимальный период запроса для интервала (CANDLE_INTERVALS).
+    Если передан executor, одновременно запрашивается не больше API_LIMITS['max_workers']
+    отрезков, поэтому память ограничена несколькими отрезками независимо от глубины истории.
+    Ошибка запроса (RequestError) пробрасывается после отданных до неё отрезков.
+
+    Args:
+        client: клиент Tinkoff Invest API
+        figi: идентификатор инструмента
+        from_date: начальная дата
+        interval: интервал свечей (ключ CANDLE_INTERVALS)
+        limiter: общий ограничитель частоты запросов (TokenBucket)
+        executor: пул потоков для параллельной загрузки отрезков
+        to_date: конечная дата (по умолчанию — текущий момент)
+
+    Yields:
+        tuple: ((начало, конец) отрезка, свечи отрезка)
+    """
+    chunks = iter(split_into_chunks(from_date, to_date or now(), timedelta(days=CANDLE_INTERVALS[interval])))
+
+    def fetch_chunk(chunk):
+        chunk_from, chunk_to = chunk
+        response = call_with_limits(
+            limiter,
+            client.market_data.get_candles,
+            figi=figi,
+            from_=chunk_from,
+            to=chunk_to,
+            interval=API_INTERVALS[interval]
+        )
+        return chunk, response.candles
+
+    if executor is None:
+        for chunk in chunks:
+            yield fetch_chunk(chunk)
+        return
+
+    pending = deque()
+
+    def submit_next():
+        chunk = next(chunks, None)
+        if chunk is not None:
+            pending.append(executor.submit(fetch_chunk, chunk))
+
+    for _ in range(API_LIMITS['max_workers']):
+        submit_next()
+
+    try:
+        while pending:
+            result = pending.popleft().result()
+            submit_next()
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def iter_candle_chunks(client, figi, from_date, interval='day', limiter=None, executor=None, to_date=None):
+    """
+    Как iter_candle_ranges, но отдаёт только свечи отрезков.
+    При ошибке загрузка останавливается: отданы только отрезки до ошибочного.
+
+    Yields:
+        list: свечи очередного отрезка
+    """
+    try:
+        for _, candles in iter_candle_ranges(client, figi, from_date, interval, limiter, executor, to_date):
+            yield candles
+    except RequestError as e:
+        print(f"Ошибка при получении свечей: {e}")
+
+
+def get_candles(client, figi, from_date, ticker, limiter=None, executor=None, interval='day'):
     """
     Загружает исторические данные по свечам за указанный период.
 
@@ -117,35 +244,59 @@ def get_candles(client, figi, from_date, ticker):
         figi: идентификатор инструмента
         from_date: начальная дата
         ticker: тикер акции
+        limiter: общий ограничитель частоты запросов (TokenBucket)
+        executor: пул потоков для параллельной загрузки отрезков
+        interval: интервал свечей (ключ CANDLE_INTERVALS)
 
     Returns:
         candles: список свечей
     """
     all_candles = []
-    current_date = from_date
-    end_date = now()
-    chunk_size = timedelta(days=365)
-
-    while current_date < end_date:
-        try:
-            next_date = min(current_date + chunk_size, end_date)
-            candles = client.market_data.get_candles(
-                figi=figi,
-                from_=current_date,
-                to=next_date,
-                interval=CandleInterval.CANDLE_INTERVAL_DAY
-            )
-            if candles.candles:
-                all_candles.extend(candles.candles)
-            current_date = next_date
-        except RequestError as e:
-            print(f"Ошибка при получении свечей: {e}")
-            break
+    for candles in iter_candle_chunks(client, figi, from_date, interval, limiter, executor):
+        all_candles.extend(candles)
 
     print(f"Всего загружено {len(all_candles)} записей для {ticker}")
     return all_candles
 
 
+def candles_to_arrays(candles):
+    """
+    Преобразует ответ get_candles в колонки NumPy за один проход.
+
+    Целые части (units) и наночасти (nano) цен складываются в заранее выделенные
+    массивы int64 и переводятся во float64 одной векторной операцией.
+
+    Args:
+        candles: список свечей HistoricCandle
+
+    Returns:
+        dict: date (datetime64[us], UTC без часового пояса), open, high, low, close (float64), volume (int64)
+    """
+    count = len(candles)
+    times = np.empty(count, dtype=np.int64)
+    units = np.empty((4, count), dtype=np.int64)
+    nanos = np.empty((4, count), dtype=np.int64)
+    volume = np.empty(count, dtype=np.int64)
+
+    for i, candle in enumerate(candles):
+        times[i] = (candle.time - EPOCH) // MICROSECOND
+        units[0, i], nanos[0, i] = candle.open.units, candle.open.nano
+        units[1, i], nanos[1, i] = candle.high.units, candle.high.nano
+        units[2, i], nanos[2, i] = candle.low.units, candle.low.nano
+        units[3, i], nanos[3, i] = candle.close.units, candle.close.nano
+        volume[i] = candle.volume
+
+    prices = units + nanos / 1e9
+    return {
+        'date': times.astype('datetime64[us]'),
+        'open': prices[0],
+        'high': prices[1],
+        'low': prices[2],
+        'close': prices[3],
+        'volume': volume,
+    }
+
+
 def calculate_bollinger_bands(df, window=20, num_std=2):
     """
     Рассчитывает значения Полос Боллинджера.
@@ -165,187 +316,411 @@ def calculate_bollinger_bands(df, window=20, num_std=2):
     return df
 
 
-def create_table(conn, ticker):
+def calculate_bollinger_bands_incremental(conn, ticker, df, interval='day'):
     """
-    Создаёт таблицу в PostgreSQL для хранения данных по конкретному тикеру.
+    Рассчитывает Полосы Боллинджера только для новых свечей.
+
+    Скользящее окно дополняется последними window - 1 ценами закрытия из БД,
+    поэтому даже одна новая свеча получает корректные полосы, а объём работы
+    на тикер — O(window), а не пересчёт всей истории.
 
     Args:
         conn: соединение с базой данных
         ticker: тикер акции
+        df: DataFrame с новыми свечами, отсортированный по дате
+        interval: интервал свечей
+
+    Returns:
+        df: новые свечи с колонками sma, upper_band, lower_band
     """
-    table_name = f"quotes_{ticker.lower()}"
-    print(f"Создание таблицы {table_name} для тикера {ticker}")
+    window = BOLLINGER_CONFIG['window']
+    first_new_date = df['date'].iloc[0].to_pydatetime().replace(tzinfo=None)
+    try:
+        seed = quotes_storage.get_seed_closes(conn, ticker, first_new_date, window - 1, interval)
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при чтении истории для расчёта полос из {quotes_storage.table_label(ticker, interval)}: {e}")
+        seed = pd.DataFrame(columns=['date', 'close'])
+
+    closes = pd.concat([seed['close'], df['close']], ignore_index=True).to_frame()
+    bands = calculate_bollinger_bands(closes, **BOLLINGER_CONFIG).iloc[len(seed):]
+    for column in ('sma', 'upper_band', 'lower_band'):
+        df[column] = bands[column].to_numpy()
+    return df
 
-    query = sql.SQL("""
-        CREATE TABLE IF NOT EXISTS {} (
-            date TIMESTAMP PRIMARY KEY,
-            open NUMERIC,
-            high NUMERIC,
-            low NUMERIC,
-            close NUMERIC,
-            volume BIGINT,
-            sma NUMERIC,
-            upper_band NUMERIC,
-            lower_band NUMERIC
-        )
-    """).format(sql.Identifier(table_name))
+
+def create_table(conn, ticker, interval='day'):
+    """
+    Создаёт в PostgreSQL хранилище котировок конкретного тикера:
+    отдельную таблицу или секцию общей таблицы quotes (см. QUOTES_STORAGE).
+
+    Args:
+        conn: соединение с базой данных
+        ticker: тикер акции
+        interval: интервал свечей
+    """
+    table_name = quotes_storage.table_label(ticker, interval)
+    print(f"Создание таблицы {table_name} для тикера {ticker}")
 
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(query)
-        conn.commit()
+        quotes_storage.ensure_table(conn, ticker, interval)
         print(f"Таблица {table_name} успешно создана")
     except Exception as e:
+        conn.rollback()
         print(f"Ошибка при создании таблицы: {e}")
 
 
-def save_to_db(conn, ticker, candles):
+def get_last_loaded_date(conn, ticker, interval='day'):
+    """
+    Возвращает дату последней сохранённой свечи (MAX(date)) — «водяной знак» тикера.
+
+    Args:
+        conn: соединение с базой данных
+        ticker: тикер акции
+        interval: интервал свечей
+
+    Returns:
+        datetime: дата последней свечи в UTC или None, если таблица пуста
+    """
+    try:
+        last_date = quotes_storage.get_last_date(conn, ticker, interval)
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при чтении последней даты из {quotes_storage.table_label(ticker, interval)}: {e}")
+        return None
+    if last_date is None:
+        return None
+    # В таблице хранится время UTC без часового пояса
+    return last_date.replace(tzinfo=timezone.utc)
+
+
+def save_to_db(conn, ticker, candles, bulk=None, interval='day', refresh_date=None):
     """
     Сохраняет данные о свечах в PostgreSQL после расчёта индикаторов,
     предварительно проверяя, какие даты уже существуют.
+
+    Args:
+        conn: соединение с базой данных
+        ticker: тикер акции
+        candles: список свечей
+        bulk: True — загрузка через COPY, False — через execute_batch,
+              None — COPY выбирается автоматически начиная с BULK_COPY_THRESHOLD строк
+        interval: интервал свечей
+        refresh_date: дата уже сохранённой свечи, которую нужно перезаписать
+                      (последняя свеча могла быть сохранена незавершённой)
+
+    Returns:
+        bool: False, если сохранить свечи не удалось
     """
     if not candles:
         print(f"Нет данных для сохранения для тикера {ticker}")
-        return
+        return True
 
-    table_name = f"quotes_{ticker.lower()}"
+    table_name = quotes_storage.table_label(ticker, interval)
     
-    # Получаем список дат, уже существующих в БД
+    # Колоночное представление свечей: одна проходка по ответу API, без словаря на каждую свечу
+    arrays = candles_to_arrays(candles)
+
+    # Получаем список дат, уже существующих в БД, только в пределах загруженного диапазона
+    first_candle_time = pd.Timestamp(arrays['date'].min()).to_pydatetime()
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(sql.SQL("SELECT date FROM {}").format(sql.Identifier(table_name)))
-            existing_dates = set(row[0] for row in cursor.fetchall())
+        existing_dates = np.array(quotes_storage.get_dates_since(conn, ticker, first_candle_time, interval),
+                                  dtype='datetime64[us]')
     except Exception as e:
+        conn.rollback()
         print(f"Ошибка при чтении существующих дат: {e}")
-        existing_dates = set()
-
-    # Преобразование в DataFrame
-    data = []
-    for candle in candles:
-        if candle.time in existing_dates:
-            continue  # Пропускаем, если такая дата уже есть
-        data.append({
-            'date': candle.time,
-            'open': float(candle.open.units + candle.open.nano / 1e9),
-            'high': float(candle.high.units + candle.open.nano / 1e9),
-            'low': float(candle.low.units + candle.low.nano / 1e9),
-            'close': float(candle.close.units + candle.close.nano / 1e9),
-            'volume': int(candle.volume)
-        })
-
-    if not data:
+        existing_dates = np.array([], dtype='datetime64[us]')
+
+    # Пропускаем даты, которые уже есть в БД, кроме перезаписываемой свечи
+    is_new = ~np.isin(arrays['date'], existing_dates)
+    refresh_key = None
+    if refresh_date is not None:
+        refresh_key = np.datetime64(refresh_date.replace(tzinfo=None), 'us')
+        is_new |= arrays['date'] == refresh_key
+    if not is_new.any():
         print(f"Нет новых данных для тикера {ticker}, все записи уже в БД")
-        return
+        return True
 
-    df = pd.DataFrame(data)
-    df = calculate_bollinger_bands(df)
-    if 'std' in df.columns:
-        df.drop(columns=['std'], inplace=True)
-    df.dropna(inplace=True)
-
-    # Подготовка данных для вставки
-    records = df.to_records(index=False)
-    data_to_insert = [
-        tuple(
-            None if pd.isna(x) else (
-                int(x) if isinstance(x, np.integer) else
-                float(x) if isinstance(x, np.floating) else x
-            )
-            for x in row
-        )
-        for row in records
-    ]
+    df = pd.DataFrame({column: values[is_new] for column, values in arrays.items()})
+    df = df.sort_values('date').reset_index(drop=True)
+    df = calculate_bollinger_bands_incremental(conn, ticker, df, interval)
+    # Без полного окна истории полосы не определены: такие свечи есть только в самом начале истории тикера
+    df.dropna(subset=['sma', 'upper_band', 'lower_band'], inplace=True)
+
+    is_refreshed = (df['date'] == refresh_key).to_numpy() if refresh_key is not None \
+        else np.zeros(len(df), dtype=bool)
+    new_df = df[~is_refreshed]
 
-    print(f"Сохранение {len(data_to_insert)} новых записей в таблицу {table_name}")
+    print(f"Сохранение {len(new_df)} новых записей в таблицу {table_name}")
     try:
-        with conn.cursor() as cursor:
-            insert_query = sql.SQL("""
-                INSERT INTO {}
-                (date, open, high, low, close, volume, sma, upper_band, lower_band)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (date) DO NOTHING
-            """).format(sql.Identifier(table_name))
-            execute_batch(cursor, insert_query, data_to_insert, page_size=500)
+        if is_refreshed.any():
+            quotes_storage.insert_frame(conn, ticker, df[is_refreshed], interval, upsert=True)
+        if not new_df.empty:
+            if bulk or (bulk is None and len(new_df) >= BULK_COPY_THRESHOLD):
+                quotes_storage.copy_frame(conn, ticker, new_df, interval)
+            else:
+                quotes_storage.insert_frame(conn, ticker, new_df, interval)
         conn.commit()
         print(f"Новые данные для {ticker} успешно сохранены")
+        return True
     except Exception as e:
+        conn.rollback()
         print(f"Ошибка при сохранении данных: {e}")
+        return False
+
+
+def load_ticker(client, ticker, full, limiter, chunk_executor, interval='day', run_id=None, resume_from=None):
+    """
+    Загружает и сохраняет свечи одного тикера.
+    Выполняется в потоке пула тикеров, поэтому использует собственное соединение с БД.
+
+    Свечи сохраняются порциями по LOAD_FLUSH_ROWS строк по мере загрузки отрезков,
+    поэтому глубокая внутридневная история не накапливается в памяти целиком.
+    Сохранённые отрезки отмечаются в журнале запуска run_id.
+
+    Args:
+        client: клиент Tinkoff Invest API
+        ticker: тикер акции
+        full: полная перезагрузка истории
+        limiter: общий ограничитель частоты запросов (TokenBucket)
+        chunk_executor: пул потоков для параллельной загрузки отрезков
+        interval: интервал свечей (ключ CANDLE_INTERVALS)
+        run_id: id запуска в журнале (None — без журнала)
+        resume_from: конец последнего сохранённого отрезка прерванного запуска
+
+    Returns:
+        str: статус тикера в журнале — done (загружен полностью), failed (временная ошибка,
+             запуск будет продолжен) или skipped (тикер загрузить невозможно)
+    """
+    print(f"\nНачинаем обработку тикера {ticker}")
+
+    conn = connect()
+    try:
+        if run_id is not None:
+            run_journal.start_ticker(conn, run_id, ticker)
+
+        # Получаем FIGI и дату первой свечи для тикера
+        figi, first_candle_date = get_figi_for_ticker(client, ticker)
+        if not figi:
+            tqdm.write(f"FIGI не найден для тикера {ticker}, пропускаем...")
+            if run_id is not None:
+                run_journal.finish_ticker(conn, run_id, ticker, run_journal.STATUS_SKIPPED, "FIGI не найден")
+            return run_journal.STATUS_SKIPPED
+
+        # Создаем таблицу в БД
+        create_table(conn, ticker, interval)
+
+        # Инкрементальный режим: продолжаем с последней сохранённой свечи
+        last_loaded_date = None if full else get_last_loaded_date(conn, ticker, interval)
+        if last_loaded_date:
+            # Последняя свеча запрашивается повторно и перезаписывается: она могла быть сохранена незавершённой
+            earliest_date = last_loaded_date
+            tqdm.write(f"Тикер {ticker}: инкрементальная загрузка с {earliest_date}")
+        else:
+            # Определяем самую раннюю доступную дату
+            if first_candle_date:
+                earliest_date = first_candle_date
+                print(f"Используем дату первой свечи из информации об инструменте: {earliest_date}")
+            else:
+                print("Дата первой свечи не найдена, выполняем поиск...")
+                earliest_date = find_earliest_available_date(client, figi, ticker, limiter)
+                if not earliest_date:
+                    tqdm.write(f"Не удалось определить начальную дату для {ticker}, пропускаем...")
+                    if run_id is not None:
+                        run_journal.finish_ticker(conn, run_id, ticker, run_journal.STATUS_SKIPPED,
+                                                  "не определена начальная дата")
+                    return run_journal.STATUS_SKIPPED
+                print(f"Найдена самая ранняя доступная дата: {earliest_date}")
+
+            # Внутридневная история ограничена глубиной INTRADAY_HISTORY_DAYS
+            if interval != 'day':
+                earliest_date = max(earliest_date, now() - timedelta(days=INTRADAY_HISTORY_DAYS))
+
+            tqdm.write(f"Тикер {ticker}: загрузка данных ({interval}) с {earliest_date}")
+
+        # Прерванный запуск продолжается с отрезка, на котором остановился
+        if resume_from and resume_from > earliest_date:
+            earliest_date = resume_from
+            tqdm.write(f"Тикер {ticker}: продолжение прерванной загрузки с {earliest_date}")
+
+        # Загружаем свечи отрезками и сохраняем в БД порциями
+        bulk = True if full or not last_loaded_date else None
+        buffer = []
+        buffered_chunks = []
+        total = 0
+
+        def flush():
+            nonlocal buffer, buffered_chunks, total
+            if buffer and not save_to_db(conn, ticker, buffer, bulk=bulk, interval=interval,
+                                         refresh_date=last_loaded_date):
+                raise RuntimeError(f"не удалось сохранить свечи тикера {ticker}")
+            total += len(buffer)
+            if run_id is not None:
+                run_journal.complete_chunks(conn, run_id, ticker, buffered_chunks)
+            buffer, buffered_chunks = [], []
+
+        error = None
+        try:
+            for (chunk_from, chunk_to), candles in iter_candle_ranges(
+                    client, figi, earliest_date, interval, limiter, chunk_executor):
+                buffer.extend(candles)
+                buffered_chunks.append((chunk_from, chunk_to, len(candles)))
+                if len(buffer) >= LOAD_FLUSH_ROWS:
+                    flush()
+        except RequestError as e:
+            # Отрезки до ошибочного сохраняются, следующий запуск продолжит с ошибочного
+            tqdm.write(f"Ошибка при получении свечей для {ticker}: {e}")
+            error = str(e)
+        flush()
+
+        tqdm.write(f"Тикер {ticker}: сохранено {total} записей")
+
+        # Дублируем новые свечи в локальное колоночное хранилище
+        if COLUMNAR_STORE['enabled']:
+            added = columnar_store.sync_ticker(conn, ticker, interval)
+            tqdm.write(f"Тикер {ticker}: в колоночное хранилище записано {added} свечей")
+
+        # Досчитываем дополнительные индикаторы по новым свечам
+        if INDICATORS:
+            saved = indicators.update_ticker(conn, ticker, interval)
+            tqdm.write(f"Тикер {ticker}: сохранено {saved} значений индикаторов")
+
+        status = run_journal.STATUS_FAILED if error else run_journal.STATUS_DONE
+        if run_id is not None:
+            run_journal.finish_ticker(conn, run_id, ticker, status, error)
+        return status
+    except Exception as e:
+        if run_id is not None:
+            try:
+                conn.rollback()
+                run_journal.finish_ticker(conn, run_id, ticker, run_journal.STATUS_FAILED, str(e))
+            except Exception:
+                pass
+        raise
+    finally:
+        db.putconn(conn)
+
 
-def main():
+def current_candle_start(interval='day'):
+    """Начало текущей (незавершённой) свечи интервала в UTC"""
+    step = CANDLE_STEPS[interval]
+    return EPOCH + (now() - EPOCH) // step * step
+
+
+def is_ticker_loaded(state, fetch_end):
+    """
+    Тикер прерванного запуска можно пропустить: он загружен полностью
+    и его контрольная точка не раньше fetch_end (начала текущей свечи).
+    """
+    return (state.get('status') == run_journal.STATUS_DONE and state.get('checkpoint') is not None
+            and state['checkpoint'] >= fetch_end)
+
+
+def run(full=False, interval='day'):
+    """
+    Основная функция запуска процесса загрузки данных (этап конвейера main.py).
+
+    Тикеры обрабатываются параллельно в пуле из API_LIMITS['max_workers'] потоков,
+    общая частота запросов ограничивается токен-бакетом по API_LIMITS.
+    Ход загрузки пишется в журнал запусков (run_journal): прерванный запуск
+    с теми же параметрами продолжается, тикеры, загруженные до текущей свечи, пропускаются.
+
+    Args:
+        full: полная перезагрузка истории с даты первой свечи.
+              По умолчанию загружаются только свечи после последней сохранённой даты.
+        interval: интервал свечей (ключ CANDLE_INTERVALS)
+
+    Returns:
+        bool: True, если загружены все тикеры
     """
-    Основная функция запуска процесса загрузки данных.
-    """    
     start_time = time.time()
     
     # Проверка токена
     if not TOKEN or TOKEN == 'TOKEN':
         print("ОШИБКА: Необходимо указать токен API Тинькофф Инвестиций!")
-        return
+        return False
 
-    # Подключение к PostgreSQL
+    # Проверка подключения к PostgreSQL и подготовка общей схемы котировок
     try:
         print("Подключение к PostgreSQL...")
-        conn = psycopg2.connect(**DB_CONFIG)
+        conn = connect()
+        quotes_storage.ensure_schema(conn, interval)
+        migrations.ensure_schema(conn)
+        run_id, resumed = run_journal.start_run(conn, interval, full)
+        progress = run_journal.get_progress(conn, run_id) if resumed else {}
+        db.putconn(conn)
         print("Успешное подключение к PostgreSQL")
     except Exception as e:
         print(f"Ошибка подключения к PostgreSQL: {e}")
-        return
+        return False
+
+    fetch_end = current_candle_start(interval)
+    tickers = [ticker for ticker in TICKERS if not is_ticker_loaded(progress.get(ticker, {}), fetch_end)]
+    if resumed:
+        print(f"[i] Продолжение прерванного запуска #{run_id}: "
+              f"загружено {len(TICKERS) - len(tickers)} из {len(TICKERS)} тикеров")
 
     # Подключение к API Тинькофф
+    failed = len(tickers)
+    skipped = []
     try:
         print("Подключение к API Тинькофф Инвестиций...")
         with Client(TOKEN) as client:
             print("Успешное подключение к API Тинькофф")
-            for ticker in tqdm(TICKERS, desc="Обработка тикеров"):
-                try:
-                    print(f"\nНачинаем обработку тикера {ticker}")
-
-                    # Получаем FIGI и дату первой свечи для тикера
-                    figi, first_candle_date = get_figi_for_ticker(client, ticker)
-                    if not figi:
-                        tqdm.write(f"FIGI не найден для тикера {ticker}, пропускаем...")
-                        continue
-
-                    # Определяем самую раннюю доступную дату
-                    if first_candle_date:
-                        earliest_date = first_candle_date
-                        print(f"Используем дату первой свечи из информации об инструменте: {earliest_date}")
-                    else:
-                        print("Дата первой свечи не найдена, выполняем поиск...")
-                        earliest_date = find_earliest_available_date(client, figi, ticker)
-                        if not earliest_date:
-                            tqdm.write(f"Не удалось определить начальную дату для {ticker}, пропускаем...")
-                            continue
-                        print(f"Найдена самая ранняя доступная дата: {earliest_date}")
-
-                    tqdm.write(f"Тикер {ticker}: загрузка данных с {earliest_date}")
-
-                    # Создаем таблицу в БД
-                    create_table(conn, ticker)
-
-                    # Получаем все свечи
-                    candles = get_candles(client, figi, earliest_date, ticker)
-
-                    # Сохраняем в БД
-                    save_to_db(conn, ticker, candles)
-
-                    tqdm.write(f"Тикер {ticker}: сохранено {len(candles)} записей")
-
-                except Exception as e:
-                    tqdm.write(f"Ошибка при обработке тикера {ticker}: {str(e)}")
-                    continue
+            # Справочник инструментов загружается один раз на весь запуск
+            load_catalog(client)
+
+            limiter = create_api_limiter()
+            max_workers = API_LIMITS['max_workers']
+            with ThreadPoolExecutor(max_workers=max_workers) as ticker_executor, \
+                    ThreadPoolExecutor(max_workers=max_workers) as chunk_executor:
+                # Инкрементальная загрузка и так продолжается с последней сохранённой свечи
+                # (и перезаписывает её), контрольная точка нужна только полной перезагрузке
+                futures = {
+                    ticker_executor.submit(load_ticker, client, ticker, full, limiter, chunk_executor, interval,
+                                           run_id, progress.get(ticker, {}).get('checkpoint') if full else None): ticker
+                    for ticker in tickers
+                }
+                for future in tqdm(as_completed(futures), total=len(futures), desc="Обработка тикеров"):
+                    ticker = futures[future]
+                    try:
+                        status = future.result()
+                        if status != run_journal.STATUS_FAILED:
+                            failed -= 1
+                        if status == run_journal.STATUS_SKIPPED:
+                            skipped.append(ticker)
+                    except Exception as e:
+                        tqdm.write(f"Ошибка при обработке тикера {ticker}: {str(e)}")
 
     except Exception as e:
         print(f"Ошибка подключения к API Тинькофф: {e}")
 
-    # Закрываем соединение с БД
-    print("Закрытие соединения с PostgreSQL")
-    conn.close()
+    # Запуск с тикерами, прерванными временной ошибкой, продолжится при следующем запуске;
+    # тикеры, которые загрузить нельзя (skipped), запуск продолжаемым не делают
+    try:
+        conn = connect()
+        run_journal.finish_run(conn, run_id, run_journal.STATUS_INTERRUPTED if failed else run_journal.STATUS_DONE)
+        db.putconn(conn)
+    except Exception as e:
+        print(f"Ошибка при записи журнала запуска: {e}")
+    if skipped:
+        print(f"[W] Пропущены тикеры, которые невозможно загрузить: {', '.join(sorted(skipped))}")
+    if failed:
+        print(f"[W] Не загружено тикеров: {failed}, запуск #{run_id} будет продолжен при следующем запуске")
+
     print("Готово!")
 
     # Время выполнения
     exec_time = time.time() - start_time
     print(f"\n Все задачи выполнены за {exec_time:.2f} секунд")
+    return failed == 0 and not skipped
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Загрузка котировок из Tinkoff Invest API в PostgreSQL")
+    parser.add_argument("--full", action="store_true",
+                        help="полная перезагрузка истории вместо загрузки после последней сохранённой даты")
+    parser.add_argument("--interval", choices=list(CANDLE_INTERVALS), default='day',
+                        help="интервал свечей (по умолчанию day)")
+    args = parser.parse_args()
+    run(full=args.full, interval=args.interval)
+    db.print_pool_stats()
\ No newline at end of file
@@ -0,0 +1,129 @@
+"""
+db.py
+
+Назначение: Общий пул соединений с PostgreSQL для всех модулей.
+Вместо psycopg2.connect(**DB_CONFIG) на каждый запрос соединения берутся
+из ограниченного пула (DB_POOL) и возвращаются в него после работы.
+Если все соединения заняты, поток ждёт освобождения; время ожидания
+и число занятых соединений собираются в статистику пула.
+
+Использование:
+    with db.transaction() as conn:   — транзакция: COMMIT в конце блока, ROLLBACK при исключении
+        ...
+    with db.connection() as conn:    — соединение без автоматического COMMIT
+        ...
+    conn = db.getconn() ... db.putconn(conn)  — для долгих соединений (загрузка тикера)
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool
+from config import DB_CONFIG, DB_POOL
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(DB_POOL['max_connections'])
+
+# Статистика пула
+_stats_lock = threading.Lock()
+_stats = {
+    'acquired': 0,  # Выдано соединений
+    'in_use': 0,  # Занято сейчас
+    'peak_in_use': 0,  # Максимум одновременно занятых
+    'wait_total': 0.0,  # Суммарное ожидание свободного соединения, с
+    'wait_max': 0.0,  # Наибольшее ожидание, с
+}
+
+
+def get_pool():
+    """
+    Возвращает пул соединений процесса, создавая его при первом обращении.
+    В дочернем процессе (ProcessPoolExecutor) создаётся собственный пул:
+    соединения родителя через fork не используются.
+    """
+    global _pool, _pool_pid, _slots
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadedConnectionPool(DB_POOL['min_connections'], DB_POOL['max_connections'], **DB_CONFIG)
+            _pool_pid = os.getpid()
+            _slots = threading.BoundedSemaphore(DB_POOL['max_connections'])
+        return _pool
+
+
+def getconn():
+    """Берёт соединение из пула; если свободных нет — ждёт"""
+    pool = get_pool()
+    started = time.perf_counter()
+    _slots.acquire()
+    waited = time.perf_counter() - started
+    try:
+        conn = pool.getconn()
+    except Exception:
+        _slots.release()
+        raise
+    with _stats_lock:
+        _stats['acquired'] += 1
+        _stats['in_use'] += 1
+        _stats['peak_in_use'] = max(_stats['peak_in_use'], _stats['in_use'])
+        _stats['wait_total'] += waited
+        _stats['wait_max'] = max(_stats['wait_max'], waited)
+    return conn
+
+
+def putconn(conn):
+    """Возвращает соединение в пул (незавершённая транзакция откатывается пулом)"""
+    try:
+        get_pool().putconn(conn, close=conn.closed != 0)
+    finally:
+        with _stats_lock:
+            _stats['in_use'] -= 1
+        _slots.release()
+
+
+@contextmanager
+def connection():
+    """Соединение из пула на время блока with"""
+    conn = getconn()
+    try:
+        yield conn
+    finally:
+        putconn(conn)
+
+
+@contextmanager
+def transaction():
+    """Транзакция на соединении из пула: COMMIT в конце блока, ROLLBACK при исключении"""
+    with connection() as conn:
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def pool_stats():
+    """Возвращает копию статистики пула"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def print_pool_stats():
+    """Печатает статистику пула"""
+    stats = pool_stats()
+    average_wait = stats['wait_total'] / stats['acquired'] if stats['acquired'] else 0
+    print(f"[i] Пул соединений: выдано {stats['acquired']}, занято {stats['in_use']}, "
+          f"максимум одновременно {stats['peak_in_use']} из {DB_POOL['max_connections']}, "
+          f"ожидание среднее {average_wait * 1000:.1f} мс, максимальное {stats['wait_max'] * 1000:.1f} мс")
+
+
+def close_pool():
+    """Закрывает все соединения пула"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
@@ -0,0 +1,185 @@
+"""
+gap_planner.py
+
+Назначение: Поиск и заполнение пропусков в дневных котировках.
+Если отрезок в get_candles завершился ошибкой, загрузка идёт дальше и в таблице
+остаётся дыра, которую инкрементальная загрузка (она продолжает с последней даты) не видит.
+
+Планировщик сравнивает даты каждого тикера с торговым календарём MOEX,
+собирает пропущенные дни в диапазоны, объединяет близкие диапазоны в запросы
+не длиннее CANDLE_INTERVALS['day'] дней и запрашивает только их.
+Число запросов к API пропорционально числу пропусков, а не длине истории.
+
+Торговый календарь строится по данным в БД: торговым считается день,
+за который есть свеча хотя бы у одного тикера из TICKERS.
+
+Запуск:
+    python gap_planner.py            — найти и заполнить пропуски
+    python gap_planner.py --dry-run  — только отчёт о пропусках
+"""
+
+import argparse
+from datetime import datetime, timezone
+import numpy as np
+from tinkoff.invest import Client
+from config import TOKEN, TICKERS, CANDLE_INTERVALS
+from instruments_catalog import get_figi, load_catalog
+from rate_limiter import create_api_limiter
+from data_loader import iter_candle_chunks, save_to_db
+from recompute_indicators import recompute_ticker
+import quotes_storage
+import indicators
+import db
+
+INTERVAL = 'day'
+
+
+def connect():
+    """Соединение из общего пула (вернуть через db.putconn)"""
+    return db.getconn()
+
+
+def load_trading_days(conn, tickers):
+    """
+    Читает дни со свечами по каждому тикеру и строит торговый календарь.
+
+    Returns:
+        tuple: (dict тикер -> np.ndarray дней datetime64[D], np.ndarray торговых дней)
+    """
+    days_by_ticker = {}
+    for ticker in tickers:
+        try:
+            dates = quotes_storage.get_dates(conn, ticker, INTERVAL)
+        except Exception as e:
+            conn.rollback()
+            print(f"[W] {ticker}: не удалось прочитать даты котировок: {e}")
+            continue
+        days_by_ticker[ticker] = np.unique(np.array(dates, dtype='datetime64[D]'))
+    if days_by_ticker:
+        calendar = np.unique(np.concatenate(list(days_by_ticker.values())))
+    else:
+        calendar = np.array([], dtype='datetime64[D]')
+    return days_by_ticker, calendar
+
+
+def find_gaps(days, calendar):
+    """
+    Находит пропущенные торговые дни между первой и последней свечой тикера.
+
+    Args:
+        days: дни со свечами тикера (отсортированы)
+        calendar: торговые дни (отсортированы)
+
+    Returns:
+        list: диапазоны (первый пропущенный день, последний пропущенный день)
+    """
+    if len(days) == 0:
+        return []
+    calendar = calendar[(calendar >= days[0]) & (calendar <= days[-1])]
+    missing = np.flatnonzero(~np.isin(calendar, days))
+    if len(missing) == 0:
+        return []
+    # Диапазон — серия подряд идущих торговых дней календаря
+    breaks = np.flatnonzero(np.diff(missing) > 1)
+    starts = np.concatenate(([missing[0]], missing[breaks + 1]))
+    ends = np.concatenate((missing[breaks], [missing[-1]]))
+    return [(calendar[start], calendar[end]) for start, end in zip(starts, ends)]
+
+
+def count_missing_days(gaps, calendar):
+    """Считает торговые дни в диапазонах пропусков"""
+    return sum(int(np.count_nonzero((calendar >= start) & (calendar <= end))) for start, end in gaps)
+
+
+def plan_requests(gaps, max_days=CANDLE_INTERVALS[INTERVAL]):
+    """
+    Объединяет диапазоны пропусков в запросы не длиннее max_days дней.
+
+    Returns:
+        list: периоды запросов (from, to) в UTC, to не включается
+    """
+    requests = []
+    for start, end in gaps:
+        if requests and (end - requests[-1][0]).astype(int) < max_days:
+            requests[-1][1] = end
+        else:
+            requests.append([start, end])
+    return [(_to_utc(start), _to_utc(end + np.timedelta64(1, 'D'))) for start, end in requests]
+
+
+def _to_utc(day):
+    return datetime.fromisoformat(str(day)).replace(tzinfo=timezone.utc)
+
+
+def fill_gaps(client, conn, ticker, figi, requests, limiter):
+    """Загружает свечи за запланированные периоды и сохраняет отсутствующие в БД"""
+    for from_date, to_date in requests:
+        for candles in iter_candle_chunks(client, figi, from_date, INTERVAL, limiter, to_date=to_date):
+            if candles:
+                save_to_db(conn, ticker, candles, bulk=False, interval=INTERVAL)
+
+
+def main(dry_run=False, tickers=None):
+    """
+    Находит пропуски по всем тикерам, заполняет их и печатает отчёт.
+
+    Args:
+        dry_run: только отчёт о найденных пропусках, без запросов к API
+        tickers: список тикеров (по умолчанию TICKERS)
+    """
+    tickers = tickers or TICKERS
+    conn = connect()
+    try:
+        days_by_ticker, calendar = load_trading_days(conn, tickers)
+        print(f"[i] Торговый календарь: {len(calendar)} дней")
+
+        plans = {}
+        for ticker, days in days_by_ticker.items():
+            gaps = find_gaps(days, calendar)
+            if gaps:
+                plans[ticker] = gaps
+                print(f"[W] {ticker}: {len(gaps)} пропусков, {count_missing_days(gaps, calendar)} торговых дней")
+
+        if not plans:
+            print("[i] Пропусков не найдено")
+            return
+        if dry_run:
+            return
+
+        limiter = create_api_limiter()
+        report = []
+        with Client(TOKEN) as client:
+            load_catalog(client)
+            for ticker, gaps in plans.items():
+                figi = get_figi(ticker)
+                if not figi:
+                    print(f"[W] FIGI не найден для тикера {ticker}, пропускаем...")
+                    continue
+                requests = plan_requests(gaps)
+                fill_gaps(client, conn, ticker, figi, requests, limiter)
+
+                # Свечи после заполненных дней считались без них: полосы пересчитываются заново,
+                # там же пересобирается файл колоночного хранилища (заполненные свечи лежат
+                # в середине истории и при дописывании в файл не попадают)
+                recompute_ticker(ticker, INTERVAL)
+                # Значения config.INDICATORS пересчитываются с первого заполненного дня
+                indicators.update_ticker(conn, ticker, INTERVAL, start=datetime.fromisoformat(str(gaps[0][0])))
+
+                days = np.unique(np.array(quotes_storage.get_dates(conn, ticker, INTERVAL), dtype='datetime64[D]'))
+                missing = count_missing_days(gaps, calendar)
+                remaining = count_missing_days(find_gaps(days, calendar), calendar)
+                report.append((ticker, len(gaps), missing, len(requests), remaining))
+
+        print("\n[i] Отчёт о пропусках:")
+        for ticker, gap_count, missing, request_count, remaining in report:
+            print(f"    {ticker}: пропусков {gap_count} ({missing} дней), запросов {request_count}, "
+                  f"заполнено дней {missing - remaining}, осталось {remaining}")
+    finally:
+        db.putconn(conn)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Поиск и заполнение пропусков в дневных котировках")
+    parser.add_argument("--dry-run", action="store_true", help="только отчёт о пропусках, без загрузки")
+    args = parser.parse_args()
+    main(dry_run=args.dry_run)
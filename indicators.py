@@ -0,0 +1,297 @@
+"""
+indicators.py
+
+Назначение: Реестр индикаторов, которые считаются за один проход по ценам тикера.
+Набор индикаторов задаётся в config.INDICATORS (несколько конфигураций Полос Боллинджера,
+ширина полос, ATR и т.д.), результаты хранятся в таблице quote_indicators
+(ticker, interval, date, indicator, value).
+
+Скользящие средние и стандартные отклонения всех индикаторов берутся из общих
+накопленных сумм (RollingWindows), поэтому индикаторы с одинаковым окном
+не пересчитывают их заново, а добавление индикатора не требует отдельного прохода по истории.
+
+Новый тип индикатора регистрируется декоратором register_indicator.
+
+Запуск:
+    python indicators.py                 — досчитать индикаторы по всем тикерам
+    python indicators.py --interval hour
+"""
+
+import argparse
+import io
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from config import TICKERS, INDICATORS, CANDLE_INTERVALS
+import quotes_storage
+import migrations
+import db
+
+# Реестр: тип индикатора -> (функция расчёта, суффиксы выходных колонок или None для одной колонки)
+INDICATOR_TYPES = {}
+
+
+def register_indicator(kind, outputs=None):
+    """
+    Регистрирует тип индикатора.
+
+    Функция расчёта получает RollingWindows и параметры из config.INDICATORS
+    и возвращает массив (одна колонка) или словарь суффикс -> массив.
+    """
+    def decorator(func):
+        INDICATOR_TYPES[kind] = (func, outputs)
+        return func
+    return decorator
+
+
+def output_columns(spec):
+    """Имена колонок, которые даёт индикатор"""
+    _, outputs = INDICATOR_TYPES[spec['type']]
+    if outputs is None:
+        return [spec['name']]
+    return [f"{spec['name']}_{suffix}" for suffix in outputs]
+
+
+def max_window(specs=INDICATORS):
+    """Наибольшее окно среди индикаторов (глубина истории для инкрементального расчёта)"""
+    return max((spec.get('window', 1) for spec in specs), default=1)
+
+
+class RollingWindows:
+    """
+    Общие скользящие суммы по ценам тикера.
+
+    Накопленные суммы значений и их квадратов считаются один раз на ряд,
+    средние и стандартные отклонения по каждому окну кэшируются.
+    Цены центрируются на первое значение, чтобы разность сумм не теряла точность.
+    """
+
+    def __init__(self, close, high=None, low=None):
+        self.series = {'close': np.asarray(close, dtype='float64')}
+        if high is not None and low is not None:
+            self.series['high'] = np.asarray(high, dtype='float64')
+            self.series['low'] = np.asarray(low, dtype='float64')
+        self.length = len(self.series['close'])
+        self._cumsums = {}
+        self._cache = {}
+
+    def true_range(self):
+        """Истинный диапазон: max(high - low, |high - close[-1]|, |low - close[-1]|)"""
+        if 'true_range' not in self.series:
+            high, low, close = self.series['high'], self.series['low'], self.series['close']
+            prev_close = np.concatenate(([np.nan], close[:-1]))
+            ranges = np.vstack((high - low, np.abs(high - prev_close), np.abs(low - prev_close)))
+            true_range = np.nanmax(ranges, axis=0)
+            true_range[0] = np.nan  # Для первой свечи нет предыдущего закрытия
+            self.series['true_range'] = true_range
+        return self.series['true_range']
+
+    def _sums(self, name):
+        if name not in self._cumsums:
+            values = self.series[name]
+            offset = values[np.isfinite(values)][0] if np.isfinite(values).any() else 0.0
+            centred = np.nan_to_num(values - offset, nan=0.0)
+            self._cumsums[name] = (
+                offset,
+                np.concatenate(([0.0], np.cumsum(centred))),
+                np.concatenate(([0.0], np.cumsum(centred * centred))),
+                np.concatenate(([0], np.cumsum(~np.isfinite(values)))),
+            )
+        return self._cumsums[name]
+
+    def _window_sums(self, name, window):
+        offset, s1, s2, gaps = self._sums(name)
+        result = np.full(self.length, np.nan), np.full(self.length, np.nan)
+        if window > self.length:
+            return offset, result
+        sum1 = s1[window:] - s1[:-window]
+        sum2 = s2[window:] - s2[:-window]
+        # Окна с пропусками (NaN) не считаются
+        has_gap = (gaps[window:] - gaps[:-window]) > 0
+        sum1[has_gap] = np.nan
+        sum2[has_gap] = np.nan
+        result[0][window - 1:] = sum1
+        result[1][window - 1:] = sum2
+        return offset, result
+
+    def mean(self, window, name='close'):
+        """Скользящее среднее ряда name"""
+        key = ('mean', name, window)
+        if key not in self._cache:
+            offset, (sum1, _) = self._window_sums(name, window)
+            self._cache[key] = sum1 / window + offset
+        return self._cache[key]
+
+    def std(self, window, name='close'):
+        """Скользящее стандартное отклонение (ddof=1, как rolling().std() в pandas)"""
+        key = ('std', name, window)
+        if key not in self._cache:
+            _, (sum1, sum2) = self._window_sums(name, window)
+            variance = (sum2 - sum1 * sum1 / window) / (window - 1)
+            self._cache[key] = np.sqrt(np.clip(variance, 0.0, None))
+        return self._cache[key]
+
+
+# === Типы индикаторов ===
+
+@register_indicator('bollinger', outputs=('sma', 'upper', 'lower'))
+def bollinger(windows, window=20, num_std=2):
+    sma = windows.mean(window)
+    deviation = num_std * windows.std(window)
+    return {'sma': sma, 'upper': sma + deviation, 'lower': sma - deviation}
+
+
+@register_indicator('band_width')
+def band_width(windows, window=20, num_std=2):
+    """Ширина полос Боллинджера относительно SMA"""
+    return 2 * num_std * windows.std(window) / windows.mean(window)
+
+
+@register_indicator('atr')
+def atr(windows, window=14):
+    """Средний истинный диапазон (простое скользящее среднее true range)"""
+    windows.true_range()
+    return windows.mean(window, 'true_range')
+
+
+def compute_indicators(df, specs=INDICATORS):
+    """
+    Считает все индикаторы за один проход по ценам.
+
+    Args:
+        df: DataFrame с колонками close, high, low
+        specs: описания индикаторов (по умолчанию config.INDICATORS)
+
+    Returns:
+        DataFrame: по колонке на каждый выход индикатора, индекс как у df
+    """
+    windows = RollingWindows(df['close'], df.get('high'), df.get('low'))
+    columns = {}
+    for spec in specs:
+        func, outputs = INDICATOR_TYPES[spec['type']]
+        params = {key: value for key, value in spec.items() if key not in ('name', 'type')}
+        values = func(windows, **params)
+        if outputs is None:
+            columns[spec['name']] = values
+        else:
+            for suffix in outputs:
+                columns[f"{spec['name']}_{suffix}"] = values[suffix]
+    return pd.DataFrame(columns, index=df.index)
+
+
+# === Хранение ===
+
+def get_last_dates(conn, ticker, interval=quotes_storage.DEFAULT_INTERVAL):
+    """Возвращает дату последнего сохранённого значения по каждому индикатору тикера"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT indicator, MAX(date) FROM quote_indicators
+            WHERE ticker = %s AND interval = %s
+            GROUP BY indicator
+        """, (ticker, interval))
+        return dict(cur.fetchall())
+
+
+def save_indicators(conn, ticker, dates, values, interval=quotes_storage.DEFAULT_INTERVAL):
+    """
+    Сохраняет значения индикаторов: COPY во временную таблицу и один INSERT ... ON CONFLICT DO UPDATE.
+    Значения прогрева окна (NaN) не сохраняются. Коммит выполняет вызывающий код.
+
+    Returns:
+        int: количество сохранённых значений
+    """
+    long = values.assign(date=np.asarray(dates)).melt(id_vars='date', var_name='indicator', value_name='value')
+    long = long.dropna(subset=['value'])
+    if long.empty:
+        return 0
+    buffer = io.StringIO()
+    long[['date', 'indicator', 'value']].to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS staging_quote_indicators (
+                date TIMESTAMP,
+                indicator TEXT,
+                value DOUBLE PRECISION
+            ) ON COMMIT DROP
+        """)
+        cur.copy_expert("COPY staging_quote_indicators (date, indicator, value) FROM STDIN WITH (FORMAT csv)",
+                        buffer)
+        cur.execute("""
+            INSERT INTO quote_indicators (ticker, interval, date, indicator, value)
+            SELECT %s, %s, date, indicator, value FROM staging_quote_indicators
+            ON CONFLICT (ticker, interval, indicator, date) DO UPDATE SET value = EXCLUDED.value
+        """, (ticker, interval))
+        cur.execute("TRUNCATE staging_quote_indicators")
+    return len(long)
+
+
+def update_ticker(conn, ticker, interval=quotes_storage.DEFAULT_INTERVAL, specs=INDICATORS, start=None):
+    """
+    Досчитывает индикаторы тикера начиная с последней сохранённой даты.
+
+    Значения за последнюю сохранённую дату пересчитываются: свеча могла быть
+    перезаписана загрузчиком (была сохранена незавершённой).
+    Читается только хвост истории: свечи с этой даты и max_window() + 1 свечей перед ними
+    (для true range нужна ещё и предыдущая цена закрытия).
+    Если какой-то индикатор ещё не считался (добавлен в config.INDICATORS),
+    история читается целиком, но один раз для всех индикаторов.
+
+    Args:
+        start: пересчитать значения начиная с этой даты (включительно), даже если они
+               уже сохранены — например, после заполнения пропусков в середине истории
+
+    Returns:
+        int: количество сохранённых значений
+    """
+    if not specs:
+        return 0
+    last_dates = get_last_dates(conn, ticker, interval)
+    columns = [column for spec in specs for column in output_columns(spec)]
+    since = None
+    if all(column in last_dates for column in columns):
+        since = min(last_dates[column] for column in columns)
+        if start is not None:
+            since = min(since, start)
+
+    # lookback включает и саму свечу за дату since
+    df = quotes_storage.read_since(conn, ticker, since, interval, lookback=max_window(specs) + 2)
+    if since is not None:
+        is_new = df['date'] >= since
+        if not is_new.any():
+            return 0
+    else:
+        is_new = np.ones(len(df), dtype=bool)
+    if df.empty:
+        return 0
+
+    prices = df[['close', 'high', 'low']].astype(float)
+    values = compute_indicators(prices, specs)[is_new]
+    saved = save_indicators(conn, ticker, df['date'][is_new], values, interval)
+    conn.commit()
+    return saved
+
+
+def main(interval=quotes_storage.DEFAULT_INTERVAL):
+    """Досчитывает индикаторы по всем тикерам"""
+    conn = db.getconn()
+    try:
+        migrations.ensure_schema(conn)
+        total = 0
+        for ticker in tqdm(TICKERS, desc="Расчёт индикаторов"):
+            try:
+                total += update_ticker(conn, ticker, interval)
+            except Exception as e:
+                conn.rollback()
+                tqdm.write(f"[X] Ошибка при расчёте индикаторов {ticker}: {e}")
+        print(f"[i] Сохранено значений индикаторов: {total}")
+    finally:
+        db.putconn(conn)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Расчёт индикаторов из config.INDICATORS")
+    parser.add_argument("--interval", choices=list(CANDLE_INTERVALS), default=quotes_storage.DEFAULT_INTERVAL,
+                        help="интервал свечей (по умолчанию day)")
+    args = parser.parse_args()
+    main(interval=args.interval)
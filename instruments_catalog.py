@@ -0,0 +1,165 @@
+"""
+instruments_catalog.py
+
+Назначение: Общий справочник инструментов (тикер → FIGI, лот, дата первой свечи, валюта).
+Справочник загружается из Tinkoff Invest API не чаще одного раза за
+INSTRUMENTS_CATALOG_TTL_HOURS, хранится в PostgreSQL (таблица instruments_catalog)
+и индексируется в памяти, поэтому за один запуск полный каталог скачивается не более одного раза.
+
+Используется:
+- data_loader.py
+- trader_executor.py
+- seller.py
+"""
+
+import threading
+from psycopg2.extras import execute_batch
+from tinkoff.invest import Client
+from tinkoff.invest.sandbox.client import SandboxClient
+from config import TOKEN, SANDBOX_MODE, INSTRUMENTS_CATALOG_TTL_HOURS
+import migrations
+import db
+
+# Индекс в памяти: ticker -> {'figi', 'lot', 'first_1day_candle_date', 'currency', 'instrument_type'}
+_catalog = {}
+_catalog_lock = threading.Lock()
+
+
+def connect():
+    """Соединение из общего пула (вернуть через db.putconn)"""
+    return db.getconn()
+
+
+def _load_from_db(conn):
+    """
+    Читает справочник из БД, если он моложе TTL.
+
+    Returns:
+        dict: индекс ticker -> данные инструмента или None, если кэш пуст или устарел
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT ticker, figi, lot, currency, first_1day_candle_date, instrument_type
+            FROM instruments_catalog
+            WHERE updated_at > NOW() - make_interval(hours => %s)
+        """, (INSTRUMENTS_CATALOG_TTL_HOURS,))
+        rows = cur.fetchall()
+    if not rows:
+        return None
+    return {
+        ticker: {
+            'figi': figi,
+            'lot': lot,
+            'currency': currency,
+            'first_1day_candle_date': first_date,
+            'instrument_type': instrument_type,
+        }
+        for ticker, figi, lot, currency, first_date, instrument_type in rows
+    }
+
+
+def _save_to_db(conn, index):
+    """Полностью заменяет содержимое instruments_catalog одной транзакцией"""
+    rows = [
+        (ticker, item['figi'], item['lot'], item['currency'],
+         item['first_1day_candle_date'], item['instrument_type'])
+        for ticker, item in index.items()
+    ]
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM instruments_catalog")
+        execute_batch(cur, """
+            INSERT INTO instruments_catalog
+            (ticker, figi, lot, currency, first_1day_candle_date, instrument_type, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, NOW())
+        """, rows, page_size=500)
+    conn.commit()
+
+
+def _fetch_from_api(client):
+    """
+    Скачивает акции и фонды из API и строит индекс по тикеру.
+    Как и раньше, при повторе тикера побеждает первое вхождение, акции имеют приоритет над фондами.
+    """
+    index = {}
+    for instrument_type, response in (("share", client.instruments.shares()),
+                                      ("etf", client.instruments.etfs())):
+        for instrument in response.instruments:
+            index.setdefault(instrument.ticker, {
+                'figi': instrument.figi,
+                'lot': instrument.lot,
+                'currency': instrument.currency,
+                'first_1day_candle_date': instrument.first_1day_candle_date,
+                'instrument_type': instrument_type,
+            })
+    return index
+
+
+def _open_client():
+    """Открывает клиент API в соответствии с режимом песочницы"""
+    return SandboxClient(TOKEN) if SANDBOX_MODE else Client(TOKEN)
+
+
+def _refresh_from_api(client):
+    if client is not None:
+        return _fetch_from_api(client)
+    with _open_client() as own_client:
+        return _fetch_from_api(own_client)
+
+
+def load_catalog(client=None, force=False):
+    """
+    Возвращает индекс инструментов ticker -> данные.
+
+    Порядок поиска: память процесса → таблица instruments_catalog (если не старше TTL) → API.
+    Обращение к API выполняется не чаще одного раза за запуск.
+
+    Args:
+        client: открытый клиент Tinkoff Invest API (если None — будет открыт свой)
+        force: игнорировать кэш и перекачать справочник из API
+
+    Returns:
+        dict: индекс инструментов
+    """
+    with _catalog_lock:
+        if _catalog and not force:
+            return _catalog
+
+        conn = None
+        try:
+            conn = connect()
+            migrations.ensure_schema(conn)
+            index = None if force else _load_from_db(conn)
+        except Exception as e:
+            print(f"[W] Справочник инструментов недоступен в БД: {e}")
+            index = None
+
+        try:
+            if index is None:
+                print("[i] Загрузка справочника инструментов из API...")
+                index = _refresh_from_api(client)
+                if conn is not None:
+                    try:
+                        _save_to_db(conn, index)
+                    except Exception as e:
+                        conn.rollback()
+                        print(f"[W] Не удалось сохранить справочник инструментов в БД: {e}")
+                print(f"[i] Справочник инструментов обновлён: {len(index)} инструментов")
+        finally:
+            # Соединение возвращается в общий пул и при ошибке API
+            if conn is not None:
+                db.putconn(conn)
+
+        _catalog.clear()
+        _catalog.update(index)
+        return _catalog
+
+
+def get_instrument(ticker, client=None):
+    """Возвращает данные инструмента по тикеру или None"""
+    return load_catalog(client).get(ticker)
+
+
+def get_figi(ticker, client=None):
+    """Возвращает FIGI инструмента по тикеру или None"""
+    instrument = get_instrument(ticker, client)
+    return instrument['figi'] if instrument else None
@@ -2,45 +2,63 @@
 main.py
 
 Управляющий скрипт.
-Запускает:
+Запускает в одном процессе (общий пул соединений с БД, справочник инструментов и котировки):
 - data_loader.py → загрузка данных из Tinkoff Invest API
 - signals_processor.py → генерация торговых сигналов
-- trader_executor.py → исполнение сделок по сигналам
+- telegram_notifier.py → постановка сигналов в очередь Telegram
+- telegram_outbox.py → отправка сообщений из очереди Telegram
 """
 
-import subprocess
-from tqdm import tqdm
+import logging
 import time
 import os
+import traceback
 from datetime import datetime, timedelta
-import psycopg2
-from config import DB_CONFIG
+from config import TICKERS
+import quotes_storage
+import db
+import migrations
+import data_loader
+import signals_processor
+import telegram_notifier
+import telegram_outbox
 
 # Файл лога
 LOG_FILE = "log_sandbox_main.txt"
 
+# Ожидание готовности данных перед поиском сигналов
+DATA_WAIT_TIMEOUT = 600  # 10 минут
+DATA_WAIT_INTERVAL = 60  # интервал проверки 1 минута
+
 
 def log_message(message):
-    """Записывает сообщение в лог с временной меткой"""
+    """Записывает сообщение в лог с временной меткой и сразу выводит его в консоль"""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     with open(LOG_FILE, "a", encoding="utf-8") as f:
         f.write(f"[{timestamp}] {message}\n")
+    print(f"[{timestamp}] [ПЕСОЧНИЦА] {message}", flush=True)
+
+
+def run_stage(name, func, **kwargs):
+    """
+    Выполняет этап конвейера в текущем процессе.
 
+    Вывод этапа идёт в консоль по мере работы; в лог пишутся начало, завершение,
+    длительность и ошибка этапа с трассировкой.
 
-def run_script(script_name):
-    """ Запускает указанный скрипт и возвращает успех/ошибку """
+    Returns:
+        (bool, результат этапа или None)
+    """
+    log_message(f"Выполняется: {name}")
+    started = time.time()
     try:
-        result = subprocess.run(
-            ["python", script_name],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        return True, result.stdout
-    except subprocess.CalledProcessError as e:
-        error_msg = f"Ошибка при выполнении {script_name}:\n{e.stderr}"
-        return False, error_msg
+        result = func(**kwargs)
+    except Exception as e:
+        log_message(f"Ошибка в {name}: {e}\n{traceback.format_exc()}")
+        return False, None
+    log_message(f"{name} выполнен успешно за {time.time() - started:.2f} секунд.")
+    return True, result
+
 
 def clear_log():
     """Очищает лог-файл, если он существует"""
@@ -53,25 +71,30 @@ def data_is_ready():
     Проверяет, есть ли данные за предыдущий день хотя бы по одному тикеру
     """
     try:
-
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT EXISTS (
-                SELECT 1 FROM quotes_gazp 
-                WHERE date = CURRENT_DATE - INTERVAL '1 day'
-            )
-        """)
-        is_ready = cur.fetchone()[0]
-        conn.close()
-        return is_ready
+        yesterday = datetime.now().date() - timedelta(days=1)
+        with db.connection() as conn:
+            return quotes_storage.has_data_for_day(conn, "GAZP", yesterday)
     except Exception as e:
         print(f"[ERROR] Не удалось проверить данные в БД: {e}")
         return False
 
+
+def wait_for_data():
+    """Ждёт появления данных за предыдущий день (не дольше DATA_WAIT_TIMEOUT)"""
+    wait_start = time.time()
+    while not data_is_ready():
+        if time.time() - wait_start > DATA_WAIT_TIMEOUT:
+            log_message("Таймаут ожидания данных для signals_processor")
+            return False
+        log_message("Ожидание загрузки данных...")
+        time.sleep(DATA_WAIT_INTERVAL)
+    return True
+
+
 def main():
     start_time = time.time()
     clear_log()
+    logging.basicConfig(level=logging.INFO)
 
     # --- Добавляем дату и время запуска ---
     launch_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -79,53 +102,19 @@ def main():
     log_message("Начало выполнения main.py")
     # ------------------------------------
 
-    # Список скриптов для запуска
-    tasks = [
-        ("data_loader.py", 0),  # ждём 10 секунд после загрузки
-        ("signals_processor.py", 0),  # ждём 5 секунд после signals_processor
-        ("telegram_notifier.py", 0)  # выполняем без задержки
-    ]
-
-#===================================================================================
-#    for script_name, delay in tqdm(tasks, desc="Выполнение этапов", unit="этап"):
-#        tqdm.write(f"[ПЕСОЧНИЦА] Выполняется: {script_name}")
-#        success, output = run_script(script_name)
-#        if success:
-#            log_message(f"{script_name} выполнен успешно.")
-#            tqdm.write(f"[ПЕСОЧНИЦА] {script_name} завершён успешно.")
-#        else:
-#            log_message(output)
-#            tqdm.write(f"[X ПЕСОЧНИЦА] Ошибка в {script_name}: {output}")
-#        time.sleep(delay)
-#===================================================================================
-#=== Изменение от 090725 ============================
-    for script_name, delay in tqdm(tasks, desc="Выполнение этапов", unit="этап"):
-        tqdm.write(f"[ПЕСОЧНИЦА] Выполняется: {script_name}")
-
-        # Если это signals_processor — ждём готовности данных
-        if script_name == "signals_processor.py":
-            wait_start = time.time()
-            timeout = 600  # 10 минут
-            while not data_is_ready():
-                elapsed = time.time() - wait_start
-                if elapsed > timeout:
-                    log_message("Таймаут ожидания данных для signals_processor")
-                    tqdm.write("Таймаут ожидания данных для signals_processor")
-                    break
-                tqdm.write("Ожидание загрузки данных...")
-                time.sleep(60) # интервал проверки1 минута
-
-    # Запуск скрипта
-        success, output = run_script(script_name)
-        if success:
-            log_message(f"{script_name} выполнен успешно.")
-            tqdm.write(f"[ПЕСОЧНИЦА] {script_name} завершён успешно.")
-        else:
-            log_message(output)
-            tqdm.write(f"[X ПЕСОЧНИЦА] Ошибка в {script_name}: {output}")
-    
-        time.sleep(delay)
-#=== END Изменение от 090725 ============================
+    run_stage("миграции схемы БД", migrations.ensure_schema)
+    run_stage("data_loader", data_loader.run)
+
+    # Котировки для сигналов читаются один раз, когда данные готовы
+    wait_for_data()
+    ok, quotes = run_stage("загрузка котировок", signals_processor.get_last_n_days_batch, tickers=TICKERS)
+    run_stage("signals_processor", signals_processor.run, quotes=quotes if ok else None)
+
+    run_stage("telegram_notifier", telegram_notifier.run)
+    run_stage("telegram_outbox", telegram_outbox.run)
+
+    db.print_pool_stats()
+    db.close_pool()
 
     log_message("main.py завершил выполнение.")
     print("FIN-ПЕСОЧНИЦА main.py завершил выполнение.")
@@ -135,4 +124,4 @@ def main():
     log_message(f"Все задачи выполнены за {exec_time:.2f} секунд")
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
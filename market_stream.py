@@ -0,0 +1,250 @@
+"""
+market_stream.py
+
+Назначение: Потоковая загрузка котировок в режиме реального времени.
+Подписывается на свечи MarketDataStream по всем TICKERS, накапливает обновления
+в памяти и сбрасывает их в таблицы котировок микропорциями — по количеству
+обновлений (STREAM_CONFIG['flush_rows']) или по времени (STREAM_CONFIG['flush_seconds']).
+
+Источник данных подключаемый: по умолчанию поток Tinkoff Invest API,
+для проверки без сети — FakeMarketDataStream.
+
+Запуск:
+    python market_stream.py          — поток Tinkoff Invest API
+    python market_stream.py --fake   — локальный генератор свечей
+"""
+
+import argparse
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import pandas as pd
+from tinkoff.invest import Client, CandleInstrument, SubscriptionInterval
+from config import TOKEN, TICKERS, STREAM_CONFIG
+from instruments_catalog import load_catalog
+from data_loader import candles_to_arrays, calculate_bollinger_bands_incremental, create_table
+import quotes_storage
+import db
+
+# Интервалы подписки для интервалов из CANDLE_INTERVALS
+SUBSCRIPTION_INTERVALS = {
+    '1m': SubscriptionInterval.SUBSCRIPTION_INTERVAL_ONE_MINUTE,
+    '5m': SubscriptionInterval.SUBSCRIPTION_INTERVAL_FIVE_MINUTES,
+}
+
+INTERVAL_STEPS = {
+    '1m': timedelta(minutes=1),
+    '5m': timedelta(minutes=5),
+}
+
+
+def connect():
+    """Соединение из общего пула (вернуть через db.putconn)"""
+    return db.getconn()
+
+
+def tinkoff_candle_stream(figis, interval):
+    """
+    Источник свечей из MarketDataStream Tinkoff Invest API.
+
+    Args:
+        figis: список FIGI для подписки
+        interval: интервал свечей ('1m' или '5m')
+
+    Yields:
+        Candle: очередное обновление свечи
+    """
+    with Client(TOKEN) as client:
+        stream = client.create_market_data_stream()
+        stream.candles.subscribe([
+            CandleInstrument(figi=figi, interval=SUBSCRIPTION_INTERVALS[interval]) for figi in figis
+        ])
+        try:
+            for marketdata in stream:
+                if marketdata.candle:
+                    yield marketdata.candle
+        finally:
+            stream.stop()
+
+
+def _quotation(price):
+    units = int(price)
+    return SimpleNamespace(units=units, nano=int(round((price - units) * 1e9)))
+
+
+class FakeMarketDataStream:
+    """
+    Локальный источник свечей для проверки без сети.
+
+    Цена каждого FIGI меняется случайным блужданием; каждая свеча приходит
+    несколькими обновлениями, как в настоящем потоке.
+    """
+
+    def __init__(self, updates_per_candle=3, limit=None, delay=0.0, start=None, seed=None):
+        self.updates_per_candle = updates_per_candle
+        self.limit = limit  # Всего обновлений (None — бесконечно)
+        self.delay = delay  # Пауза (секунды) между свечами
+        self.start = start
+        self.seed = seed
+
+    def __call__(self, figis, interval):
+        rng = random.Random(self.seed)
+        step = INTERVAL_STEPS[interval]
+        current = self.start or datetime.now(timezone.utc).replace(second=0, microsecond=0)
+        prices = {figi: 100.0 for figi in figis}
+        sent = 0
+
+        while True:
+            for figi in figis:
+                open_price = high = low = close = prices[figi]
+                volume = 0
+                for _ in range(self.updates_per_candle):
+                    close = close * (1 + rng.gauss(0, 0.001))
+                    high, low = max(high, close), min(low, close)
+                    volume += rng.randint(1, 100)
+                    yield SimpleNamespace(
+                        figi=figi, time=current, volume=volume,
+                        open=_quotation(open_price), high=_quotation(high),
+                        low=_quotation(low), close=_quotation(close),
+                    )
+                    sent += 1
+                    if self.limit is not None and sent >= self.limit:
+                        return
+                prices[figi] = close
+            current += step
+            if self.delay:
+                time.sleep(self.delay)
+
+
+class CandleBuffer:
+    """Буфер обновлений: по каждой паре (тикер, время свечи) хранится последнее обновление"""
+
+    def __init__(self):
+        self.candles = {}
+        self.updates = 0
+        self.lock = threading.Lock()
+
+    def add(self, ticker, candle):
+        with self.lock:
+            self.candles[(ticker, candle.time)] = candle
+            self.updates += 1
+
+    def drain(self):
+        """Забирает накопленные свечи, сгруппированные по тикеру"""
+        with self.lock:
+            candles, self.candles, self.updates = self.candles, {}, 0
+        by_ticker = {}
+        for (ticker, _), candle in candles.items():
+            by_ticker.setdefault(ticker, []).append(candle)
+        return by_ticker
+
+    def restore(self, by_ticker):
+        """Возвращает в буфер свечи, которые не удалось сохранить (более новые обновления не затираются)"""
+        with self.lock:
+            for ticker, candles in by_ticker.items():
+                for candle in candles:
+                    self.candles.setdefault((ticker, candle.time), candle)
+
+
+def save_stream_candles(conn, ticker, candles, interval):
+    """
+    Сохраняет порцию свечей тикера из потока.
+
+    Незавершённые свечи приходят повторно, поэтому уже сохранённые строки обновляются.
+    Полосы Боллинджера считаются по истории из БД так же, как при пакетной загрузке.
+    """
+    df = pd.DataFrame(candles_to_arrays(candles)).sort_values('date').reset_index(drop=True)
+    df = calculate_bollinger_bands_incremental(conn, ticker, df, interval)
+    quotes_storage.insert_frame(conn, ticker, df, interval, upsert=True)
+
+
+def flush_buffer(conn, buffer, interval):
+    """Сбрасывает буфер в БД одной транзакцией"""
+    by_ticker = buffer.drain()
+    if not by_ticker:
+        return 0
+    try:
+        for ticker, candles in by_ticker.items():
+            save_stream_candles(conn, ticker, candles, interval)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        buffer.restore(by_ticker)
+        print(f"[X] Ошибка при сохранении свечей из потока: {e}")
+        return 0
+    count = sum(len(candles) for candles in by_ticker.values())
+    print(f"[i] Сохранено {count} свечей по {len(by_ticker)} тикерам")
+    return count
+
+
+def run_stream(source=None, interval=None, flush_rows=None, flush_seconds=None):
+    """
+    Запускает потоковую загрузку и работает до остановки (Ctrl+C) или окончания источника.
+
+    Args:
+        source: источник свечей — вызываемый объект (figis, interval) -> итератор свечей;
+                по умолчанию tinkoff_candle_stream
+        interval: интервал свечей (по умолчанию STREAM_CONFIG['interval'])
+        flush_rows: сброс после стольких обновлений (по умолчанию из STREAM_CONFIG)
+        flush_seconds: сброс не реже чем раз в столько секунд (по умолчанию из STREAM_CONFIG)
+    """
+    source = source or tinkoff_candle_stream
+    interval = interval or STREAM_CONFIG['interval']
+    flush_rows = flush_rows or STREAM_CONFIG['flush_rows']
+    flush_seconds = flush_seconds or STREAM_CONFIG['flush_seconds']
+
+    catalog = load_catalog()
+    figi_to_ticker = {catalog[ticker]['figi']: ticker for ticker in TICKERS if ticker in catalog}
+    print(f"[i] Подписка на свечи {interval} по {len(figi_to_ticker)} тикерам")
+
+    conn = connect()
+    quotes_storage.ensure_schema(conn, interval)
+    for ticker in figi_to_ticker.values():
+        create_table(conn, ticker, interval)
+
+    buffer = CandleBuffer()
+    db_lock = threading.Lock()
+    stop = threading.Event()
+
+    def flush():
+        with db_lock:
+            flush_buffer(conn, buffer, interval)
+
+    def flush_by_timer():
+        while not stop.wait(flush_seconds):
+            flush()
+
+    timer = threading.Thread(target=flush_by_timer, daemon=True)
+    timer.start()
+
+    try:
+        while True:
+            try:
+                for candle in source(list(figi_to_ticker), interval):
+                    ticker = figi_to_ticker.get(candle.figi)
+                    if ticker is None:
+                        continue
+                    buffer.add(ticker, candle)
+                    if buffer.updates >= flush_rows:
+                        flush()
+                break  # Источник завершился сам (например, FakeMarketDataStream с limit)
+            except Exception as e:
+                print(f"[X] Обрыв потока котировок: {e}. Переподключение через {STREAM_CONFIG['reconnect_delay']} с")
+                time.sleep(STREAM_CONFIG['reconnect_delay'])
+    except KeyboardInterrupt:
+        print("[i] Остановка потоковой загрузки")
+    finally:
+        stop.set()
+        timer.join()
+        flush()
+        db.putconn(conn)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Потоковая загрузка котировок в PostgreSQL")
+    parser.add_argument("--fake", action="store_true", help="локальный генератор свечей вместо Tinkoff Invest API")
+    parser.add_argument("--interval", choices=list(SUBSCRIPTION_INTERVALS), default=STREAM_CONFIG['interval'])
+    args = parser.parse_args()
+    run_stream(source=FakeMarketDataStream(delay=1.0) if args.fake else None, interval=args.interval)
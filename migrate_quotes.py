@@ -0,0 +1,107 @@
+"""
+migrate_quotes.py
+
+Назначение: Переносит котировки из отдельных таблиц quotes_{ticker}
+в общую секционированную таблицу quotes (схема QUOTES_STORAGE = 'partitioned').
+
+Порядок перехода:
+1. python migrate_quotes.py            — копирование данных (можно запускать повторно)
+2. QUOTES_STORAGE = 'partitioned' в config.py
+3. python migrate_quotes.py --drop-old — удаление старых таблиц после проверки
+"""
+
+import argparse
+from psycopg2 import sql
+from tqdm import tqdm
+from config import TICKERS, CANDLE_INTERVALS
+import quotes_storage
+import db
+
+
+def table_exists(conn, table_name):
+    """Проверяет существование таблицы"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (table_name,))
+        return cur.fetchone()[0]
+
+
+def count_rows(conn, table_name, ticker=None):
+    """Считает строки таблицы (для общей таблицы — строки тикера)"""
+    with conn.cursor() as cur:
+        if ticker is None:
+            cur.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(sql.Identifier(table_name)))
+        else:
+            cur.execute(sql.SQL("SELECT COUNT(*) FROM {} WHERE ticker = %s").format(sql.Identifier(table_name)),
+                        (ticker,))
+        return cur.fetchone()[0]
+
+
+def migrate_ticker(conn, ticker, interval=quotes_storage.DEFAULT_INTERVAL):
+    """
+    Копирует строки тикера из quotes_{ticker} в его секцию общей таблицы.
+
+    Returns:
+        tuple: (строк в старой таблице, строк в секции после переноса)
+    """
+    legacy_table = quotes_storage.legacy_table_name(ticker, interval)
+    target_table = quotes_storage.partitioned_table_name(interval)
+    quotes_storage.create_partition(conn, ticker, interval)
+
+    columns = sql.SQL(', ').join(map(sql.Identifier, quotes_storage.QUOTE_COLUMNS))
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("""
+            INSERT INTO {target} (ticker, {columns})
+            SELECT %s, {columns} FROM {source}
+            ON CONFLICT (ticker, date) DO NOTHING
+        """).format(target=sql.Identifier(target_table),
+                    source=sql.Identifier(legacy_table),
+                    columns=columns), (ticker,))
+    conn.commit()
+    return count_rows(conn, legacy_table), count_rows(conn, target_table, ticker)
+
+
+def main(drop_old=False, interval=quotes_storage.DEFAULT_INTERVAL):
+    conn = db.getconn()
+    try:
+        quotes_storage.create_partitioned_table(conn, interval)
+
+        migrated = []
+        for ticker in tqdm(TICKERS, desc="Перенос котировок"):
+            legacy_table = quotes_storage.legacy_table_name(ticker, interval)
+            if not table_exists(conn, legacy_table):
+                tqdm.write(f"[-] {legacy_table}: таблицы нет, пропускаем")
+                continue
+            try:
+                source_rows, target_rows = migrate_ticker(conn, ticker, interval)
+            except Exception as e:
+                conn.rollback()
+                tqdm.write(f"[X] Ошибка при переносе {ticker}: {e}")
+                continue
+
+            if target_rows < source_rows:
+                tqdm.write(f"[W] {ticker}: в секции {target_rows} строк из {source_rows}")
+                continue
+            tqdm.write(f"[V] {ticker}: перенесено {source_rows} строк")
+            migrated.append(ticker)
+
+        if drop_old:
+            with conn.cursor() as cur:
+                for ticker in migrated:
+                    cur.execute(sql.SQL("DROP TABLE {}").format(
+                        sql.Identifier(quotes_storage.legacy_table_name(ticker, interval))))
+            conn.commit()
+            print(f"[i] Удалено старых таблиц: {len(migrated)}")
+
+        print(f"[i] Перенос завершён: {len(migrated)} из {len(TICKERS)} тикеров")
+    finally:
+        db.putconn(conn)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Перенос котировок в секционированную таблицу quotes")
+    parser.add_argument("--drop-old", action="store_true",
+                        help="удалить таблицы quotes_{ticker} после успешного переноса")
+    parser.add_argument("--interval", choices=list(CANDLE_INTERVALS), default=quotes_storage.DEFAULT_INTERVAL,
+                        help="интервал свечей (по умолчанию day)")
+    args = parser.parse_args()
+    main(drop_old=args.drop_old, interval=args.interval)
@@ -0,0 +1,400 @@
+"""
+migrations.py
+
+Назначение: Версионированные миграции схемы БД.
+Все постоянные таблицы (сигналы, позиции, сделки, очередь Telegram, справочник
+инструментов, журнал загрузки, индикаторы, результаты перебора) и их индексы
+создаются здесь, а не в модулях. Применённые версии записываются в таблицу
+schema_migrations; каждая миграция выполняется в своей транзакции один раз.
+Таблицы котировок (quotes_{ticker} и секции quotes) создаются по тикерам
+в quotes_storage.py.
+
+Первая миграция повторяет прежние CREATE TABLE IF NOT EXISTS модулей,
+поэтому на уже существующей базе она только отмечается как применённая.
+
+Проверка индексов (--check) выполняет EXPLAIN частых запросов
+(trader_executor, telegram_notifier, signal_state, seller, telegram_outbox)
+и сообщает, если запрос не использует ожидаемый индекс.
+
+Запуск:
+    python migrations.py            — применить новые миграции
+    python migrations.py --status   — список миграций и отметка о применении
+    python migrations.py --check    — проверить планы частых запросов
+"""
+
+import argparse
+import threading
+import db
+
+# Ключ pg_advisory_xact_lock: параллельные процессы применяют миграции по очереди
+MIGRATIONS_LOCK_KEY = 5_020_240
+
+# (версия, описание, список SQL)
+MIGRATIONS = [
+    (1, "Таблицы сигналов, позиций, сделок, очереди Telegram, справочника, журнала загрузки и индикаторов", [
+        """
+        CREATE TABLE IF NOT EXISTS signals_log (
+            id SERIAL PRIMARY KEY,
+            ticker TEXT NOT NULL,
+            signal_type TEXT NOT NULL,
+            signal_date DATE NOT NULL,
+            is_active BOOLEAN DEFAULT TRUE,
+            parent_id INTEGER REFERENCES signals_log(id),
+            created_at TIMESTAMP DEFAULT NOW(),
+            UNIQUE(ticker, signal_type, signal_date, parent_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS signals_sent (
+            signal_id INT PRIMARY KEY
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS positions (
+            id SERIAL PRIMARY KEY,
+            ticker TEXT NOT NULL UNIQUE,
+            buy_level NUMERIC,
+            avg_price NUMERIC,
+            quantity INT DEFAULT 10,
+            in_market BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS trade_logs (
+            id SERIAL PRIMARY KEY,
+            ticker TEXT NOT NULL,
+            trade_type TEXT NOT NULL,
+            price NUMERIC,
+            quantity INT,
+            amount NUMERIC,
+            profit NUMERIC,
+            timestamp TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS signal_watermarks (
+            ticker TEXT PRIMARY KEY,
+            candle_date TIMESTAMP NOT NULL,
+            candle_close NUMERIC NOT NULL,
+            evaluated_at TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS telegram_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            source TEXT,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INT NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            sent_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS telegram_outbox_pending_idx
+        ON telegram_outbox (next_attempt_at, id)
+        WHERE status = 'pending'
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS instruments_catalog (
+            ticker TEXT PRIMARY KEY,
+            figi TEXT NOT NULL,
+            lot INTEGER,
+            currency TEXT,
+            first_1day_candle_date TIMESTAMPTZ,
+            instrument_type TEXT,
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS loader_runs (
+            id SERIAL PRIMARY KEY,
+            interval TEXT NOT NULL,
+            full_reload BOOLEAN NOT NULL,
+            status TEXT NOT NULL,
+            started_at TIMESTAMP DEFAULT NOW(),
+            finished_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS loader_run_tickers (
+            run_id INTEGER REFERENCES loader_runs(id) ON DELETE CASCADE,
+            ticker TEXT NOT NULL,
+            status TEXT NOT NULL,
+            rows_saved INTEGER DEFAULT 0,
+            error TEXT,
+            started_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (run_id, ticker)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS loader_run_chunks (
+            run_id INTEGER REFERENCES loader_runs(id) ON DELETE CASCADE,
+            ticker TEXT NOT NULL,
+            chunk_from TIMESTAMPTZ NOT NULL,
+            chunk_to TIMESTAMPTZ NOT NULL,
+            candles INTEGER NOT NULL,
+            completed_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (run_id, ticker, chunk_from)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS quote_indicators (
+            ticker TEXT NOT NULL,
+            interval TEXT NOT NULL,
+            date TIMESTAMP NOT NULL,
+            indicator TEXT NOT NULL,
+            value DOUBLE PRECISION,
+            PRIMARY KEY (ticker, interval, indicator, date)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS param_sweep_results (
+            sweep_started_at TIMESTAMP NOT NULL,
+            rank INT NOT NULL,
+            window_size INT NOT NULL,
+            num_std NUMERIC NOT NULL,
+            n INT NOT NULL,
+            exit_rule TEXT NOT NULL,
+            total_return NUMERIC,
+            max_drawdown NUMERIC,
+            trades INT,
+            PRIMARY KEY (sweep_started_at, rank)
+        )
+        """,
+    ]),
+    (2, "Индексы для частых запросов к сигналам, позициям и сделкам", [
+        # Активные сигналы тикера: деактивация после продажи, проверки по типу и дате
+        """
+        CREATE INDEX IF NOT EXISTS signals_log_active_idx
+        ON signals_log (ticker, signal_type, signal_date)
+        WHERE is_active
+        """,
+        # Неотправленные активные сигналы в порядке даты (telegram_notifier)
+        """
+        CREATE INDEX IF NOT EXISTS signals_log_active_date_idx
+        ON signals_log (signal_date DESC, id)
+        WHERE is_active
+        """,
+        # Открытые позиции (seller, сброс "сломанных" позиций)
+        """
+        CREATE INDEX IF NOT EXISTS positions_in_market_idx
+        ON positions (ticker)
+        WHERE in_market
+        """,
+        # Сделки за день (trader_executor)
+        """
+        CREATE INDEX IF NOT EXISTS trade_logs_timestamp_idx
+        ON trade_logs (timestamp)
+        """,
+        "ANALYZE signals_log",
+        "ANALYZE positions",
+        "ANALYZE trade_logs",
+    ]),
+    (3, "Индекс очереди Telegram по ожидающим и забранным отправителем сообщениям", [
+        """
+        CREATE INDEX IF NOT EXISTS telegram_outbox_due_idx
+        ON telegram_outbox (next_attempt_at, id)
+        WHERE status IN ('pending', 'sending')
+        """,
+        "DROP INDEX IF EXISTS telegram_outbox_pending_idx",
+    ]),
+]
+
+# Частые запросы и индексы, которые они должны использовать: (название, SQL, параметры, индексы)
+HOT_QUERIES = [
+    ("trader_executor: сигнал по тикеру, типу и дате", """
+        SELECT 1 FROM signals_log
+        WHERE ticker = %s AND signal_type = 'КУПИ'
+        AND signal_date >= %s
+        LIMIT 1
+    """, ('SBER', '2025-01-01'), ['signals_log_ticker_signal_type_signal_date_parent_id_key']),
+    ("trader_executor: позиция тикера", """
+        SELECT avg_price, in_market FROM positions WHERE ticker = %s
+    """, ('SBER',), ['positions_ticker_key']),
+    ("trader_executor: сделки за день", """
+        SELECT COUNT(*) FROM trade_logs
+        WHERE timestamp >= %s AND timestamp < %s::date + 1
+    """, ('2025-01-01', '2025-01-01'), ['trade_logs_timestamp_idx']),
+    ("signal_state: деактивация сигналов после продажи", """
+        UPDATE signals_log
+        SET is_active = FALSE
+        WHERE ticker = %s
+          AND signal_type IN ('ВНИМАНИЕ', 'КУПИ', 'ДОКУПИ')
+          AND is_active = TRUE
+    """, ('SBER',), ['signals_log_active_idx']),
+    ("telegram_notifier: неотправленные сигналы", """
+        SELECT id, ticker, signal_type, signal_date FROM signals_log
+        WHERE is_active = TRUE
+          AND NOT EXISTS (
+              SELECT 1 FROM signals_sent
+              WHERE signal_id = signals_log.id
+          )
+        ORDER BY signal_date DESC
+    """, (), ['signals_log_active_date_idx', 'signals_sent_pkey']),
+    ("seller: открытые позиции", """
+        SELECT ticker, avg_price, quantity, created_at
+        FROM positions
+        WHERE in_market = TRUE AND quantity > 0
+    """, (), ['positions_in_market_idx']),
+    ("telegram_outbox: сообщения к отправке", """
+        UPDATE telegram_outbox
+        SET status = 'sending', next_attempt_at = NOW() + %s * INTERVAL '1 second'
+        WHERE id IN (
+            SELECT id FROM telegram_outbox
+            WHERE status IN ('pending', 'sending') AND next_attempt_at <= NOW()
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, message, attempts
+    """, (600, 50), ['telegram_outbox_due_idx']),
+]
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def create_migrations_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+
+
+def applied_versions(conn):
+    """Версии применённых миграций"""
+    with conn.cursor() as cur:
+        create_migrations_table(cur)
+        cur.execute("SELECT version FROM schema_migrations")
+        versions = {version for (version,) in cur.fetchall()}
+    conn.commit()
+    return versions
+
+
+def migrate(conn):
+    """
+    Применяет новые миграции по порядку версий, каждую в своей транзакции.
+
+    Returns:
+        list: версии, применённые в этом вызове
+    """
+    applied = []
+    for version, description, statements in sorted(MIGRATIONS):
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+            create_migrations_table(cur)
+            cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+            if cur.fetchone() is None:
+                for statement in statements:
+                    cur.execute(statement)
+                cur.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                            (version, description))
+                applied.append(version)
+                print(f"[i] Применена миграция {version}: {description}")
+        conn.commit()
+    return applied
+
+
+def ensure_schema(conn=None):
+    """
+    Применяет новые миграции один раз за процесс. Вызывается модулями
+    перед первым обращением к своим таблицам.
+
+    Args:
+        conn: соединение вызывающего кода (если None — берётся из пула)
+    """
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        if conn is None:
+            with db.connection() as own_conn:
+                try:
+                    migrate(own_conn)
+                except Exception:
+                    own_conn.rollback()
+                    raise
+        else:
+            try:
+                migrate(conn)
+            except Exception:
+                conn.rollback()
+                raise
+        _schema_ready = True
+
+
+def plan_indexes(plan):
+    """Имена индексов, которые встречаются в плане EXPLAIN (FORMAT JSON)"""
+    names = {plan['Index Name']} if 'Index Name' in plan else set()
+    for child in plan.get('Plans', []):
+        names |= plan_indexes(child)
+    return names
+
+
+def check_indexes(conn):
+    """
+    Проверяет по EXPLAIN, что частые запросы используют свои индексы.
+
+    Последовательное чтение отключается (enable_seqscan = off): на маленьких
+    таблицах планировщик всегда выбирает его, а проверяется, что индекс вообще
+    подходит запросу. Запросы не выполняются, транзакция откатывается.
+
+    Returns:
+        bool: True, если все запросы используют ожидаемые индексы
+    """
+    ok = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL enable_seqscan = off")
+            for name, query, params, expected in HOT_QUERIES:
+                cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+                used = plan_indexes(cur.fetchone()[0][0]['Plan'])
+                missing = [index for index in expected if index not in used]
+                if missing:
+                    ok = False
+                    print(f"[X] {name}: не используются {', '.join(missing)} "
+                          f"(в плане: {', '.join(sorted(used)) or 'нет индексов'})")
+                else:
+                    print(f"[i] {name}: {', '.join(expected)}")
+    finally:
+        conn.rollback()
+    return ok
+
+
+def print_status(conn):
+    """Печатает список миграций с отметкой о применении"""
+    versions = applied_versions(conn)
+    for version, description, _ in sorted(MIGRATIONS):
+        mark = "применена" if version in versions else "не применена"
+        print(f"[i] {version}: {description} — {mark}")
+
+
+def main(status=False, check=False):
+    with db.connection() as conn:
+        if status:
+            print_status(conn)
+            return True
+        ensure_schema(conn)
+        if check:
+            return check_indexes(conn)
+        print("[i] Схема БД актуальна")
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument("--status", action="store_true", help="показать применённые миграции")
+    parser.add_argument("--check", action="store_true",
+                        help="проверить по EXPLAIN, что частые запросы используют индексы")
+    args = parser.parse_args()
+    if not main(status=args.status, check=args.check):
+        raise SystemExit(1)
@@ -0,0 +1,161 @@
+"""
+param_sweep.py
+
+Назначение: Перебор параметров стратегии на бэктесте (backtester.py).
+Сетка из config.PARAM_SWEEP: окно и ширина полос Боллинджера, окно проверки сигналов N
+и правило выхода. Варианты считаются параллельно в пуле процессов; цены всех тикеров
+лежат в общей памяти (multiprocessing.shared_memory) и не копируются в каждую задачу.
+
+Результаты ранжируются по доходности и сохраняются в таблицу param_sweep_results
+(и в param_sweep.csv).
+
+Запуск:
+    python param_sweep.py
+    python param_sweep.py --workers 32 --since 2015-01-01
+"""
+
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_batch
+from config import PARAM_SWEEP
+import backtester
+import migrations
+import db
+
+RESULTS_FILE = "param_sweep.csv"
+SHARED_ARRAYS = ['open', 'close', 'valid', 'row']
+RESULT_COLUMNS = ['window', 'num_std', 'n', 'exit_rule', 'total_return', 'max_drawdown', 'trades']
+
+# Состояние процесса-исполнителя: панель поверх общей памяти и полосы последних параметров
+_panel = None
+_segments = []
+_bands = {}
+
+
+def share_panel(panel):
+    """
+    Копирует массивы панели в блоки общей памяти.
+
+    Returns:
+        (segments, specs): блоки SharedMemory (закрыть и удалить после работы)
+                           и описание массивов {имя: (имя блока, форма, dtype)}
+    """
+    segments, specs = [], {}
+    for name in SHARED_ARRAYS:
+        array = np.ascontiguousarray(panel[name])
+        segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+        segments.append(segment)
+        specs[name] = (segment.name, array.shape, array.dtype.str)
+    return segments, specs
+
+
+def attach_panel(specs, dates, tickers):
+    """Инициализатор процесса: собирает панель из блоков общей памяти без копирования"""
+    global _panel
+    _panel = {'dates': dates, 'tickers': tickers}
+    for name, (segment_name, shape, dtype) in specs.items():
+        segment = shared_memory.SharedMemory(name=segment_name)
+        _segments.append(segment)
+        _panel[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+
+
+def evaluate(params):
+    """
+    Бэктест одного набора параметров в процессе-исполнителе.
+    Полосы считаются один раз на (window, num_std): задачи с одинаковыми полосами идут подряд.
+    """
+    window, num_std, n, exit_rule = params
+    key = (window, num_std)
+    if key not in _bands:
+        _bands.clear()
+        _bands[key] = backtester.rolling_bands(_panel, window, num_std)
+    sma, upper, lower = _bands[key]
+    result = backtester.run_backtest(_panel, sma, upper, lower, n=n, exit_rule=exit_rule, record=False)
+    stats = backtester.summarize(result)
+    return (window, num_std, n, exit_rule, float(stats['total_return']), float(stats['max_drawdown']), stats['trades'])
+
+
+def parameter_grid(grid=PARAM_SWEEP):
+    """Все сочетания параметров; сочетания с одинаковыми полосами идут подряд"""
+    return list(itertools.product(grid['windows'], grid['num_std'], grid['n'], grid['exit_rules']))
+
+
+def run_sweep(panel, grid=PARAM_SWEEP, workers=None):
+    """
+    Считает все сочетания параметров сетки в пуле процессов.
+
+    Returns:
+        DataFrame: RESULT_COLUMNS и rank, по убыванию доходности
+    """
+    tasks = parameter_grid(grid)
+    workers = workers or os.cpu_count() or 1
+    # Одна порция — все варианты N и правила выхода для одной пары полос
+    chunksize = len(grid['n']) * len(grid['exit_rules'])
+    segments, specs = share_panel(panel)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=attach_panel,
+                                 initargs=(specs, panel['dates'], panel['tickers'])) as executor:
+            rows = list(executor.map(evaluate, tasks, chunksize=chunksize))
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+    results = pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    results = results.sort_values(['total_return', 'max_drawdown'], ascending=[False, False]).reset_index(drop=True)
+    results['rank'] = results.index + 1
+    return results
+
+
+def save_results(results, started_at):
+    """Сохраняет ранжированные результаты перебора в param_sweep_results"""
+    with db.transaction() as conn:
+        migrations.ensure_schema(conn)
+        with conn.cursor() as cur:
+            execute_batch(cur, """
+                INSERT INTO param_sweep_results
+                    (sweep_started_at, rank, window_size, num_std, n, exit_rule, total_return, max_drawdown, trades)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, [(started_at, int(row.rank), int(row.window), float(row.num_std), int(row.n), row.exit_rule,
+                   row.total_return, row.max_drawdown, int(row.trades))
+                  for row in results.itertuples(index=False)], page_size=500)
+
+
+def main(workers=None, since=None, top=20):
+    started_at = pd.Timestamp.now().floor('s').to_pydatetime()
+    history = backtester.load_history(since=since)
+    if history.empty:
+        print("[X] Нет котировок для перебора параметров")
+        return
+    panel = backtester.build_history_panel(history)
+    tasks = parameter_grid()
+    print(f"[i] Перебор параметров: {len(tasks)} вариантов, {len(panel['tickers'])} тикеров, "
+          f"{len(panel['dates'])} дней, процессов: {workers or os.cpu_count()}")
+
+    start = time.time()
+    results = run_sweep(panel, workers=workers)
+    elapsed = time.time() - start
+    print(f"[i] Перебор завершён за {elapsed:.1f} с ({len(tasks) / elapsed:.1f} вариантов/с)")
+
+    results.to_csv(RESULTS_FILE, index=False)
+    try:
+        save_results(results, started_at)
+        print(f"[i] Результаты сохранены в param_sweep_results и {RESULTS_FILE}")
+    except Exception as e:
+        print(f"[W] Не удалось сохранить результаты в БД ({e}), см. {RESULTS_FILE}")
+    print(results.head(top).to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Перебор параметров стратегии на бэктесте")
+    parser.add_argument("--workers", type=int, default=None, help="количество процессов (по умолчанию — число ядер)")
+    parser.add_argument("--since", help="начальная дата истории (YYYY-MM-DD)")
+    parser.add_argument("--top", type=int, default=20, help="сколько лучших вариантов вывести")
+    args = parser.parse_args()
+    main(workers=args.workers, since=args.since, top=args.top)
@@ -0,0 +1,522 @@
+"""
+quotes_storage.py
+
+Назначение: Единая точка доступа к таблицам котировок в PostgreSQL.
+Все модули читают и пишут свечи только через эти функции.
+
+Схема хранения задаётся в config.QUOTES_STORAGE:
+- 'per_ticker'  — отдельная таблица quotes_{ticker} на каждый тикер (исходная схема);
+- 'partitioned' — одна таблица quotes с ключом (ticker, date),
+                  секционированная по тикеру (PARTITION BY LIST), секции quotes_part_{ticker}.
+
+Дневные свечи хранятся в перечисленных таблицах, свечи других интервалов
+(см. config.CANDLE_INTERVALS) — в отдельных таблицах с суффиксом интервала:
+quotes_{ticker}_{interval} или quotes_{interval} с секциями quotes_{interval}_part_{ticker}.
+"""
+
+import io
+import pandas as pd
+from psycopg2 import sql
+from psycopg2.extras import execute_batch
+from config import QUOTES_STORAGE
+
+# Колонки котировок в порядке вставки
+QUOTE_COLUMNS = ['date', 'open', 'high', 'low', 'close', 'volume', 'sma', 'upper_band', 'lower_band']
+
+# Колонки индикаторов, которые пересчитываются по ценам закрытия
+INDICATOR_COLUMNS = ['sma', 'upper_band', 'lower_band']
+
+# Общая секционированная таблица дневных свечей
+PARTITIONED_TABLE = "quotes"
+
+# Интервал, для которого сохраняются исходные имена таблиц
+DEFAULT_INTERVAL = "day"
+
+QUOTE_COLUMNS_DDL = """
+    open NUMERIC,
+    high NUMERIC,
+    low NUMERIC,
+    close NUMERIC,
+    volume BIGINT,
+    sma NUMERIC,
+    upper_band NUMERIC,
+    lower_band NUMERIC
+"""
+
+
+def is_partitioned():
+    """Используется ли общая секционированная таблица quotes"""
+    return QUOTES_STORAGE == 'partitioned'
+
+
+def _interval_suffix(interval):
+    return "" if interval == DEFAULT_INTERVAL else f"_{interval.lower()}"
+
+
+def legacy_table_name(ticker, interval=DEFAULT_INTERVAL):
+    """Имя отдельной таблицы тикера в исходной схеме"""
+    return f"quotes_{ticker.lower()}{_interval_suffix(interval)}"
+
+
+def partitioned_table_name(interval=DEFAULT_INTERVAL):
+    """Имя общей секционированной таблицы интервала"""
+    return f"{PARTITIONED_TABLE}{_interval_suffix(interval)}"
+
+
+def partition_name(ticker, interval=DEFAULT_INTERVAL):
+    """Имя секции тикера в общей таблице интервала"""
+    return f"{partitioned_table_name(interval)}_part_{ticker.lower()}"
+
+
+def target_table_name(ticker, interval=DEFAULT_INTERVAL):
+    """Имя таблицы, в которую пишутся котировки тикера при текущей схеме хранения"""
+    return partitioned_table_name(interval) if is_partitioned() else legacy_table_name(ticker, interval)
+
+
+def table_label(ticker, interval=DEFAULT_INTERVAL):
+    """Человекочитаемое имя хранилища тикера для сообщений"""
+    if is_partitioned():
+        return f"{partitioned_table_name(interval)}[{ticker}]"
+    return legacy_table_name(ticker, interval)
+
+
+def _source(ticker, interval=DEFAULT_INTERVAL):
+    """
+    Возвращает таблицу и условие отбора строк тикера.
+
+    Returns:
+        tuple: (идентификатор таблицы, SQL-условие, параметры условия)
+    """
+    if is_partitioned():
+        return sql.Identifier(partitioned_table_name(interval)), sql.SQL("ticker = %s"), (ticker,)
+    return sql.Identifier(legacy_table_name(ticker, interval)), sql.SQL("TRUE"), ()
+
+
+def _key_columns():
+    return ['ticker', 'date'] if is_partitioned() else ['date']
+
+
+def create_partitioned_table(conn, interval=DEFAULT_INTERVAL):
+    """Создаёт общую таблицу интервала, секционированную по тикеру, и индекс по дате"""
+    table_name = partitioned_table_name(interval)
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("""
+            CREATE TABLE IF NOT EXISTS {table} (
+                ticker TEXT NOT NULL,
+                date TIMESTAMP NOT NULL,
+                {columns},
+                PRIMARY KEY (ticker, date)
+            ) PARTITION BY LIST (ticker)
+        """).format(table=sql.Identifier(table_name), columns=sql.SQL(QUOTE_COLUMNS_DDL)))
+        # Срезы «все тикеры за последние дни» обслуживаются индексом по дате
+        cursor.execute(sql.SQL("""
+            CREATE INDEX IF NOT EXISTS {index} ON {table} (date DESC, ticker)
+        """).format(index=sql.Identifier(f"{table_name}_date_ticker_idx"),
+                    table=sql.Identifier(table_name)))
+    conn.commit()
+
+
+def create_partition(conn, ticker, interval=DEFAULT_INTERVAL):
+    """Создаёт секцию тикера в общей таблице интервала"""
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("""
+            CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} FOR VALUES IN ({ticker})
+        """).format(partition=sql.Identifier(partition_name(ticker, interval)),
+                    table=sql.Identifier(partitioned_table_name(interval)),
+                    ticker=sql.Literal(ticker)))
+    conn.commit()
+
+
+def ensure_schema(conn, interval=DEFAULT_INTERVAL):
+    """
+    Создаёт общую секционированную таблицу интервала (только для схемы 'partitioned').
+    Вызывается один раз до параллельной загрузки тикеров.
+    """
+    if is_partitioned():
+        create_partitioned_table(conn, interval)
+
+
+def ensure_table(conn, ticker, interval=DEFAULT_INTERVAL):
+    """
+    Создаёт хранилище котировок тикера: отдельную таблицу или секцию общей таблицы.
+
+    Args:
+        conn: соединение с базой данных
+        ticker: тикер акции
+        interval: интервал свечей
+    """
+    if is_partitioned():
+        create_partition(conn, ticker, interval)
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("""
+            CREATE TABLE IF NOT EXISTS {} (
+                date TIMESTAMP PRIMARY KEY,
+                {}
+            )
+        """).format(sql.Identifier(legacy_table_name(ticker, interval)), sql.SQL(QUOTE_COLUMNS_DDL)))
+    conn.commit()
+
+
+def get_last_date(conn, ticker, interval=DEFAULT_INTERVAL):
+    """Возвращает дату последней сохранённой свечи тикера (MAX(date)) или None"""
+    table, condition, params = _source(ticker, interval)
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("SELECT MAX(date) FROM {} WHERE {}").format(table, condition), params)
+        return cursor.fetchone()[0]
+
+
+def get_dates(conn, ticker, interval=DEFAULT_INTERVAL):
+    """Возвращает все даты свечей тикера по возрастанию"""
+    table, condition, params = _source(ticker, interval)
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("SELECT date FROM {} WHERE {} ORDER BY date").format(table, condition), params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def get_dates_since(conn, ticker, since, interval=DEFAULT_INTERVAL):
+    """Возвращает список дат свечей тикера, начиная с since"""
+    table, condition, params = _source(ticker, interval)
+    with conn.cursor() as cursor:
+        cursor.execute(
+            sql.SQL("SELECT date FROM {} WHERE {} AND date >= %s").format(table, condition),
+            params + (since,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def get_seed_closes(conn, ticker, before_date, count, interval=DEFAULT_INTERVAL):
+    """
+    Возвращает последние count цен закрытия, сохранённые до before_date.
+
+    Args:
+        conn: соединение с базой данных
+        ticker: тикер акции
+        before_date: дата первой новой свечи
+        count: количество свечей (window - 1 для скользящего окна)
+        interval: интервал свечей
+
+    Returns:
+        DataFrame: колонки date, close в порядке возрастания даты
+    """
+    table, condition, params = _source(ticker, interval)
+    with conn.cursor() as cursor:
+        cursor.execute(
+            sql.SQL("""
+                SELECT date, close FROM {}
+                WHERE {} AND date < %s
+                ORDER BY date DESC
+                LIMIT %s
+            """).format(table, condition),
+            params + (before_date, count)
+        )
+        rows = cursor.fetchall()
+    seed = pd.DataFrame(rows[::-1], columns=['date', 'close'])
+    seed['close'] = seed['close'].astype(float)
+    return seed
+
+
+def read_last_n(conn, ticker, n, columns=None, until_today=False, ascending=True, interval=DEFAULT_INTERVAL):
+    """
+    Читает последние n свечей тикера.
+
+    Args:
+        conn: соединение с базой данных
+        ticker: тикер акции
+        n: количество свечей
+        columns: список колонок (по умолчанию все QUOTE_COLUMNS)
+        until_today: не брать свечи с датой позже CURRENT_DATE
+        ascending: порядок результата по дате
+        interval: интервал свечей
+
+    Returns:
+        DataFrame: свечи тикера
+    """
+    columns = columns or QUOTE_COLUMNS
+    table, condition, params = _source(ticker, interval)
+    if until_today:
+        condition = sql.SQL("{} AND date <= CURRENT_DATE").format(condition)
+    with conn.cursor() as cursor:
+        cursor.execute(
+            sql.SQL("""
+                SELECT {columns} FROM {table}
+                WHERE {condition}
+                ORDER BY date DESC
+                LIMIT %s
+            """).format(columns=sql.SQL(', ').join(map(sql.Identifier, columns)),
+                        table=table, condition=condition),
+            params + (n,)
+        )
+        rows = cursor.fetchall()
+    df = pd.DataFrame(rows, columns=columns)
+    if ascending:
+        df = df.iloc[::-1].reset_index(drop=True)
+    return df
+
+
+def existing_tickers(conn, tickers, interval=DEFAULT_INTERVAL):
+    """Возвращает тикеры, для которых есть таблица котировок (одним запросом)"""
+    if is_partitioned():
+        return list(tickers)
+    names = [legacy_table_name(ticker, interval) for ticker in tickers]
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM unnest(%s::text[]) AS name WHERE to_regclass(quote_ident(name)) IS NOT NULL",
+            (names,)
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+    return [ticker for ticker, name in zip(tickers, names) if name in existing]
+
+
+def read_last_n_batch(conn, tickers, n, columns=None, until_today=False, interval=DEFAULT_INTERVAL):
+    """
+    Читает последние n свечей сразу по всем тикерам одним запросом.
+
+    Для отдельных таблиц — UNION ALL подзапросов с LIMIT по каждой таблице,
+    для общей таблицы — LATERAL-подзапрос по списку тикеров.
+    Тикеры без таблицы котировок пропускаются.
+
+    Args:
+        conn: соединение с базой данных
+        tickers: список тикеров
+        n: количество свечей на тикер (None — вся история)
+        columns: список колонок (по умолчанию все QUOTE_COLUMNS)
+        until_today: не брать свечи с датой позже CURRENT_DATE
+        interval: интервал свечей
+
+    Returns:
+        DataFrame: панель с индексом (ticker, date), даты по возрастанию внутри тикера
+    """
+    columns = columns or QUOTE_COLUMNS
+    if 'date' not in columns:
+        columns = ['date'] + columns
+    select_columns = sql.SQL(', ').join(map(sql.Identifier, columns))
+    date_condition = sql.SQL("date <= CURRENT_DATE") if until_today else sql.SQL("TRUE")
+
+    if is_partitioned():
+        query = sql.SQL("""
+            SELECT t.ticker, {columns}
+            FROM unnest(%s::text[]) AS t(ticker)
+            CROSS JOIN LATERAL (
+                SELECT {columns} FROM {table}
+                WHERE ticker = t.ticker AND {date_condition}
+                ORDER BY date DESC
+                LIMIT %s
+            ) AS q
+        """).format(columns=select_columns, table=sql.Identifier(partitioned_table_name(interval)),
+                    date_condition=date_condition)
+        params = (list(tickers), n)
+    else:
+        tickers = existing_tickers(conn, tickers, interval)
+        if not tickers:
+            return pd.DataFrame(columns=['ticker'] + columns).set_index(['ticker', 'date'])
+        query = sql.SQL(" UNION ALL ").join(
+            sql.SQL("""
+                (SELECT {ticker}::text AS ticker, {columns} FROM {table}
+                 WHERE {date_condition}
+                 ORDER BY date DESC
+                 LIMIT {limit})
+            """).format(ticker=sql.Literal(ticker), columns=select_columns,
+                        table=sql.Identifier(legacy_table_name(ticker, interval)),
+                        date_condition=date_condition, limit=sql.Literal(n))
+            for ticker in tickers
+        )
+        params = ()
+
+    with conn.cursor() as cursor:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    panel = pd.DataFrame(rows, columns=['ticker'] + columns)
+    panel['date'] = pd.to_datetime(panel['date'])
+    return panel.set_index(['ticker', 'date']).sort_index()
+
+
+def has_data_for_day(conn, ticker, day, interval=DEFAULT_INTERVAL):
+    """Проверяет, есть ли у тикера свеча за календарный день day"""
+    table, condition, params = _source(ticker, interval)
+    with conn.cursor() as cursor:
+        cursor.execute(
+            sql.SQL("SELECT EXISTS (SELECT 1 FROM {} WHERE {} AND date >= %s AND date < %s + 1)").format(
+                table, condition),
+            params + (day, day)
+        )
+        return cursor.fetchone()[0]
+
+
+def _prepare_frame(ticker, df):
+    frame = df[QUOTE_COLUMNS]
+    if is_partitioned():
+        frame = frame.assign(ticker=ticker)[['ticker'] + QUOTE_COLUMNS]
+    return frame
+
+
+def _conflict_action(upsert):
+    """Действие при совпадении ключа: пропустить строку или обновить её значения"""
+    if not upsert:
+        return sql.SQL("DO NOTHING")
+    return sql.SQL("DO UPDATE SET {}").format(sql.SQL(', ').join(
+        sql.SQL("{column} = EXCLUDED.{column}").format(column=sql.Identifier(column))
+        for column in QUOTE_COLUMNS if column != 'date'
+    ))
+
+
+def insert_frame(conn, ticker, df, interval=DEFAULT_INTERVAL, upsert=False):
+    """
+    Вставляет строки DataFrame через execute_batch (для небольших инкрементальных порций).
+    Значения приводятся к типам Python целыми колонками, NaN заменяется на NULL.
+    Коммит выполняет вызывающий код.
+
+    Args:
+        upsert: обновлять уже сохранённые свечи (незавершённые свечи из потока котировок)
+    """
+    frame = _prepare_frame(ticker, df).astype(object)
+    rows = frame.where(frame.notna(), None).itertuples(index=False, name=None)
+    table = sql.Identifier(target_table_name(ticker, interval))
+    with conn.cursor() as cursor:
+        insert_query = sql.SQL("""
+            INSERT INTO {table} ({columns})
+            VALUES ({placeholders})
+            ON CONFLICT ({key}) {action}
+        """).format(
+            table=table,
+            columns=sql.SQL(', ').join(map(sql.Identifier, frame.columns)),
+            placeholders=sql.SQL(', ').join(sql.Placeholder() * len(frame.columns)),
+            key=sql.SQL(', ').join(map(sql.Identifier, _key_columns())),
+            action=_conflict_action(upsert)
+        )
+        execute_batch(cursor, insert_query, rows, page_size=500)
+
+
+def copy_frame(conn, ticker, df, interval=DEFAULT_INTERVAL):
+    """
+    Массовая загрузка DataFrame: COPY FROM STDIN во временную таблицу
+    и перенос в основную таблицу одним INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+    Коммит выполняет вызывающий код.
+    """
+    frame = _prepare_frame(ticker, df)
+    target_name = target_table_name(ticker, interval)
+    staging_name = f"staging_{legacy_table_name(ticker, interval)}"
+    buffer = io.StringIO()
+    # Пустое поле в формате CSV PostgreSQL воспринимает как NULL
+    frame.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    columns = sql.SQL(', ').join(map(sql.Identifier, frame.columns))
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("""
+            CREATE TEMP TABLE IF NOT EXISTS {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DROP
+        """).format(sql.Identifier(staging_name), sql.Identifier(target_name)))
+        cursor.copy_expert(
+            sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+                sql.Identifier(staging_name), columns
+            ).as_string(conn),
+            buffer
+        )
+        cursor.execute(sql.SQL("""
+            INSERT INTO {target} ({columns})
+            SELECT {columns} FROM {staging}
+            ON CONFLICT ({key}) DO NOTHING
+        """).format(
+            target=sql.Identifier(target_name),
+            staging=sql.Identifier(staging_name),
+            columns=columns,
+            key=sql.SQL(', ').join(map(sql.Identifier, _key_columns()))
+        ))
+
+
+def read_closes(conn, ticker, interval=DEFAULT_INTERVAL):
+    """Читает всю историю цен закрытия тикера (колонки date, close по возрастанию даты)"""
+    table, condition, params = _source(ticker, interval)
+    with conn.cursor() as cursor:
+        cursor.execute(
+            sql.SQL("SELECT date, close FROM {} WHERE {} ORDER BY date").format(table, condition),
+            params
+        )
+        rows = cursor.fetchall()
+    df = pd.DataFrame(rows, columns=['date', 'close'])
+    df['close'] = df['close'].astype(float)
+    return df
+
+
+def update_indicators(conn, ticker, df, interval=DEFAULT_INTERVAL):
+    """
+    Массово обновляет sma, upper_band, lower_band уже сохранённых свечей:
+    COPY во временную таблицу и один UPDATE ... FROM по ключу.
+    Коммит выполняет вызывающий код.
+
+    Returns:
+        int: количество обновлённых строк
+    """
+    columns = ['date'] + INDICATOR_COLUMNS
+    frame = df[columns]
+    staging_name = f"indicators_{legacy_table_name(ticker, interval)}"
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    table, condition, params = _source(ticker, interval)
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("""
+            CREATE TEMP TABLE IF NOT EXISTS {} (
+                date TIMESTAMP PRIMARY KEY,
+                sma NUMERIC,
+                upper_band NUMERIC,
+                lower_band NUMERIC
+            ) ON COMMIT DROP
+        """).format(sql.Identifier(staging_name)))
+        cursor.copy_expert(
+            sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+                sql.Identifier(staging_name), sql.SQL(', ').join(map(sql.Identifier, columns))
+            ).as_string(conn),
+            buffer
+        )
+        cursor.execute(sql.SQL("""
+            UPDATE {table} AS q
+            SET {assignments}
+            FROM {staging} AS s
+            WHERE q.date = s.date AND {condition}
+        """).format(
+            table=table,
+            staging=sql.Identifier(staging_name),
+            assignments=sql.SQL(', ').join(
+                sql.SQL("{column} = s.{column}").format(column=sql.Identifier(column))
+                for column in INDICATOR_COLUMNS
+            ),
+            condition=condition
+        ), params)
+        return cursor.rowcount
+
+
+def read_since(conn, ticker, since=None, interval=DEFAULT_INTERVAL, lookback=0):
+    """
+    Читает свечи тикера с датой строго позже since (все свечи, если since не задан).
+
+    Args:
+        lookback: дополнительно вернуть столько свечей до since (история для скользящих окон)
+
+    Returns:
+        DataFrame: колонки QUOTE_COLUMNS по возрастанию даты
+    """
+    table, condition, params = _source(ticker, interval)
+    if since is not None and lookback:
+        condition = sql.SQL("""
+            {condition} AND date >= COALESCE((
+                SELECT MIN(date) FROM (
+                    SELECT date FROM {table} WHERE {condition} AND date <= %s
+                    ORDER BY date DESC LIMIT %s
+                ) AS seed
+            ), %s)
+        """).format(condition=condition, table=table)
+        params = params + params + (since, lookback, since)
+    elif since is not None:
+        condition = sql.SQL("{} AND date > %s").format(condition)
+        params = params + (since,)
+    with conn.cursor() as cursor:
+        cursor.execute(
+            sql.SQL("SELECT {columns} FROM {table} WHERE {condition} ORDER BY date").format(
+                columns=sql.SQL(', ').join(map(sql.Identifier, QUOTE_COLUMNS)),
+                table=table, condition=condition),
+            params
+        )
+        rows = cursor.fetchall()
+    return pd.DataFrame(rows, columns=QUOTE_COLUMNS)
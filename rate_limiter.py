@@ -0,0 +1,99 @@
+"""
+rate_limiter.py
+
+Назначение: Ограничение частоты запросов к Tinkoff Invest API.
+Общий для всех потоков «токен-бакет» настраивается из config.API_LIMITS,
+а вызовы, получившие от брокера ответ RESOURCE_EXHAUSTED, повторяются с паузой.
+"""
+
+import time
+import threading
+from grpc import StatusCode
+from tinkoff.invest.exceptions import RequestError
+from config import API_LIMITS
+
+
+class TokenBucket:
+    """
+    Потокобезопасный токен-бакет.
+
+    Бакет вмещает capacity токенов и пополняется со скоростью rate_per_minute.
+    Каждый запрос к API забирает один токен; если токенов нет, поток ждёт.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0  # токенов в секунду
+        self.capacity = capacity or max(1, int(self.rate))
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, current):
+        elapsed = current - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = current
+
+    def acquire(self):
+        """Блокирует поток, пока не появится свободный токен"""
+        while True:
+            with self.lock:
+                current = time.monotonic()
+                self._refill(current)
+                if current >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - current, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Приостанавливает выдачу токенов всем потокам (ответ брокера о превышении квоты)"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+def create_api_limiter():
+    """Создаёт токен-бакет по параметрам API_LIMITS"""
+    return TokenBucket(
+        rate_per_minute=API_LIMITS['requests_per_minute'],
+        capacity=API_LIMITS['max_workers'],
+    )
+
+
+def is_rate_limit_error(error):
+    """Проверяет, что ошибка API вызвана превышением квоты запросов"""
+    return isinstance(error, RequestError) and error.code == StatusCode.RESOURCE_EXHAUSTED
+
+
+def call_with_limits(limiter, func, **kwargs):
+    """
+    Вызывает метод API с учётом лимитера и повторяет вызов при превышении квоты.
+
+    Пауза берётся из заголовка ratelimit_reset ответа брокера, а если его нет —
+    растёт экспоненциально от API_LIMITS['delay_between_requests'].
+
+    Args:
+        limiter: TokenBucket или None
+        func: метод клиента API (например, client.market_data.get_candles)
+        **kwargs: аргументы метода
+
+    Returns:
+        ответ API
+    """
+    delay = API_LIMITS['delay_between_requests']
+    for attempt in range(API_LIMITS['max_retries'] + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return func(**kwargs)
+        except RequestError as e:
+            if not is_rate_limit_error(e) or attempt == API_LIMITS['max_retries']:
+                raise
+            reset = getattr(e.metadata, 'ratelimit_reset', None) if e.metadata else None
+            wait = reset if reset else delay * (2 ** attempt)
+            print(f"[W] Превышена квота API, пауза {wait} с (попытка {attempt + 1})")
+            if limiter is not None:
+                limiter.pause(wait)
+            else:
+                time.sleep(wait)
@@ -0,0 +1,99 @@
+"""
+recompute_indicators.py
+
+Назначение: Полный пересчёт индикаторов (sma, upper_band, lower_band) по всей истории
+всех тикеров — после изменения схемы или параметров BOLLINGER_CONFIG.
+
+Тикеры распределяются по пулу процессов: каждый процесс читает цены закрытия
+одного тикера, считает полосы и массово обновляет его строки, поэтому
+пересчёт масштабируется по числу ядер.
+
+Запуск:
+    python recompute_indicators.py                  — все тикеры, дневные свечи
+    python recompute_indicators.py --workers 4 --interval hour
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+from config import TICKERS, BOLLINGER_CONFIG, CANDLE_INTERVALS
+from data_loader import calculate_bollinger_bands
+import quotes_storage
+import columnar_store
+import db
+
+
+def recompute_ticker(ticker, interval=quotes_storage.DEFAULT_INTERVAL):
+    """
+    Пересчитывает индикаторы одного тикера (выполняется в процессе пула).
+
+    Returns:
+        tuple: (тикер, обновлено строк, время в секундах, PID процесса)
+    """
+    started = time.perf_counter()
+    conn = db.getconn()
+    try:
+        df = quotes_storage.read_closes(conn, ticker, interval)
+        if df.empty:
+            return ticker, 0, time.perf_counter() - started, os.getpid()
+        df = calculate_bollinger_bands(df, **BOLLINGER_CONFIG)
+        # Первые window - 1 строк хранятся с полосами, посчитанными по несохранённым свечам,
+        # — без полного окна их не пересчитать, поэтому они не трогаются
+        df = df.dropna(subset=quotes_storage.INDICATOR_COLUMNS)
+        updated = quotes_storage.update_indicators(conn, ticker, df, interval)
+        conn.commit()
+        # Полосы в файле колоночного хранилища устарели
+        columnar_store.invalidate(conn, ticker, interval)
+        return ticker, updated, time.perf_counter() - started, os.getpid()
+    finally:
+        db.putconn(conn)
+
+
+def main(workers=None, interval=quotes_storage.DEFAULT_INTERVAL, tickers=None):
+    """
+    Пересчитывает индикаторы по всем тикерам в пуле процессов.
+
+    Args:
+        workers: количество процессов (по умолчанию — число ядер)
+        interval: интервал свечей (ключ CANDLE_INTERVALS)
+        tickers: список тикеров (по умолчанию TICKERS)
+    """
+    tickers = tickers or TICKERS
+    workers = workers or os.cpu_count() or 1
+    start_time = time.time()
+    total_rows = 0
+    worker_stats = {}  # PID -> [тикеров, строк, секунд]
+
+    print(f"[i] Пересчёт индикаторов: {len(tickers)} тикеров, процессов: {workers}")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(recompute_ticker, ticker, interval): ticker for ticker in tickers}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Пересчёт индикаторов"):
+            ticker = futures[future]
+            try:
+                _, updated, seconds, pid = future.result()
+            except Exception as e:
+                tqdm.write(f"[X] Ошибка при пересчёте {ticker}: {e}")
+                continue
+            total_rows += updated
+            stats = worker_stats.setdefault(pid, [0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += updated
+            stats[2] += seconds
+
+    elapsed = time.time() - start_time
+    for pid, (ticker_count, rows, seconds) in sorted(worker_stats.items()):
+        rate = rows / seconds if seconds else 0
+        print(f"[i] Процесс {pid}: {ticker_count} тикеров, {rows} строк, {rate:.0f} строк/с")
+    rate = total_rows / elapsed if elapsed else 0
+    print(f"[i] Обновлено {total_rows} строк за {elapsed:.1f} с ({rate:.0f} строк/с)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пересчёт полос Боллинджера по всей истории котировок")
+    parser.add_argument("--workers", type=int, default=None, help="количество процессов (по умолчанию — число ядер)")
+    parser.add_argument("--interval", choices=list(CANDLE_INTERVALS), default=quotes_storage.DEFAULT_INTERVAL,
+                        help="интервал свечей (по умолчанию day)")
+    args = parser.parse_args()
+    main(workers=args.workers, interval=args.interval)
@@ -0,0 +1,135 @@
+"""
+run_journal.py
+
+Назначение: Журнал запусков data_loader с контрольными точками.
+В таблицах loader_runs, loader_run_tickers и loader_run_chunks фиксируется,
+какие тикеры и отрезки загрузки уже сохранены в БД. Если запуск прервался
+(процесс упал, ошибка API или БД на одном из тикеров), следующий запуск с теми же
+параметрами продолжает его: тикеры, загруженные до текущей свечи, пропускаются,
+остальные загружаются с отрезка, на котором остановились.
+
+Тикеры, которые загрузить нельзя в принципе (нет FIGI, не определена начальная дата),
+получают статус skipped и не делают запуск продолжаемым.
+
+Используется:
+- data_loader.py
+"""
+
+from psycopg2.extras import execute_batch
+from config import RUN_JOURNAL_RESUME_HOURS
+
+# Статусы запуска и тикера
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_INTERRUPTED = 'interrupted'  # запуск: часть тикеров не догружена из-за временной ошибки
+STATUS_SKIPPED = 'skipped'  # тикер: загрузка невозможна (нет FIGI и т.п.), повторять не нужно
+
+# Запуски в этих статусах продолжаются следующим запуском
+RESUMABLE_STATUSES = (STATUS_RUNNING, STATUS_INTERRUPTED)
+
+
+def start_run(conn, interval, full):
+    """
+    Возвращает прерванный запуск с теми же параметрами (статус running — процесс упал,
+    или interrupted), начатый или продолженный не раньше RUN_JOURNAL_RESUME_HOURS назад,
+    или создаёт новый. Запуски, завершённые со статусом done или failed, не продолжаются.
+
+    Returns:
+        tuple: (id запуска, True если запуск продолжается)
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT id FROM loader_runs
+            WHERE interval = %s AND full_reload = %s AND status IN %s
+            AND started_at > NOW() - make_interval(hours => %s)
+            ORDER BY started_at DESC
+            LIMIT 1
+        """, (interval, full, RESUMABLE_STATUSES, RUN_JOURNAL_RESUME_HOURS))
+        row = cur.fetchone()
+        if row:
+            # started_at сдвигается: окно продолжения отсчитывается от последней попытки
+            cur.execute("UPDATE loader_runs SET status = %s, started_at = NOW(), finished_at = NULL WHERE id = %s",
+                        (STATUS_RUNNING, row[0]))
+            run_id, resumed = row[0], True
+        else:
+            cur.execute("""
+                INSERT INTO loader_runs (interval, full_reload, status)
+                VALUES (%s, %s, %s)
+                RETURNING id
+            """, (interval, full, STATUS_RUNNING))
+            run_id, resumed = cur.fetchone()[0], False
+    conn.commit()
+    return run_id, resumed
+
+
+def finish_run(conn, run_id, status):
+    """Фиксирует завершение запуска"""
+    with conn.cursor() as cur:
+        cur.execute("UPDATE loader_runs SET status = %s, finished_at = NOW() WHERE id = %s", (status, run_id))
+    conn.commit()
+
+
+def get_progress(conn, run_id):
+    """
+    Возвращает состояние тикеров запуска.
+
+    Returns:
+        dict: тикер -> {'status': ..., 'checkpoint': конец последнего сохранённого отрезка или None}
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT t.ticker, t.status, MAX(c.chunk_to)
+            FROM loader_run_tickers t
+            LEFT JOIN loader_run_chunks c ON c.run_id = t.run_id AND c.ticker = t.ticker
+            WHERE t.run_id = %s
+            GROUP BY t.ticker, t.status
+        """, (run_id,))
+        return {ticker: {'status': status, 'checkpoint': checkpoint}
+                for ticker, status, checkpoint in cur.fetchall()}
+
+
+def start_ticker(conn, run_id, ticker):
+    """Отмечает начало (или продолжение) загрузки тикера"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO loader_run_tickers (run_id, ticker, status)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (run_id, ticker) DO UPDATE
+            SET status = EXCLUDED.status, error = NULL, updated_at = NOW()
+        """, (run_id, ticker, STATUS_RUNNING))
+    conn.commit()
+
+
+def complete_chunks(conn, run_id, ticker, chunks):
+    """
+    Отмечает отрезки, свечи которых сохранены в БД.
+
+    Args:
+        chunks: список (начало, конец, количество свечей)
+    """
+    if not chunks:
+        return
+    with conn.cursor() as cur:
+        execute_batch(cur, """
+            INSERT INTO loader_run_chunks (run_id, ticker, chunk_from, chunk_to, candles)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (run_id, ticker, chunk_from) DO NOTHING
+        """, [(run_id, ticker, chunk_from, chunk_to, count) for chunk_from, chunk_to, count in chunks])
+        cur.execute("""
+            UPDATE loader_run_tickers
+            SET rows_saved = rows_saved + %s, updated_at = NOW()
+            WHERE run_id = %s AND ticker = %s
+        """, (sum(count for _, _, count in chunks), run_id, ticker))
+    conn.commit()
+
+
+def finish_ticker(conn, run_id, ticker, status, error=None):
+    """Фиксирует итог загрузки тикера"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE loader_run_tickers
+            SET status = %s, error = %s, updated_at = NOW()
+            WHERE run_id = %s AND ticker = %s
+        """, (status, error, run_id, ticker))
+    conn.commit()
@@ -7,30 +7,42 @@ import datetime
 import logging
 from decimal import Decimal
 
-from tinkoff.invest import Client, OrderDirection, OrderType
-from tinkoff.invest.sandbox.client import SandboxClient
-from config import TOKEN, DB_CONFIG, TELEGRAM_CHAT_ID, COMMISSION, SANDBOX_MODE
-from telegram_bot import send_telegram_message
-import psycopg2
+from tinkoff.invest import OrderDirection
+from config import TELEGRAM_CHAT_ID, COMMISSION
+from broker_session import BrokerSession
+import telegram_outbox
+from instruments_catalog import get_figi
+import migrations
+import db
 
 
 # === Настройка логирования ===
 LOG_FILE_SELLER = "seller.txt"
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+_logging_ready = False
 
-# Логгирование в консоль
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-logging.getLogger().addHandler(console_handler)
 
-# Логгирование в файл
-file_handler = logging.FileHandler(LOG_FILE_SELLER, encoding='utf-8')
-file_handler.setFormatter(formatter)
-logging.getLogger().addHandler(file_handler)
+def setup_logging():
+    """Подключает вывод логов в консоль и в LOG_FILE_SELLER (один раз на процесс, при запуске, а не при импорте)"""
+    global _logging_ready
+    if _logging_ready:
+        return
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+    # Логгирование в консоль
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    logging.getLogger().addHandler(console_handler)
+
+    # Логгирование в файл
+    file_handler = logging.FileHandler(LOG_FILE_SELLER, encoding='utf-8')
+    file_handler.setFormatter(formatter)
+    logging.getLogger().addHandler(file_handler)
+    _logging_ready = True
+
 
 def connect_db():
-    """Подключение к базе данных."""
-    return psycopg2.connect(**DB_CONFIG)
+    """Транзакция на соединении из общего пула (COMMIT в конце блока with)."""
+    return db.transaction()
 
 
 def get_positions():
@@ -45,39 +57,14 @@ def get_positions():
             return cur.fetchall()
 
 
-def get_figi_by_ticker(ticker):
-    """Получаем FIGI по тикеру."""
-    with Client(TOKEN) as client:
-        instruments = client.instruments
-        if ticker == 'SPY':
-            r = instruments.etfs()
-        else:
-            r = instruments.shares()
+def get_figi_by_ticker(session, ticker):
+    """Получаем FIGI по тикеру из общего справочника инструментов."""
+    return get_figi(ticker, session.client)
 
-        for item in r.instruments:
-            if item.ticker == ticker:
-                return item.figi
-    return None
-
-def sell_position(figi, quantity, price):
+def sell_position(session, figi, quantity, price):
     """Выполняем ордер на продажу."""
     try:
-        with Client(TOKEN) as client:
-            # Получаем список счетов
-            accounts = client.users.get_accounts().accounts
-            if not accounts:
-                raise Exception("Нет активных счетов")
-            account_id = accounts[0].id  # Берём первый счёт
-
-            response = client.orders.post_order(
-                figi=figi,
-                quantity=quantity,
-                direction=OrderDirection.ORDER_DIRECTION_SELL,
-                account_id=account_id,
-                order_type=OrderType.ORDER_TYPE_MARKET,
-                order_id=str(hash(figi))[:36]
-            )
-            return response
+        return session.post_order(figi, quantity, OrderDirection.ORDER_DIRECTION_SELL)
     except Exception as e:
         logging.error(f"[X seller.py] Ошибка при выполнении ордера на продажу: {e}")
         return None
@@ -116,15 +103,13 @@ def send_report_to_telegram(positions_data):
 {'-' * 20}
         """
 
-    send_telegram_message(message)
+    telegram_outbox.enqueue(message, source="seller")
     logging.info("[seller.py] Сообщение с отчетом отправлено в Telegram")
 
 # === Запрос актуальной цены в API
-def get_last_price(figi):
+def get_last_price(session, figi):
     """Получает последнюю цену по FIGI."""
-    with Client(TOKEN) as client:
-        last_price = client.market_data.get_last_prices(figi=figi).last_prices[0].price
-        return float(last_price.units + last_price.nano / 1e9)
+    return session.get_last_price(figi)
 
 def main():
     logging.info("[seller.py] Запуск скрипта для закрытия позиций")
@@ -132,41 +117,43 @@ def main():
     positions = get_positions()
     if not positions:
         logging.info("[seller.py] Нет открытых позиций для закрытия")
-        send_telegram_message("*[seller.py] Нет открытых позиций для закрытия*")
+        telegram_outbox.enqueue("*[seller.py] Нет открытых позиций для закрытия*", source="seller")
         return
 
     results = []
 
-    for ticker, avg_price, quantity, created_at in positions:
-        figi = get_figi_by_ticker(ticker)
-        if not figi:
-            logging.warning(f"[seller.py] Не найден FIGI для тикера {ticker}")
-            continue
+    # Один канал API и один поиск счёта на все продажи (реальный счёт, первый счёт пользователя)
+    with BrokerSession(sandbox=False, account_id=None) as session:
+        for ticker, avg_price, quantity, created_at in positions:
+            figi = get_figi_by_ticker(session, ticker)
+            if not figi:
+                logging.warning(f"[seller.py] Не найден FIGI для тикера {ticker}")
+                continue
 
-        # Получаем текущую цену (через последнюю свечу или ордербуку)
-        # Для примера используем цену закрытия последней свечи (заменить на актуальную)
+            # Получаем текущую цену (через последнюю свечу или ордербуку)
+            # Для примера используем цену закрытия последней свечи (заменить на актуальную)
 #        exit_price = Decimal(100.00)  # ← здесь должна быть реальная цена из API
-        exit_price = Decimal(get_last_price(figi))
-
-        # Выполняем продажу
-        try:
-            sell_position(figi, quantity, exit_price)
-            logging.info(f"[seller.py] Продано {quantity} шт. {ticker} по {exit_price:.2f} руб.")
-        except Exception as e:
-            logging.error(f"[seller.py] Ошибка при продаже {ticker}: {e}")
-            continue
-
-        # Обновляем БД
-        update_position_db(ticker)
-
-        # Сохраняем данные для отчета
-        results.append({
-            'ticker': ticker,
-            'entry_price': avg_price,
-            'exit_price': exit_price,
-            'entry_date': created_at,
-            'exit_date': datetime.datetime.now()
-        })
+            exit_price = Decimal(get_last_price(session, figi))
+
+            # Выполняем продажу
+            try:
+                sell_position(session, figi, quantity, exit_price)
+                logging.info(f"[seller.py] Продано {quantity} шт. {ticker} по {exit_price:.2f} руб.")
+            except Exception as e:
+                logging.error(f"[seller.py] Ошибка при продаже {ticker}: {e}")
+                continue
+
+            # Обновляем БД
+            update_position_db(ticker)
+
+            # Сохраняем данные для отчета
+            results.append({
+                'ticker': ticker,
+                'entry_price': avg_price,
+                'exit_price': exit_price,
+                'entry_date': created_at,
+                'exit_date': datetime.datetime.now()
+            })
 
     # Отправляем отчет
     if results:
@@ -175,5 +162,16 @@ def main():
     logging.info("[seller.py] Все позиции закрыты")
 
 
+def run():
+    """Закрытие всех позиций (запуск скрипта или вызов из другого модуля)"""
+    setup_logging()
+    try:
+        migrations.ensure_schema()
+        main()
+    finally:
+        # Скрипт запускается отдельно от main.py: отчёт о продажах отправляется сразу
+        telegram_outbox.send_now()
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run()
\ No newline at end of file
@@ -0,0 +1,171 @@
+"""
+signal_engine.py
+
+Назначение: Векторный расчёт сигналов ВНИМАНИЕ / КУПИ / ДОКУПИ / ПРОДАЙ.
+Котировки всех тикеров складываются в панель (тикеры × свечи) — двумерные
+массивы NumPy, выровненные по последней свече, — и все четыре правила
+считаются операциями над массивами сразу по всем тикерам, без цикла по строкам.
+
+Правила и результат совпадают с построчной проверкой
+signals_processor.evaluate_ticker (сверка: python signals_processor.py --validate).
+
+Используется:
+- signals_processor.py
+"""
+
+import numpy as np
+import pandas as pd
+from signal_state import POSITION_LOT
+
+SIGNAL_TYPES = ["ВНИМАНИЕ", "КУПИ", "ДОКУПИ", "ПРОДАЙ"]
+PANEL_COLUMNS = ['open', 'close', 'sma', 'lower_band']
+SIGNAL_COLUMNS = ['ticker', 'signal_type', 'date', 'price', 'parent_date']
+
+
+def build_panel(quotes, tickers):
+    """
+    Собирает панель котировок: для каждой колонки — массив (тикеры × свечи).
+
+    Свечи выровнены вправо: последний столбец — последняя свеча каждого тикера,
+    у тикеров с более короткой историей слева NaN / NaT.
+
+    Args:
+        quotes: dict тикер -> DataFrame (date + PANEL_COLUMNS) по возрастанию даты
+        tickers: порядок тикеров (строк панели)
+
+    Returns:
+        dict: колонка -> np.ndarray, а также 'date' (datetime64) и 'rows' (число свечей тикера)
+    """
+    frames = {ticker: quotes[ticker][['date'] + PANEL_COLUMNS]
+              for ticker in tickers if ticker in quotes and not quotes[ticker].empty}
+    rows = np.zeros(len(tickers), dtype=int)
+    if not frames:
+        panel = {column: np.full((len(tickers), 0), np.nan) for column in PANEL_COLUMNS}
+        panel['date'] = np.full((len(tickers), 0), np.datetime64('NaT'), dtype='datetime64[ns]')
+        panel['rows'] = rows
+        return panel
+
+    long = pd.concat(frames, names=['ticker', 'row']).reset_index(level='ticker')
+    row_index = pd.Categorical(long['ticker'], categories=tickers).codes
+    from_end = long.groupby('ticker', sort=False).cumcount(ascending=False).to_numpy()
+    width = int(from_end.max()) + 1
+    column_index = width - 1 - from_end
+
+    panel = {}
+    for column in PANEL_COLUMNS:
+        values = np.full((len(tickers), width), np.nan)
+        values[row_index, column_index] = long[column].to_numpy(dtype=float)
+        panel[column] = values
+    dates = np.full((len(tickers), width), np.datetime64('NaT'), dtype='datetime64[ns]')
+    dates[row_index, column_index] = pd.to_datetime(long['date']).to_numpy()
+    panel['date'] = dates
+    np.add.at(rows, row_index, 1)
+    panel['rows'] = rows
+    return panel
+
+
+def _first_true(mask):
+    """Индекс первого True в каждой строке и признак, что он есть"""
+    return mask.argmax(axis=1), mask.any(axis=1)
+
+
+def _to_day(value):
+    """np.datetime64 -> date (None для NaT)"""
+    return None if np.isnat(value) else pd.Timestamp(value).date()
+
+
+def evaluate_signals(quotes, tickers, state, attention):
+    """
+    Вычисляет сигналы по всем тикерам сразу.
+
+    Args:
+        quotes: dict тикер -> DataFrame последних свечей (как get_last_n_days_batch)
+        tickers: список тикеров (порядок сигналов в результате)
+        state: снимок SignalState (только чтение)
+        attention: состояние ВНИМАНИЕ по тикерам — PositionState.state
+                   (тикер -> {'status', 'date', 'price'}), только чтение
+
+    Returns:
+        pd.DataFrame: сигналы (SIGNAL_COLUMNS) в том порядке, в котором их выдаёт
+                      построчная проверка: по тикерам, внутри тикера — по SIGNAL_TYPES.
+                      price — close свечи для ВНИМАНИЕ, open для остальных сигналов
+    """
+    panel = build_panel(quotes, tickers)
+    close, sma, lower, open_ = panel['close'], panel['sma'], panel['lower_band'], panel['open']
+    days = panel['date'].astype('datetime64[D]')
+    count, width = close.shape
+    rows = np.arange(count)
+    columns = np.arange(width)
+    valid = panel['rows'] >= 2
+    if width == 0:
+        return pd.DataFrame(columns=SIGNAL_COLUMNS)
+
+    # === Сигнал 1: ВНИМАНИЕ ===
+    # Последнее пересечение SMA сверху вниз, затем первая свеча не раньше него с close ниже нижней полосы
+    crossed = np.zeros((count, width), dtype=bool)
+    crossed[:, 1:] = (close[:, 1:] < sma[:, 1:]) & (close[:, :-1] >= sma[:, :-1])
+    has_cross = crossed.any(axis=1)
+    last_cross = width - 1 - crossed[:, ::-1].argmax(axis=1)
+    below = (close < lower) & (columns >= last_cross[:, None]) & has_cross[:, None]
+    attention_index, has_attention = _first_true(below)
+    attention_day = days[rows, attention_index]
+    attention_close = close[rows, attention_index]
+    candidates = np.flatnonzero(valid & has_attention)
+    new_attention = np.zeros(count, dtype=bool)
+    new_attention[candidates] = [not state.has_active_attention(tickers[i], _to_day(attention_day[i]))
+                                 for i in candidates]
+
+    # Состояние ВНИМАНИЕ после первого правила
+    prior = [attention.get(ticker) for ticker in tickers]
+    in_attention = np.array([item is not None and item['status'] == 'attention' for item in prior], dtype=bool)
+    state_day = np.array([np.datetime64(item['date'], 'D') if item is not None else np.datetime64('NaT')
+                          for item in prior], dtype='datetime64[D]')
+    state_price = np.array([item['price'] if item is not None else np.nan for item in prior], dtype=float)
+    in_attention |= new_attention
+    state_day = np.where(new_attention, attention_day, state_day)
+    state_price = np.where(new_attention, attention_close, state_price)
+
+    # === Сигнал 2: КУПИ ===
+    # Свеча ВНИМАНИЕ (дата и close), затем первая следующая свеча ниже её close и не выше SMA
+    matched = (days == state_day[:, None]) & (close == state_price[:, None]) & in_attention[:, None]
+    matched_index, has_match = _first_true(matched)
+    candidates = np.flatnonzero(valid & has_match)
+    not_bought = np.zeros(count, dtype=bool)
+    not_bought[candidates] = [not state.was_buy_received(tickers[i], _to_day(state_day[i])) for i in candidates]
+    entry = (close < state_price[:, None]) & (close <= sma) & (columns > matched_index[:, None])
+    buy_index, has_entry = _first_true(entry)
+    buy = valid & has_match & not_bought & has_entry
+    buy_open = open_[rows, buy_index]
+
+    # Позиции после КУПИ (та же формула усреднения, что и в SignalState.update_position)
+    positions = [state.positions.get(ticker) for ticker in tickers]
+    has_position = np.array([item is not None for item in positions], dtype=bool)
+    avg_price = np.array([float(item['avg_price']) if item is not None and item['avg_price'] is not None else np.nan
+                          for item in positions])
+    quantity = np.array([item['quantity'] if item is not None and item['quantity'] is not None else np.nan
+                         for item in positions], dtype=float)
+    in_market = np.array([bool(item is not None and item['in_market']) for item in positions], dtype=bool)
+    averaged = (avg_price * quantity + buy_open * POSITION_LOT) / (quantity + POSITION_LOT)
+    averaged = np.where(np.isnan(averaged), avg_price, averaged)
+    avg_price = np.where(buy, np.where(has_position, averaged, buy_open), avg_price)
+    in_market = in_market | buy
+
+    # === Сигналы 3 и 4: ДОКУПИ и ПРОДАЙ — по последней свече ===
+    latest_close, latest_sma, latest_open = close[:, -1], sma[:, -1], open_[:, -1]
+    add = valid & in_market & (latest_close < avg_price)
+    sold_today = np.array([state.was_sold_today(ticker) for ticker in tickers], dtype=bool)
+    sell = valid & in_market & ~sold_today & (latest_close > latest_sma)
+
+    latest_day = days[:, -1]
+    signals = []
+    for order, (signal_type, mask, signal_day, price, parent_day) in enumerate([
+        ("ВНИМАНИЕ", new_attention & valid, attention_day, attention_close, None),
+        ("КУПИ", buy, days[rows, buy_index], buy_open, state_day),
+        ("ДОКУПИ", add, latest_day, latest_open, None),
+        ("ПРОДАЙ", sell, latest_day, latest_open, None),
+    ]):
+        for i in np.flatnonzero(mask):
+            signals.append((i, order, tickers[i], signal_type, _to_day(signal_day[i]), price[i],
+                            _to_day(parent_day[i]) if parent_day is not None else None))
+    signals.sort(key=lambda item: item[:2])
+    return pd.DataFrame([item[2:] for item in signals], columns=SIGNAL_COLUMNS)
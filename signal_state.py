@@ -0,0 +1,224 @@
+"""
+signal_state.py
+
+Назначение: Снимок состояния сигналов и позиций для signals_processor.
+Активные сигналы (signals_log), позиции (positions) и отметки последней проверенной
+свечи тикеров (signal_watermarks) читаются из БД один раз
+в начале прогона, все проверки по тикерам выполняются по снимку в памяти,
+а новые сигналы, изменения позиций и деактивации накапливаются и записываются
+в конце прогона одной транзакцией (одним обращением к БД).
+
+Используется:
+- signals_processor.py
+"""
+
+from datetime import date
+from decimal import Decimal
+import pandas as pd
+import db
+
+# Количество бумаг, добавляемых в позицию по сигналу КУПИ / ДОКУПИ
+POSITION_LOT = 10
+
+
+class SignalState:
+    """
+    Состояние сигналов и позиций в памяти.
+
+    Методы чтения повторяют прежние точечные запросы к БД, методы записи
+    сразу меняют снимок (чтобы следующие проверки в этом прогоне видели изменения)
+    и ставят SQL-операцию в очередь для flush().
+    """
+
+    def __init__(self):
+        self.active_attention = set()  # (ticker, signal_date) активных ВНИМАНИЕ
+        self.bought_attention = set()  # (ticker, signal_date) ВНИМАНИЕ, к которым привязан КУПИ
+        self.sold_today = set()  # тикеры с сигналом ПРОДАЙ за CURRENT_DATE
+        self.positions = {}  # ticker -> {'avg_price', 'quantity', 'in_market'}
+        self.watermarks = {}  # ticker -> (дата, close) последней проверенной свечи
+        self.pending = []  # очередь операций (SQL, параметры)
+
+    # === Загрузка ===
+
+    def load(self):
+        """Читает активные сигналы и позиции из БД за одно подключение"""
+        with db.transaction() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, ticker, signal_type, signal_date, is_active, parent_id
+                    FROM signals_log
+                    WHERE signal_type = 'ВНИМАНИЕ'
+                       OR (signal_type = 'КУПИ' AND parent_id IS NOT NULL)
+                       OR (signal_type = 'ПРОДАЙ' AND signal_date = CURRENT_DATE)
+                    ORDER BY id
+                """)
+                signals = cur.fetchall()
+                cur.execute("SELECT ticker, avg_price, quantity, in_market FROM positions")
+                positions = cur.fetchall()
+                cur.execute("SELECT ticker, candle_date, candle_close FROM signal_watermarks")
+                watermarks = cur.fetchall()
+
+        attention_by_id = {}
+        for signal_id, ticker, signal_type, signal_date, is_active, parent_id in signals:
+            if signal_type == 'ВНИМАНИЕ':
+                attention_by_id[signal_id] = (ticker, signal_date)
+                if is_active:
+                    self.active_attention.add((ticker, signal_date))
+            elif signal_type == 'ПРОДАЙ':
+                self.sold_today.add(ticker)
+        for signal_id, ticker, signal_type, signal_date, is_active, parent_id in signals:
+            if signal_type == 'КУПИ' and parent_id in attention_by_id:
+                self.bought_attention.add(attention_by_id[parent_id])
+
+        for ticker, avg_price, quantity, in_market in positions:
+            self.positions[ticker] = {'avg_price': avg_price, 'quantity': quantity, 'in_market': in_market}
+        for ticker, candle_date, candle_close in watermarks:
+            self.watermarks[ticker] = (pd.Timestamp(candle_date), float(candle_close))
+        return self
+
+    # === Чтение ===
+
+    def has_active_attention(self, ticker, signal_date):
+        """Есть ли активный сигнал ВНИМАНИЕ за указанную дату"""
+        return (ticker, signal_date) in self.active_attention
+
+    def was_buy_received(self, ticker, attention_date):
+        """Есть ли сигнал КУПИ, привязанный к ВНИМАНИЕ за указанную дату"""
+        return (ticker, attention_date) in self.bought_attention
+
+    def get_position(self, ticker):
+        """Возвращает (avg_price, in_market) позиции тикера"""
+        position = self.positions.get(ticker)
+        if position is None:
+            return None, False
+        return position['avg_price'], position['in_market']
+
+    def was_sold_today(self, ticker):
+        """Был ли сегодня сигнал ПРОДАЙ"""
+        return ticker in self.sold_today
+
+    def is_evaluated(self, ticker, candle_date, candle_close):
+        """Проверялась ли уже эта свеча тикера (дата и close совпадают с отметкой)"""
+        return self.watermarks.get(ticker) == (pd.Timestamp(candle_date), float(candle_close))
+
+    def active_attention_dates(self):
+        """Возвращает активные сигналы ВНИМАНИЕ: список (ticker, signal_date)"""
+        return sorted(self.active_attention)
+
+    # === Запись (в очередь) ===
+
+    def log_signal(self, ticker, signal_type, signal_date, parent_date=None):
+        """
+        Ставит в очередь запись сигнала.
+
+        Args:
+            parent_date: дата родительского ВНИМАНИЕ (для КУПИ). id родителя определяется
+                         при записи, поэтому родитель может быть создан в этом же прогоне
+        """
+        if parent_date is None:
+            self.pending.append(("""
+                INSERT INTO signals_log (ticker, signal_type, signal_date)
+                VALUES (%s, %s, %s)
+                ON CONFLICT DO NOTHING
+            """, (ticker, signal_type, signal_date)))
+        else:
+            self.pending.append(("""
+                INSERT INTO signals_log (ticker, signal_type, signal_date, parent_id)
+                VALUES (%s, %s, %s, (
+                    SELECT id FROM signals_log
+                    WHERE ticker = %s AND signal_type = 'ВНИМАНИЕ' AND signal_date = %s
+                    ORDER BY id
+                    LIMIT 1
+                ))
+                ON CONFLICT DO NOTHING
+            """, (ticker, signal_type, signal_date, ticker, parent_date)))
+
+        if signal_type == 'ВНИМАНИЕ':
+            self.active_attention.add((ticker, signal_date))
+        elif signal_type == 'КУПИ' and parent_date is not None:
+            self.bought_attention.add((ticker, parent_date))
+        elif signal_type == 'ПРОДАЙ' and signal_date == date.today():
+            self.sold_today.add(ticker)
+
+    def update_position(self, ticker, price):
+        """Добавляет POSITION_LOT бумаг по цене price к позиции (усреднение цены) и отмечает её открытой"""
+        self.pending.append(("""
+            INSERT INTO positions (ticker, buy_level, avg_price, quantity, in_market, updated_at)
+            VALUES (%s, %s, %s, %s, TRUE, NOW())
+            ON CONFLICT (ticker) DO UPDATE SET
+                avg_price = (
+                    (positions.avg_price * positions.quantity + EXCLUDED.avg_price * EXCLUDED.quantity) /
+                    (positions.quantity + EXCLUDED.quantity)
+                ),
+                quantity = positions.quantity + EXCLUDED.quantity,
+                updated_at = NOW(),
+                in_market = TRUE
+        """, (ticker, price, price, POSITION_LOT)))
+
+        price = Decimal(str(price))
+        position = self.positions.get(ticker)
+        if position is None:
+            self.positions[ticker] = {'avg_price': price, 'quantity': POSITION_LOT, 'in_market': True}
+            return
+        if position['avg_price'] is not None and position['quantity'] is not None:
+            position['avg_price'] = (
+                (position['avg_price'] * position['quantity'] + price * POSITION_LOT) /
+                (position['quantity'] + POSITION_LOT)
+            )
+        if position['quantity'] is not None:
+            position['quantity'] += POSITION_LOT
+        position['in_market'] = True
+
+    def close_position(self, ticker):
+        """Отмечает позицию закрытой"""
+        self.pending.append(("""
+            UPDATE positions
+            SET in_market = FALSE, updated_at = NOW()
+            WHERE ticker = %s
+        """, (ticker,)))
+        if ticker in self.positions:
+            self.positions[ticker]['in_market'] = False
+
+    def deactivate_related_signals(self, ticker):
+        """Деактивирует сигналы ВНИМАНИЕ, КУПИ, ДОКУПИ тикера после продажи"""
+        self.pending.append(("""
+            UPDATE signals_log
+            SET is_active = FALSE
+            WHERE ticker = %s
+              AND signal_type IN ('ВНИМАНИЕ', 'КУПИ', 'ДОКУПИ')
+              AND is_active = TRUE
+        """, (ticker,)))
+        self.active_attention = {key for key in self.active_attention if key[0] != ticker}
+
+    def set_watermark(self, ticker, candle_date, candle_close):
+        """Отмечает последнюю проверенную свечу тикера"""
+        candle_date, candle_close = pd.Timestamp(candle_date), float(candle_close)
+        self.pending.append(("""
+            INSERT INTO signal_watermarks (ticker, candle_date, candle_close, evaluated_at)
+            VALUES (%s, %s, %s, NOW())
+            ON CONFLICT (ticker) DO UPDATE SET
+                candle_date = EXCLUDED.candle_date,
+                candle_close = EXCLUDED.candle_close,
+                evaluated_at = NOW()
+        """, (ticker, candle_date.to_pydatetime(), candle_close)))
+        self.watermarks[ticker] = (candle_date, candle_close)
+
+    # === Сохранение ===
+
+    def flush(self):
+        """
+        Записывает накопленные операции одной транзакцией: все операции отправляются
+        в БД одним пакетом в порядке постановки в очередь.
+
+        Returns:
+            int: количество записанных операций
+        """
+        if not self.pending:
+            return 0
+        with db.transaction() as conn:
+            with conn.cursor() as cur:
+                batch = b";\n".join(cur.mogrify(query, params) for query, params in self.pending)
+                cur.execute(batch)
+        count = len(self.pending)
+        self.pending = []
+        return count
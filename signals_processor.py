@@ -10,81 +10,75 @@ signals_processor.py
 - "Продай" → цена выше SMA(20)
 """
 
-import psycopg2
+import argparse
+import copy
 import pandas as pd
 from datetime import datetime
-from tqdm import tqdm
-from config import DB_CONFIG, TICKERS
-from telegram_bot import send_telegram_message
+from config import TICKERS, COLUMNAR_STORE
+import telegram_outbox
+import quotes_storage
+from signal_state import SignalState
+import signal_engine
+import db
+import migrations
+import columnar_store
 import time
 
 N = 5  # Количество дней истории (влево) для проверки наличия сигнала ВНИМАНИЕ
 
 
-# Задержка в отправке сообщений
-def send_with_delay(message):
-    try:
-        send_telegram_message(message)
-        time.sleep(3)  # Задержка 3 секунды между сообщениями
-    except Exception as e:
-        print(f"Ошибка при отправке сообщения: {e}")
-        time.sleep(5)  # Увеличиваем задержку при ошибке
-
-
-# Сообщение о начале анализа сигналов
-msg = "* ПЕСОЧНИЦА Начинаем анализ сигналов*"
-send_with_delay(msg)
-print(msg)
-
-
 def connect():
-    """Подключение к базе данных PostgreSQL"""
-    return psycopg2.connect(**DB_CONFIG)
-
-
-# Создаёт таблицу для хранения сигналов
-def create_signals_log_table():
-    with connect() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS signals_log (
-                    id SERIAL PRIMARY KEY,
-                    ticker TEXT NOT NULL,
-                    signal_type TEXT NOT NULL,
-                    signal_date DATE NOT NULL,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    parent_id INTEGER REFERENCES signals_log(id),
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    UNIQUE(ticker, signal_type, signal_date, parent_id)
-                )
-            """)
-            conn.commit()
+    """Транзакция на соединении из общего пула (COMMIT в конце блока with)"""
+    return db.transaction()
 
 
 def get_last_n_days(ticker, n=N):
     """Получает последние N дней котировок по тикеру"""
-    table_name = f"quotes_{ticker.lower()}"
-    query = f"""
-        SELECT date, open, high, low, close, volume, sma, upper_band, lower_band
-        FROM {table_name}
-        WHERE date <= CURRENT_DATE
-        ORDER BY date DESC
-        LIMIT %s
-    """
     try:
-        with psycopg2.connect(**DB_CONFIG) as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(query, (n,))
-                columns = [desc[0] for desc in cursor.description]
-                data = cursor.fetchall()
-                df = pd.DataFrame(data, columns=columns)
-                df['date'] = pd.to_datetime(df['date'])  # Гарантируем тип datetime
-                return df.sort_values('date').reset_index(drop=True)
+        if COLUMNAR_STORE['read']:
+            return columnar_store.read_last_n(ticker, n, until_today=True)
+        with connect() as conn:
+            df = quotes_storage.read_last_n(conn, ticker, n, until_today=True)
+            df['date'] = pd.to_datetime(df['date'])  # Гарантируем тип datetime
+            return df.sort_values('date').reset_index(drop=True)
     except Exception as e:
         print(f"Ошибка при загрузке данных для {ticker}: {e}")
         return pd.DataFrame()
 
 
+def get_last_n_days_batch(tickers, n=N):
+    """
+    Получает последние N дней котировок сразу по всем тикерам одним запросом.
+    Ошибка чтения не подменяется пустым результатом (иначе прогон выглядел бы
+    как «сигналов нет»), а передаётся вызывающему коду.
+
+    Returns:
+        dict: тикер -> DataFrame в том же виде, что возвращает get_last_n_days
+    """
+    if COLUMNAR_STORE['read']:
+        return {ticker: columnar_store.read_last_n(ticker, n, until_today=True) for ticker in tickers}
+    with connect() as conn:
+        panel = quotes_storage.read_last_n_batch(conn, tickers, n, until_today=True)
+    return {ticker: df.reset_index(level='ticker', drop=True).reset_index()
+            for ticker, df in panel.groupby(level='ticker', sort=False)}
+
+
+def get_latest_candles(tickers):
+    """
+    Последняя сохранённая свеча каждого тикера (одним запросом).
+
+    Returns:
+        dict: тикер -> (дата, close); тикеры без котировок пропускаются
+    """
+    if COLUMNAR_STORE['read']:
+        frames = {ticker: columnar_store.read_last_n(ticker, 1, columns=['date', 'close'], until_today=True)
+                  for ticker in tickers}
+        return {ticker: (df['date'].iloc[-1], df['close'].iloc[-1]) for ticker, df in frames.items() if not df.empty}
+    with connect() as conn:
+        panel = quotes_storage.read_last_n_batch(conn, tickers, 1, columns=['date', 'close'], until_today=True)
+    return {ticker: (candle_date, close) for (ticker, candle_date), close in panel['close'].items()}
+
+
 # Класс определяющий порядок поступления сигналов
 class PositionState:
     def __init__(self):
@@ -118,86 +112,17 @@ def calculate_harmonic_avg(prices):
         return None
 
 
-def create_positions_table():
-    """Создаёт таблицу для хранения открытых позиций и истории покупок"""
-    with connect() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS positions (
-                    id SERIAL PRIMARY KEY,
-                    ticker TEXT NOT NULL UNIQUE,
-                    buy_level NUMERIC,
-                    avg_price NUMERIC,
-                    quantity INT DEFAULT 10,
-                    in_market BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    updated_at TIMESTAMP
-                )
-            """)
-            conn.commit()
-
-
-def log_signal(ticker, signal_type, signal_date, parent_id=None):
-    """Записывает сигнал в таблицу signals_log с указанием родительского сигнала"""
-    with connect() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO signals_log (ticker, signal_type, signal_date, parent_id)
-                VALUES (%s, %s, %s, %s)
-            """, (ticker, signal_type, signal_date, parent_id))
-            conn.commit()
-
-
-def has_active_attention_signal(ticker, date):
-    """
-    Проверяет, есть ли активный сигнал "ВНИМАНИЕ" для указанной даты
+def select_changed_tickers(state, tickers):
     """
-    with connect() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT 1 FROM signals_log
-                WHERE ticker = %s AND signal_type = 'ВНИМАНИЕ'
-                  AND signal_date = %s AND is_active = TRUE
-                LIMIT 1
-            """, (ticker, date))
-            return cur.fetchone() is not None
-
+    Отбирает тикеры для проверки сигналов.
 
-def deactivate_related_signals(ticker):
+    Тикер проверяется, если его последняя свеча новее отметки прошлой проверки
+    или изменилась (дневная свеча дописывается в течение дня), а также при открытой
+    позиции — ДОКУПИ / ПРОДАЙ зависят от состояния позиции, а не только от новых свечей.
     """
-    Деактивирует все связанные сигналы после продажи
-    """
-    with connect() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE signals_log
-                SET is_active = FALSE
-                WHERE ticker = %s
-                  AND signal_type IN ('ВНИМАНИЕ', 'КУПИ', 'ДОКУПИ')
-                  AND is_active = TRUE
-            """, (ticker,))
-            conn.commit()
-
-
-def was_buy_signal_received(ticker, attention_date):
-    """
-    Проверяет, есть ли сигнал 'КУПИ', который прямо ссылается на этот конкретный 'ВНИМАНИЕ'
-    """
-    with connect() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT 1 FROM signals_log
-                WHERE ticker = %s 
-                  AND signal_type = 'КУПИ'
-                  AND parent_id IN (
-                      SELECT id FROM signals_log
-                      WHERE ticker = %s 
-                        AND signal_type = 'ВНИМАНИЕ'
-                        AND signal_date = %s
-                  )
-                LIMIT 1
-            """, (ticker, ticker, attention_date))
-            return cur.fetchone() is not None
+    latest = get_latest_candles(tickers)
+    return [ticker for ticker in tickers
+            if ticker in latest and (not state.is_evaluated(ticker, *latest[ticker]) or state.get_position(ticker)[1])]
 
 
 def find_trend_change(df):
@@ -209,60 +134,224 @@ def find_trend_change(df):
     return None
 
 
-def update_position(ticker, price):
-    """Обновляет или создаёт новую запись о позиции с флагом in_market = TRUE"""
-    with connect() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO positions (ticker, buy_level, avg_price, quantity, in_market, updated_at)
-                VALUES (%s, %s, %s, %s, TRUE, NOW())
-                ON CONFLICT (ticker) DO UPDATE SET
-                    avg_price = (
-                        (positions.avg_price * positions.quantity + EXCLUDED.avg_price * EXCLUDED.quantity) /
-                        (positions.quantity + EXCLUDED.quantity)
-                    ),
-                    quantity = positions.quantity + EXCLUDED.quantity,
-                    updated_at = NOW(),
-                    in_market = TRUE
-            """, (ticker, price, price, 10))
-            conn.commit()
-
-
-def load_active_attention_states():
-    """Загружает все активные сигналы 'ВНИМАНИЕ' из базы в position_state"""
-    with connect() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT ticker, signal_date
-                FROM signals_log
-                WHERE signal_type = 'ВНИМАНИЕ'
-                  AND is_active = TRUE
-            """)
-            rows = cur.fetchall()
-            for ticker, signal_date in rows:
-                df = get_last_n_days(ticker, n=100)  # Загружаем достаточно данных
-                if df.empty:
-                    continue
-                match = df[df['date'].dt.date == signal_date]
-                if not match.empty:
-                    close_price = match.iloc[0]['close']
-                    position_state.set_attention(ticker, signal_date, close_price)
-                    print(f"[i] Восстановлено состояние 'ВНИМАНИЕ' для {ticker} от {signal_date}: {close_price:.3f}")
-                else:
-                    print(f"[W] Для {ticker} сигнал 'ВНИМАНИЕ' от {signal_date} не найден в данных")
-
-
-def check_signals():
-    """Основной метод проверки сигналов"""
-    create_signals_log_table()
-    create_positions_table()
+def load_active_attention_states(state):
+    """Восстанавливает position_state по активным сигналам 'ВНИМАНИЕ' из снимка состояния"""
+    attention = state.active_attention_dates()
+    quotes = get_last_n_days_batch(sorted({ticker for ticker, _ in attention}), n=100)  # Загружаем достаточно данных
+    for ticker, signal_date in attention:
+        df = quotes.get(ticker, pd.DataFrame())
+        if df.empty:
+            continue
+        match = df[df['date'].dt.date == signal_date]
+        if not match.empty:
+            close_price = match.iloc[0]['close']
+            position_state.set_attention(ticker, signal_date, close_price)
+            print(f"[i] Восстановлено состояние 'ВНИМАНИЕ' для {ticker} от {signal_date}: {close_price:.3f}")
+        else:
+            print(f"[W] Для {ticker} сигнал 'ВНИМАНИЕ' от {signal_date} не найден в данных")
+
+
+def format_signal_message(signal_type, ticker, signal_date, price):
+    """Текст уведомления о сигнале (price — close для ВНИМАНИЕ, open для остальных)"""
+    if signal_type == "ВНИМАНИЕ":
+        return f"* ПЕСОЧНИЦА [!] ВНИМАНИЕ* ({ticker})\nДата: {signal_date}\nЦена: {price:.2f}"
+    marks = {"КУПИ": "[+]", "ДОКУПИ": "[~]", "ПРОДАЙ": "[-]"}
+    return f"* ПЕСОЧНИЦА {marks[signal_type]} {signal_type}* ({ticker})\nДата: {signal_date}\nЦель: {price:.2f} (по open завтра)"
+
+
+def evaluate_ticker(ticker, df, state, positions=None):
+    """
+    Построчная проверка правил сигналов для одного тикера по снимку состояния.
+    Основной расчёт выполняет signal_engine; функция оставлена как эталон для сверки (--validate).
+
+    Новые сигналы и изменения позиций ставятся в очередь state и меняют positions.
+
+    Args:
+        ticker: тикер
+        df: последние свечи тикера по возрастанию даты
+        state: снимок состояния SignalState
+        positions: PositionState (по умолчанию — position_state модуля)
+
+    Returns:
+        list: сигналы (тип сигнала, текст сообщения) в порядке срабатывания
+    """
+    if positions is None:
+        positions = position_state
+    signals = []
+    latest = df.iloc[-1]  # Последняя свеча — самая новая
+
+    # === Сигнал 1: ВНИМАНИЕ ===
+    trend_change_index = find_trend_change(df)
+    if trend_change_index is not None:
+        df_after_trend = df.iloc[trend_change_index:]
+        attention_rows = df_after_trend[df_after_trend['close'] < df_after_trend['lower_band']]
+        if not attention_rows.empty:
+            attention_row = attention_rows.iloc[0]
+            attention_date = attention_row['date'].date()
+
+            # Проверяем, есть ли уже активный сигнал "ВНИМАНИЕ"
+            if not state.has_active_attention(ticker, attention_date):
+                signals.append(("ВНИМАНИЕ", format_signal_message("ВНИМАНИЕ", ticker, attention_date, attention_row['close'])))
+                state.log_signal(ticker, "ВНИМАНИЕ", attention_date)
+                positions.set_attention(ticker, attention_date, attention_row['close'])
+
+    # === Сигнал 2: КУПИ ===
+    ticker_state = positions.get_state(ticker)
+    if ticker_state and ticker_state['status'] == 'attention':
+        attention_date = ticker_state['date']
+        attention_close = ticker_state['price']
+
+        # 🔧 Сравнение дат через .dt.date — теперь корректно!
+        attention_mask = (df['date'].dt.date == attention_date) & (df['close'] == attention_close)
+        if attention_mask.any():
+            attention_index = df.index[attention_mask][0]
+
+            # 🔧 Проверяем, был ли уже КУПИ, привязанный к этому ВНИМАНИЕ
+            if not state.was_buy_received(ticker, attention_date):
+                for i in range(attention_index + 1, len(df)):
+                    current_row = df.iloc[i]
+                    # ✅ Условие: цена ниже close ВНИМАНИЕ И не выше SMA на той же свече
+                    if current_row['close'] < attention_close and current_row['close'] <= current_row['sma']:
+                        # Записываем сигнал "КУПИ" с привязкой к родительскому "ВНИМАНИЕ"
+                        state.log_signal(ticker, "КУПИ", current_row['date'].date(), parent_date=attention_date)
+                        signals.append(("КУПИ", format_signal_message("КУПИ", ticker, current_row['date'].date(), current_row['open'])))
+                        state.update_position(ticker, current_row['open'])
+                        positions.set_in_market(ticker)
+                        break  # Выходим — берем первый подходящий сигнал
+
+    # === Сигнал 3: ДОКУПИ ===
+    avg_price, in_market = state.get_position(ticker)
+    if avg_price is not None and in_market and latest['close'] < avg_price:
+        signals.append(("ДОКУПИ", format_signal_message("ДОКУПИ", ticker, latest['date'].date(), latest['open'])))
+        state.update_position(ticker, latest['open'])
+        state.log_signal(ticker, "ДОКУПИ", latest['date'].date())
+
+    # === Сигнал 4: ПРОДАЙ ===
+    _, in_market = state.get_position(ticker)
+    if in_market and not state.was_sold_today(ticker) and latest['close'] > latest['sma']:
+        signals.append(("ПРОДАЙ", format_signal_message("ПРОДАЙ", ticker, latest['date'].date(), latest['open'])))
+        state.log_signal(ticker, "ПРОДАЙ", latest['date'].date())
+
+        # Деактивируем связанные сигналы и закрываем позицию
+        state.deactivate_related_signals(ticker)
+        state.close_position(ticker)
+        positions.reset(ticker)
+
+    return signals
+
+
+def apply_signals(signals, state, positions=None):
+    """
+    Ставит сигналы, рассчитанные signal_engine, в очередь state и обновляет positions —
+    те же изменения, что делает evaluate_ticker.
+
+    Returns:
+        list: (тикер, тип сигнала, текст сообщения) в порядке сигналов
+    """
+    if positions is None:
+        positions = position_state
+    messages = []
+    for signal in signals.itertuples(index=False):
+        ticker, signal_type, signal_date = signal.ticker, signal.signal_type, signal.date
+        if signal_type == "ВНИМАНИЕ":
+            state.log_signal(ticker, "ВНИМАНИЕ", signal_date)
+            positions.set_attention(ticker, signal_date, signal.price)
+        elif signal_type == "КУПИ":
+            state.log_signal(ticker, "КУПИ", signal_date, parent_date=signal.parent_date)
+            state.update_position(ticker, signal.price)
+            positions.set_in_market(ticker)
+        elif signal_type == "ДОКУПИ":
+            state.update_position(ticker, signal.price)
+            state.log_signal(ticker, "ДОКУПИ", signal_date)
+        elif signal_type == "ПРОДАЙ":
+            state.log_signal(ticker, "ПРОДАЙ", signal_date)
+            state.deactivate_related_signals(ticker)
+            state.close_position(ticker)
+            positions.reset(ticker)
+        messages.append((ticker, signal_type, format_signal_message(signal_type, ticker, signal_date, signal.price)))
+    return messages
+
+
+def validate_engine():
+    """
+    Сверяет signal_engine с построчной проверкой evaluate_ticker на текущих данных.
+    Оба расчёта выполняются на копиях состояния, в БД ничего не записывается.
+
+    Returns:
+        bool: True, если сигналы совпали
+    """
+    migrations.ensure_schema()
+    state = SignalState().load()
+    position_state.state.clear()
+    load_active_attention_states(state)
+    quotes = get_last_n_days_batch(TICKERS)
+
+    legacy_state, legacy_positions = copy.deepcopy(state), copy.deepcopy(position_state)
+    started = time.perf_counter()
+    legacy = []
+    for ticker in TICKERS:
+        df = quotes.get(ticker, pd.DataFrame())
+        if len(df) < 2:
+            continue
+        legacy.extend((ticker, signal_type, msg) for signal_type, msg in
+                      evaluate_ticker(ticker, df.copy(), legacy_state, legacy_positions))
+    legacy_time = time.perf_counter() - started
+
+    engine_state, engine_positions = copy.deepcopy(state), copy.deepcopy(position_state)
+    started = time.perf_counter()
+    signals = signal_engine.evaluate_signals(quotes, TICKERS, engine_state, engine_positions.state)
+    engine_time = time.perf_counter() - started
+    vectorized = apply_signals(signals, engine_state, engine_positions)
+
+    print(f"[i] Построчная проверка: {len(legacy)} сигналов за {legacy_time * 1000:.1f} мс, "
+          f"signal_engine: {len(vectorized)} сигналов за {engine_time * 1000:.1f} мс")
+    same = legacy == vectorized and legacy_positions.state == engine_positions.state
+    if same:
+        print("[i] Сигналы signal_engine совпадают с построчной проверкой")
+    else:
+        for item in legacy:
+            if item not in vectorized:
+                print(f"[W] Только в построчной проверке: {item[0]} {item[1]}")
+        for item in vectorized:
+            if item not in legacy:
+                print(f"[W] Только в signal_engine: {item[0]} {item[1]}")
+        print("[X] Сигналы signal_engine расходятся с построчной проверкой")
+    return same
+
+
+def check_signals(quotes=None, full=False):
+    """
+    Основной метод проверки сигналов.
+
+    Сигналы и позиции читаются из БД одним снимком, все изменения
+    записываются в конце прогона одной транзакцией.
+    Проверяются только тикеры, у которых появилась или изменилась свеча после прошлой
+    проверки (отметки в signal_watermarks), и тикеры с открытыми позициями.
+    Уведомления ставятся в очередь telegram_outbox одним запросом, отправку выполняет telegram_outbox.py.
+
+    Args:
+        quotes: уже загруженные котировки (dict тикер -> DataFrame, как get_last_n_days_batch);
+                по умолчанию загружаются из хранилища
+        full: проверить все тикеры, без отбора по отметкам
+
+    Returns:
+        dict: тип сигнала -> список тикеров
+    """
+    # Сообщение о начале анализа сигналов
+    msg = "* ПЕСОЧНИЦА Начинаем анализ сигналов*"
+    print(msg)
+    messages = [msg]
+
+    migrations.ensure_schema()
+
+    state = SignalState().load()
 
     # 🔧 ВОССТАНАВЛИВАЕМ ВСЕ АКТИВНЫЕ "ВНИМАНИЕ" ИЗ БАЗЫ ПРИ СТАРТЕ
     print(f"[i] Загружаем активные состояния из базы...")
-    load_active_attention_states()
+    position_state.state.clear()  # при повторном запуске в том же процессе
+    load_active_attention_states(state)
     print(f"[i] Загружено {len(position_state.state)} активных состояний 'ВНИМАНИЕ'")
 
-    signals_found = False
     signal_summary = {
         "ВНИМАНИЕ": [],
         "КУПИ": [],
@@ -270,134 +359,33 @@ def check_signals():
         "ПРОДАЙ": []
     }
 
-    for ticker in tqdm(TICKERS, desc="Проверка сигналов по тикерам"):
-        df = get_last_n_days(ticker)
-        if len(df) < 2:
-            continue
+    # Тикеры без новых свечей и без открытых позиций не перепроверяются
+    tickers = list(TICKERS) if full else select_changed_tickers(state, TICKERS)
+    print(f"[i] Тикеров к проверке: {len(tickers)} из {len(TICKERS)}")
 
-        latest = df.iloc[-1]  # Последняя свеча — самая новая
-        print(f"[i] {ticker}: последняя дата = {latest['date'].date()}")
-
-        # === Сигнал 1: ВНИМАНИЕ ===
-        trend_change_index = find_trend_change(df)
-        if trend_change_index is not None:
-            df_after_trend = df.iloc[trend_change_index:]
-            attention_rows = df_after_trend[df_after_trend['close'] < df_after_trend['lower_band']]
-            if not attention_rows.empty:
-                attention_row = attention_rows.iloc[0]
-                attention_date = attention_row['date'].date()
-
-                # Проверяем, есть ли уже активный сигнал "ВНИМАНИЕ"
-                if has_active_attention_signal(ticker, attention_date):
-                    pass  # Пропускаем, если уже есть
-                else:
-                    msg = f"* ПЕСОЧНИЦА [!] ВНИМАНИЕ* ({ticker})\nДата: {attention_date}\nЦена: {attention_row['close']:.2f}"
-                    send_with_delay(msg)
-                    print(msg)
-                    signals_found = True
-                    signal_summary["ВНИМАНИЕ"].append(ticker)
-                    log_signal(ticker, "ВНИМАНИЕ", attention_date)
-                    position_state.set_attention(ticker, attention_date, attention_row['close'])
-
-        # === Сигнал 2: КУПИ ===
-        state = position_state.get_state(ticker)
-        if state and state['status'] == 'attention':
-            attention_date = state['date']
-            attention_close = state['price']
-
-            # 🔧 Сравнение дат через .dt.date — теперь корректно!
-            attention_mask = (df['date'].dt.date == attention_date) & (df['close'] == attention_close)
-            if attention_mask.any():
-                attention_index = df.index[attention_mask][0]
-
-                # 🔧 Проверяем, был ли уже КУПИ, привязанный к этому ВНИМАНИЕ
-                if was_buy_signal_received(ticker, attention_date):
-                    pass  # Пропускаем, если уже есть связанный КУПИ
-                else:
-                    for i in range(attention_index + 1, len(df)):
-                        current_row = df.iloc[i]
-                        # ✅ Условие: цена ниже close ВНИМАНИЕ И не выше SMA на той же свече
-                        if current_row['close'] < attention_close and current_row['close'] <= current_row['sma']:
-                            # Получаем ID родительского сигнала "ВНИМАНИЕ"
-                            with connect() as conn:
-                                with conn.cursor() as cur:
-                                    cur.execute("""
-                                        SELECT id FROM signals_log
-                                        WHERE ticker = %s AND signal_type = 'ВНИМАНИЕ'
-                                        AND signal_date = %s
-                                    """, (ticker, attention_date))
-                                    result = cur.fetchone()
-                                    attention_signal_id = result[0] if result else None
-
-                            # Записываем сигнал "КУПИ" с правильным parent_id
-                            log_signal(ticker, "КУПИ", current_row['date'].date(), parent_id=attention_signal_id)
-
-                            msg = f"* ПЕСОЧНИЦА [+] КУПИ* ({ticker})\nДата: {current_row['date'].date()}\nЦель: {current_row['open']:.2f} (по open завтра)"
-                            send_with_delay(msg)
-                            print(msg)
-                            signals_found = True
-                            signal_summary["КУПИ"].append(ticker)
-                            update_position(ticker, current_row['open'])
-                            position_state.set_in_market(ticker)
-                            break  # Выходим — берем первый подходящий сигнал
-
-        # === Сигнал 3: ДОКУПИ ===
-        with connect() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT avg_price, in_market FROM positions WHERE ticker = %s", (ticker,))
-                result = cur.fetchone()
-                if result:
-                    avg_price, in_market = result
-                else:
-                    avg_price, in_market = None, False
-
-        if avg_price is not None and in_market and latest['close'] < avg_price:
-            msg = f"* ПЕСОЧНИЦА [~] ДОКУПИ* ({ticker})\nДата: {latest['date'].date()}\nЦель: {latest['open']:.2f} (по open завтра)"
-            send_with_delay(msg)
-            print(msg)
-            signals_found = True
-            signal_summary["ДОКУПИ"].append(ticker)
-            update_position(ticker, latest['open'])
-            log_signal(ticker, "ДОКУПИ", latest['date'].date())
-
-        # === Сигнал 4: ПРОДАЙ ===
-        with connect() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT p.avg_price, p.in_market, 
-                           (SELECT 1 FROM signals_log 
-                            WHERE ticker = %s AND signal_type = 'ПРОДАЙ' 
-                            AND signal_date = CURRENT_DATE LIMIT 1) as already_sold
-                    FROM positions p 
-                    WHERE p.ticker = %s
-                """, (ticker, ticker))
-                result = cur.fetchone()
-
-        avg_price = result[0] if result else None
-        in_market = result[1] if result else False
-        already_sold = result[2] if result else False
-
-        if in_market and not already_sold and latest['close'] > latest['sma']:
-            msg = f"* ПЕСОЧНИЦА [-] ПРОДАЙ* ({ticker})\nДата: {latest['date'].date()}\nЦель: {latest['open']:.2f} (по open завтра)"
-            send_with_delay(msg)
-            signals_found = True
-            signal_summary["ПРОДАЙ"].append(ticker)
-            log_signal(ticker, "ПРОДАЙ", latest['date'].date())
-            print(msg)
-
-            # Деактивируем связанные сигналы
-            deactivate_related_signals(ticker)
-
-            # Закрываем позицию в БД
-            with connect() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        UPDATE positions 
-                        SET in_market = FALSE, updated_at = NOW() 
-                        WHERE ticker = %s
-                    """, (ticker,))
-
-            position_state.reset(ticker)
+    # Котировки тикеров загружаются одним запросом
+    if quotes is None:
+        quotes = get_last_n_days_batch(tickers) if tickers else {}
+    else:
+        quotes = {ticker: quotes[ticker] for ticker in tickers if ticker in quotes}
+
+    # Правила считаются сразу по всей панели тикеров
+    signals = signal_engine.evaluate_signals(quotes, tickers, state, position_state.state)
+    print(f"[i] Проверено тикеров: {sum(len(df) >= 2 for df in quotes.values())}, сигналов: {len(signals)}")
+
+    for ticker, signal_type, msg in apply_signals(signals, state):
+        messages.append(msg)
+        print(msg)
+        signal_summary[signal_type].append(ticker)
+
+    # Отметки проверенных свечей пишутся той же транзакцией, что и сигналы
+    for ticker, df in quotes.items():
+        if not df.empty:
+            state.set_watermark(ticker, df['date'].iloc[-1], df['close'].iloc[-1])
+
+    # === Записываем все изменения одной транзакцией ===
+    saved = state.flush()
+    print(f"[i] Записано изменений сигналов и позиций: {saved}")
 
     # === Формируем и отправляем итоговое сообщение ===
     summary_lines = []
@@ -411,11 +399,31 @@ def check_signals():
         today = datetime.now().strftime("%Y-%m-%d")
         summary_text = f"* ПЕСОЧНИЦА [0] Сегодня {today} сигналов нет*"
 
+    messages.append(summary_text)
+
     try:
-        send_with_delay(summary_text)
+        queued = telegram_outbox.enqueue_many(messages, source="signals_processor")
+        print(f"[i] Сообщений поставлено в очередь Telegram: {queued}")
     except Exception as e:
-        print(f"[X] Ошибка при отправке итогового сообщения: {e}")
+        print(f"[X] Ошибка при постановке сообщений в очередь Telegram: {e}")
+
+    return signal_summary
+
+
+def run(quotes=None, full=False):
+    """Этап конвейера main.py: проверка сигналов по котировкам quotes (или загруженным из хранилища)"""
+    return check_signals(quotes, full)
 
 
 if __name__ == "__main__":
-    check_signals()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Проверка торговых сигналов")
+    parser.add_argument("--validate", action="store_true",
+                        help="сверить signal_engine с построчной проверкой, без записи в БД")
+    parser.add_argument("--all", action="store_true",
+                        help="проверить все тикеры, а не только изменившиеся с прошлой проверки")
+    args = parser.parse_args()
+    if args.validate:
+        validate_engine()
+    else:
+        run(full=args.all)
+    db.print_pool_stats()
\ No newline at end of file
@@ -17,14 +17,13 @@ import os
 from config import TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID
 
 # === Настройка логирования ===
-logging.basicConfig(level=logging.INFO)
+# Обработчики логов настраивает запускаемый скрипт (main.py), а не импорт модуля
 logger = logging.getLogger("TelegramBot")
+logger.setLevel(logging.INFO)
 
 
-def send_telegram_message(message):
-    """
-    Отправляет короткое сообщение в Telegram.
-    """
+def _request(message):
+    """Адрес метода sendMessage и тело запроса для чата TELEGRAM_CHAT_ID"""
     bot_token = os.getenv("TELEGRAM_BOT_TOKEN", TELEGRAM_BOT_TOKEN)
     chat_id = os.getenv("TELEGRAM_CHAT_ID", TELEGRAM_CHAT_ID)
 
@@ -35,12 +34,42 @@ def send_telegram_message(message):
         "parse_mode": "Markdown",
         "disable_notification": False
     }
+    return url, payload
+
+
+class TelegramSendError(Exception):
+    """Ошибка Bot API; retry_after — пауза (секунды), которую Telegram просит выдержать при ответе 429"""
 
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def post_message(message, timeout=30):
+    """
+    Отправляет одно сообщение и, в отличие от send_telegram_message, не глушит ошибки:
+    ответ с ошибкой превращается в TelegramSendError, сетевые ошибки пробрасываются.
+    """
+    url, payload = _request(message)
+    response = requests.post(url, json=payload, timeout=timeout)
+    if response.ok:
+        logger.info(f"[+] Сообщение успешно отправлено: {message[:50]}...")
+        return
     try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()  # Вызывает исключение для HTTP-ошибок
-        logger.info(f"[+] Сообщение успешно отправлено: {message[:50]}...")  # Логируем начало сообщения
-    except requests.exceptions.RequestException as e:
+        body = response.json()
+    except ValueError:
+        body = {}
+    retry_after = body.get("parameters", {}).get("retry_after")
+    raise TelegramSendError(f"HTTP {response.status_code}: {body.get('description', response.text[:200])}", retry_after)
+
+
+def send_telegram_message(message):
+    """
+    Отправляет короткое сообщение в Telegram. Ошибки только логируются.
+    """
+    try:
+        post_message(message)
+    except (requests.exceptions.RequestException, TelegramSendError) as e:
         error_msg = f"[X TELEGRAM] Ошибка при отправке сообщения: {e}"
         logger.error(error_msg, exc_info=True)
         print(error_msg)
@@ -51,23 +80,12 @@ def send_long_message(message):
     Отправляет длинное сообщение по частям (если превышает лимит Telegram).
     """
     MAX_MESSAGE_LENGTH = 4096  # Максимальная длина сообщения в Telegram
-    bot_token = os.getenv("TELEGRAM_BOT_TOKEN", TELEGRAM_BOT_TOKEN)
-    chat_id = os.getenv("TELEGRAM_CHAT_ID", TELEGRAM_CHAT_ID)
-
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
 
     for i in range(0, len(message), MAX_MESSAGE_LENGTH):
         part = message[i:i + MAX_MESSAGE_LENGTH]
-        payload = {
-            "chat_id": chat_id,
-            "text": part,
-            "parse_mode": "Markdown"
-        }
         try:
-            response = requests.post(url, json=payload)
-            response.raise_for_status()
-            logger.info(f"[+] Часть сообщения отправлена: {part[:50]}...")
-        except requests.exceptions.RequestException as e:
+            post_message(part)
+        except (requests.exceptions.RequestException, TelegramSendError) as e:
             error_msg = f"[X TELEGRAM] Ошибка при отправке части сообщения: {e}"
             logger.error(error_msg, exc_info=True)
 
@@ -2,22 +2,17 @@
 telegram_notifier.py
 
 Однократно проверяет наличие новых сигналов в БД,
-отправляет их в Telegram и завершает работу.
+ставит их в очередь Telegram (telegram_outbox) и завершает работу.
 """
 
-import time
-import psycopg2
-from telegram_bot import send_telegram_message
-from config import DB_CONFIG
-from tqdm import tqdm
-
-SEND_DELAY = 3
-ERROR_DELAY = 5
+import telegram_outbox
+import migrations
+import db
 
 
 def connect():
-    """Подключение к базе данных PostgreSQL"""
-    return psycopg2.connect(**DB_CONFIG)
+    """Транзакция на соединении из общего пула (COMMIT в конце блока with)"""
+    return db.transaction()
 
 
 def get_unsent_signals():
@@ -38,40 +33,25 @@ def get_unsent_signals():
             return cur.fetchall()
 
 
-def mark_as_sent(signal_id):
+def mark_as_sent(conn, signal_ids):
     """
-    Помечает сигнал как отправленный, записывая его ID в таблицу signals_sent
+    Помечает сигналы как отправленные, записывая их ID в таблицу signals_sent
+    (в транзакции conn, COMMIT выполняет вызывающий код)
     """
-    with connect() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO signals_sent (signal_id)
-                VALUES (%s)
-                ON CONFLICT (signal_id) DO NOTHING
-            """, (signal_id,))
-            conn.commit()
-
-
-def create_sent_table():
-    """
-    Создаёт таблицу signals_sent, если её нет
-    """
-    with connect() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS signals_sent (
-                    signal_id INT PRIMARY KEY
-                )
-            """)
-            conn.commit()
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO signals_sent (signal_id)
+            SELECT UNNEST(%s::INT[])
+            ON CONFLICT (signal_id) DO NOTHING
+        """, (list(signal_ids),))
 
 
 def send_queued_signals():
     """
-    Отправляет сигналы из БД в Telegram и завершает работу.
-    Подходит для однократного запуска через планировщик.
+    Ставит новые сигналы из БД в очередь Telegram и завершает работу.
+    Подходит для однократного запуска через планировщик; отправку выполняет telegram_outbox.py.
     """
-    create_sent_table()
+    migrations.ensure_schema()
     print("[+] Telegram Notifier: запущен")
 
     # Получаем список сигналов
@@ -81,23 +61,27 @@ def send_queued_signals():
         print("[-] Нет новых сигналов. Завершение работы.")
         return
 
-    print(f"[+] Найдено {len(signals)} новых сигналов. Отправка...")
+    print(f"[+] Найдено {len(signals)} новых сигналов. Постановка в очередь...")
+
+    messages = [f"* Сигнал {signal_type} ({ticker})\nДата: {signal_date}"
+                for _, ticker, signal_type, signal_date in signals]
+    try:
+        # Очередь и отметки об отправке записываются одной транзакцией:
+        # при сбое сигналы не попадут в очередь повторно
+        with connect() as conn:
+            telegram_outbox.enqueue_many(messages, source="telegram_notifier", conn=conn)
+            mark_as_sent(conn, (signal_id for signal_id, _, _, _ in signals))
+    except Exception as e:
+        print(f"[X] Ошибка при постановке сигналов в очередь: {e}")
+        return
 
-    # Отправляем каждый сигнал
-    for signal in tqdm(signals, desc="Отправка сигналов", unit="сигнал"):
-        signal_id, ticker, signal_type, signal_date = signal
-        message = f"* Сигнал {signal_type} ({ticker})\nДата: {signal_date}"
+    print("[V] Все сигналы поставлены в очередь. Работа завершена.")
 
-        try:
-            send_telegram_message(message)
-            mark_as_sent(signal_id)
-            time.sleep(SEND_DELAY)
-        except Exception as e:
-            tqdm.write(f"[X] Ошибка при отправке сигнала {signal_id}: {e}")
-            time.sleep(ERROR_DELAY)
 
-    print("[V] Все сигналы отправлены. Работа завершена.")
+def run():
+    """Этап конвейера main.py"""
+    send_queued_signals()
 
 
 if __name__ == "__main__":
-    send_queued_signals()
\ No newline at end of file
+    run()
\ No newline at end of file
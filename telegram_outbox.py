@@ -0,0 +1,265 @@
+"""
+telegram_outbox.py
+
+Назначение: Очередь исходящих сообщений Telegram в БД (таблица telegram_outbox)
+и фоновый отправитель.
+
+Модули (signals_processor, trader_executor, seller, telegram_notifier) не ждут Telegram:
+enqueue() только записывает сообщение в таблицу. Отправитель на asyncio забирает
+сообщения по порядку, соблюдает лимиты Telegram на чат (TELEGRAM_OUTBOX),
+повторяет неудачные отправки с растущей паузой и записывает статус доставки.
+Сообщения забираются из очереди с блокировкой (FOR UPDATE SKIP LOCKED) и статусом
+sending, поэтому несколько отправителей (--watch и этап main.py) не отправляют
+одно сообщение дважды.
+
+Запуск:
+    python telegram_outbox.py          — отправить накопленные сообщения и завершиться
+                                         (отложенные повторы — при следующем запуске)
+    python telegram_outbox.py --watch  — работать постоянно, отправляя новые сообщения
+"""
+
+import argparse
+import asyncio
+import time
+from collections import deque
+from telegram_bot import post_message, TelegramSendError
+from config import TELEGRAM_OUTBOX
+import migrations
+import db
+
+MAX_MESSAGE_LENGTH = 4096  # Максимальная длина сообщения в Telegram
+
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+
+def split_message(message):
+    """Делит длинное сообщение на части не длиннее MAX_MESSAGE_LENGTH"""
+    return [message[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(message), MAX_MESSAGE_LENGTH)] or [message]
+
+
+def enqueue_many(messages, source=None, conn=None):
+    """
+    Ставит сообщения в очередь одним запросом. Не ждёт отправки.
+
+    Args:
+        messages: тексты сообщений (длинные делятся на части)
+        source: имя модуля-отправителя (для статистики)
+        conn: соединение с открытой транзакцией вызывающего кода — запись в очередь
+              фиксируется вместе с ней (COMMIT выполняет вызывающий код);
+              если None — запись выполняется отдельной транзакцией
+
+    Returns:
+        int: количество записанных сообщений
+    """
+    parts = [part for message in messages for part in split_message(message)]
+    if not parts:
+        return 0
+    migrations.ensure_schema()
+    if conn is None:
+        with db.transaction() as own_conn:
+            return enqueue_many(messages, source, own_conn)
+    with conn.cursor() as cur:
+        values = b",".join(cur.mogrify("(%s, %s)", (source, part)) for part in parts)
+        cur.execute(b"INSERT INTO telegram_outbox (source, message) VALUES " + values)
+    return len(parts)
+
+
+def enqueue(message, source=None):
+    """Ставит одно сообщение в очередь (ошибка записи не прерывает работу модуля)"""
+    try:
+        enqueue_many([message], source)
+    except Exception as e:
+        print(f"[X TELEGRAM] Не удалось поставить сообщение в очередь: {e}")
+
+
+# === Отправитель ===
+
+class AsyncRateLimiter:
+    """
+    Ограничитель частоты для asyncio: не больше count сообщений за period секунд
+    по каждому окну из limits. pause() приостанавливает отправку (ответ 429 от Telegram).
+    """
+
+    def __init__(self, limits):
+        self.limits = limits  # [(count, period), ...]
+        self.window = max(period for _, period in limits)
+        self.sent = deque()
+        self.paused_until = 0.0
+
+    def _wait_time(self, current):
+        while self.sent and self.sent[0] <= current - self.window:
+            self.sent.popleft()
+        wait = self.paused_until - current
+        for count, period in self.limits:
+            recent = [stamp for stamp in self.sent if stamp > current - period]
+            if len(recent) >= count:
+                wait = max(wait, recent[len(recent) - count] + period - current)
+        return wait
+
+    async def acquire(self):
+        """Ждёт, пока отправка очередного сообщения не нарушит лимиты"""
+        while True:
+            wait = self._wait_time(time.monotonic())
+            if wait <= 0:
+                self.sent.append(time.monotonic())
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def fetch_due(limit):
+    """
+    Забирает сообщения, которые пора отправить, в порядке постановки в очередь.
+
+    Сообщения получают статус sending на TELEGRAM_OUTBOX['claim_timeout'] секунд:
+    другие отправители их пропускают, а если отправитель упал, не записав
+    результат, по истечении срока сообщение забирается снова.
+    """
+    with db.transaction() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE telegram_outbox
+                SET status = 'sending', next_attempt_at = NOW() + %s * INTERVAL '1 second'
+                WHERE id IN (
+                    SELECT id FROM telegram_outbox
+                    WHERE status IN ('pending', 'sending') AND next_attempt_at <= NOW()
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, message, attempts
+            """, (TELEGRAM_OUTBOX['claim_timeout'], limit))
+            return sorted(cur.fetchall())
+
+
+def seconds_to_next_due():
+    """Через сколько секунд наступит ближайшая повторная отправка (None — очередь пуста)"""
+    with db.transaction() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT EXTRACT(EPOCH FROM MIN(next_attempt_at) - NOW())
+                FROM telegram_outbox
+                WHERE status IN ('pending', 'sending')
+            """)
+            seconds = cur.fetchone()[0]
+    return None if seconds is None else max(0.0, float(seconds))
+
+
+def mark_sent(message_id):
+    with db.transaction() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE telegram_outbox
+                SET status = 'sent', attempts = attempts + 1, sent_at = NOW(), last_error = NULL
+                WHERE id = %s
+            """, (message_id,))
+
+
+def mark_failed(message_id, attempts, error):
+    """
+    Записывает неудачную попытку: сообщение откладывается с удваивающейся паузой,
+    после TELEGRAM_OUTBOX['max_attempts'] попыток получает статус failed.
+    """
+    attempts += 1
+    status = STATUS_FAILED if attempts >= TELEGRAM_OUTBOX['max_attempts'] else STATUS_PENDING
+    delay = TELEGRAM_OUTBOX['retry_delay'] * 2 ** (attempts - 1)
+    with db.transaction() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE telegram_outbox
+                SET status = %s, attempts = %s, last_error = %s,
+                    next_attempt_at = NOW() + %s * INTERVAL '1 second'
+                WHERE id = %s
+            """, (status, attempts, str(error)[:1000], delay, message_id))
+    return status
+
+
+async def deliver(limiter, message_id, message, attempts):
+    """
+    Отправляет одно сообщение с учётом лимитов. Ответ 429 (retry_after) не считается
+    попыткой: отправка приостанавливается на указанное Telegram время и повторяется.
+
+    Returns:
+        str: итоговый статус сообщения
+    """
+    while True:
+        await limiter.acquire()
+        try:
+            await asyncio.to_thread(post_message, message)
+        except TelegramSendError as e:
+            if e.retry_after:
+                print(f"[W] Telegram ограничил частоту, пауза {e.retry_after} с")
+                limiter.pause(e.retry_after)
+                continue
+            return await asyncio.to_thread(mark_failed, message_id, attempts, e)
+        except Exception as e:
+            return await asyncio.to_thread(mark_failed, message_id, attempts, e)
+        await asyncio.to_thread(mark_sent, message_id)
+        return STATUS_SENT
+
+
+async def run_sender(watch=False):
+    """
+    Отправляет сообщения из очереди.
+
+    Args:
+        watch: True — работать постоянно; False — завершиться, как только не останется
+               сообщений, которые пора отправить сейчас (отложенные повторы не дожидаются:
+               их отправит следующий запуск или отправитель --watch)
+
+    Returns:
+        dict: статус -> количество сообщений за запуск
+    """
+    await asyncio.to_thread(migrations.ensure_schema)
+    limiter = AsyncRateLimiter([
+        (TELEGRAM_OUTBOX['messages_per_second'], 1),
+        (TELEGRAM_OUTBOX['messages_per_minute'], 60),
+    ])
+    stats = {STATUS_SENT: 0, STATUS_PENDING: 0, STATUS_FAILED: 0}
+    while True:
+        batch = await asyncio.to_thread(fetch_due, TELEGRAM_OUTBOX['batch_size'])
+        for message_id, message, attempts in batch:
+            status = await deliver(limiter, message_id, message, attempts)
+            stats[status] += 1
+            if status != STATUS_SENT:
+                print(f"[W] Сообщение {message_id} не отправлено (статус {status})")
+        if batch:
+            continue
+        if not watch:
+            break
+        wait = await asyncio.to_thread(seconds_to_next_due)
+        await asyncio.sleep(min(wait if wait is not None else TELEGRAM_OUTBOX['poll_interval'],
+                                TELEGRAM_OUTBOX['poll_interval']))
+    print(f"[i] Telegram: отправлено {stats[STATUS_SENT]}, отложено попыток {stats[STATUS_PENDING]}, "
+          f"не доставлено {stats[STATUS_FAILED]}")
+    return stats
+
+
+def run(watch=False):
+    """Запускает отправитель (этап конвейера main.py)"""
+    return asyncio.run(run_sender(watch=watch))
+
+
+def send_now():
+    """
+    Однократно отправляет накопленные сообщения. Для скриптов, которые запускаются
+    отдельно от main.py (trader_executor, seller): их сообщения уходят сразу,
+    а не при следующем запуске конвейера. Ошибка отправки не прерывает работу скрипта.
+    """
+    try:
+        return run()
+    except Exception as e:
+        print(f"[X TELEGRAM] Не удалось отправить сообщения из очереди: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Отправка сообщений из очереди telegram_outbox")
+    parser.add_argument("--watch", action="store_true", help="работать постоянно, ожидая новые сообщения")
+    args = parser.parse_args()
+    run(watch=args.watch)
@@ -1,40 +1,49 @@
 """
 trader_executor.py
 Исполняет сделки на основе сигналов из БД.
-Работает только с таблицами: quotes_{ticker}, signals_log, positions, trade_logs.
+Работает только с таблицами: котировки (через quotes_storage), signals_log, positions, trade_logs.
 Не зависит от signals_processor.py.
 """
 
 import pandas as pd
-from tinkoff.invest import Client, OrderDirection, OrderType, AccountType
-from tinkoff.invest.sandbox.client import SandboxClient
-from config import TICKERS, TOKEN, DB_CONFIG, TELEGRAM_CHAT_ID, COMMISSION, SANDBOX_MODE, STARTING_DEPOSIT, MAX_OPERATION_AMOUNT, ACCOUNT_ID, MAX_SHARES_PER_TRADE
-from telegram_bot import send_telegram_message
-import psycopg2
+from tinkoff.invest import OrderDirection
+from config import TICKERS, TELEGRAM_CHAT_ID, COMMISSION, STARTING_DEPOSIT, MAX_OPERATION_AMOUNT, MAX_SHARES_PER_TRADE
+from broker_session import BrokerSession, money_to_float
+import telegram_outbox
+from instruments_catalog import get_figi
+import quotes_storage
+import migrations
+import db
 import matplotlib.pyplot as plt
 import os
-import time
 import datetime
 from tqdm import tqdm
 import sys
 import logging
-from decimal import Decimal
 
 # === Настройка логирования ===
 LOG_FILE = "trading_log.txt"
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+_logging_ready = False
 
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
 
-file_handler = logging.FileHandler(LOG_FILE, encoding='utf-8')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+def setup_logging():
+    """Подключает вывод логов в консоль и в LOG_FILE (один раз на процесс, при запуске, а не при импорте)"""
+    global _logging_ready
+    if _logging_ready:
+        return
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+
+    file_handler = logging.FileHandler(LOG_FILE, encoding='utf-8')
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+    _logging_ready = True
 
-logging.info("=== Запуск торгового робота ===")
 
 # === Константы ===
 N = 2
@@ -45,121 +54,59 @@ CHART_FILE = "balance_chart.png"
 
 # === Подключение к БД ===
 def connect_db():
-    """Подключение к базе данных"""
-    return psycopg2.connect(**DB_CONFIG)
+    """Транзакция на соединении из общего пула (COMMIT в конце блока with)"""
+    return db.transaction()
 
 # === Получение FIGI по тикеру ===
-def get_figi_by_ticker(ticker):
-    """Получает FIGI инструмента по тикеру"""
+def get_figi_by_ticker(session, ticker):
+    """Получает FIGI инструмента по тикеру из общего справочника инструментов (API — через канал сессии)"""
     try:
-        if SANDBOX_MODE:
-            with SandboxClient(TOKEN) as client:
-                instruments = client.instruments
-        else:
-            with Client(TOKEN) as client:
-                instruments = client.instruments
-
-        if ticker == 'SPY':
-            r = instruments.etfs()
-        else:
-            r = instruments.shares()
-
-        for instrument in r.instruments:
-            if instrument.ticker == ticker:
-                return instrument.figi
-        return None
+        return get_figi(ticker, session.client)
     except Exception as e:
         print(f"[X ПЕСОЧНИЦА] Ошибка при получении FIGI для {ticker}: {e}")
         return None
 
-# === Получение последних N свечей из таблицы quotes_{ticker} ===
+# === Получение последних N свечей тикера ===
 def get_last_n_days(ticker, n=2):
-    """Получает последние n свечей из таблицы quotes_{ticker}"""
-    table_name = f"quotes_{ticker.lower()}"
-    query = f"""
-        SELECT date, open, close, sma, lower_band
-        FROM {table_name}
-        ORDER BY date DESC
-        LIMIT %s
-    """
+    """Получает последние n свечей тикера, самая новая — первая"""
     try:
         with connect_db() as conn:
-            with conn.cursor() as cur:
-                cur.execute(query, (n,))
-                rows = cur.fetchall()
-                if not rows:
-                    return pd.DataFrame()
-                return pd.DataFrame(rows, columns=['date', 'open', 'close', 'sma', 'lower_band'])
+            df = quotes_storage.read_last_n(conn, ticker, n, columns=['date', 'open', 'close', 'sma', 'lower_band'],
+                                            ascending=False)
+            if df.empty:
+                return pd.DataFrame()
+            return df
     except Exception as e:
-        print(f"[X ПЕСОЧНИЦА] Ошибка при получении данных из {table_name}: {e}")
+        print(f"[X ПЕСОЧНИЦА] Ошибка при получении данных из {quotes_storage.table_label(ticker)}: {e}")
         return pd.DataFrame()
 
 # === Выполнение ордера ===
-def execute_order(figi, quantity, order_type):
-    """Выполняет ордер через Tinkoff API"""
+def execute_order(session, figi, quantity, order_type):
+    """Выполняет ордер через открытую сессию брокера"""
     try:
-        if SANDBOX_MODE:
-            with SandboxClient(TOKEN) as client:
-                account_id = client.sandbox.get_sandbox_accounts().accounts[0].id
-                client.sandbox.sandbox_pay_in(account_id=account_id, amount=Decimal(1_000_000))
-        else:
-            with Client(TOKEN) as client:
-                account_id = ACCOUNT_ID
-
         direction = OrderDirection.ORDER_DIRECTION_BUY if order_type == "BUY" else OrderDirection.ORDER_DIRECTION_SELL
-
-        if SANDBOX_MODE:
-            response = client.sandbox.post_order(
-                figi=figi,
-                quantity=quantity,
-                direction=direction,
-                account_id=account_id,
-                order_type=OrderType.ORDER_TYPE_MARKET,
-                order_id=str(hash(figi))[:36]
-            )
-        else:
-            response = client.orders.post_order(
-                figi=figi,
-                quantity=quantity,
-                direction=direction,
-                account_id=account_id,
-                order_type=OrderType.ORDER_TYPE_MARKET,
-                order_id=str(hash(figi))[:36]
-            )
+        session.post_order(figi, quantity, direction)
         return True
     except Exception as e:
         print(f"[X ПЕСОЧНИЦА] Ошибка при выполнении ордера {order_type} для {figi}: {e}")
         return False
 
 # === Получение текущего баланса ===
-def get_current_balance():
-    """Получает текущий баланс счёта"""
+def get_current_balance(session):
+    """Получает текущий баланс счёта сессии"""
     try:
-        if SANDBOX_MODE:
-            with SandboxClient(TOKEN) as client:
-                accounts = client.sandbox.get_sandbox_accounts()
-                if not accounts.accounts:
-                    client.sandbox.open_sandbox_account()
-                account_id = accounts.accounts[0].id
-                positions = client.operations.get_operations(account_id=account_id).positions
-        else:
-            with Client(TOKEN) as client:
-                accounts = client.users.get_accounts()
-                account_id = ACCOUNT_ID
-                positions = client.operations.get_operations(account_id=account_id).positions
-
         total_value = 0
-        for pos in positions:
-            total_value += pos.current_price.units + pos.current_price.nano / 1e9
+        for pos in session.get_operations_positions():
+            total_value += money_to_float(pos.current_price)
         return total_value
     except Exception as e:
         print(f"[X ПЕСОЧНИЦА] Ошибка при получении баланса: {e}")
         return STARTING_DEPOSIT
 
 # === Логирование сделки в Excel и БД ===
-def log_trade(signal_type, ticker, price, quantity, amount, profit=None):
+def log_trade(session, signal_type, ticker, price, quantity, amount, profit=None):
     """Логирует сделку в Excel и в БД"""
-    balance = get_current_balance()
+    balance = get_current_balance(session)
     timestamp = datetime.datetime.now()
 
     df_new = pd.DataFrame([{
@@ -240,11 +187,11 @@ def reset_broken_positions():
         print(f"[X ПЕСОЧНИЦА] Ошибка при сбросе позиций: {e}")
 
 # === Основной торговый цикл ===
-def main_trading_loop():
+def main_trading_loop(session):
     print("[ПЕСОЧНИЦА] Начинаем новый торговый цикл")
     logging.info("[ПЕСОЧНИЦА] Начинаем новый торговый цикл")
 
-    balance = get_current_balance()
+    balance = get_current_balance(session)
     print(f"[ПЕСОЧНИЦА] Текущий баланс:")
     print(f"[ПЕСОЧНИЦА] - Денег на счёте: {balance:.2f} руб.")
     print(f"[ПЕСОЧНИЦА] - Стоимость акций: 0.00 руб.")
@@ -324,8 +271,8 @@ def main_trading_loop():
 
             balance_details = {'money': balance}
             if balance_details['money'] > amount:
-                figi = get_figi_by_ticker(ticker)
-                if figi and execute_order(figi, int(qty), "BUY"):
+                figi = get_figi_by_ticker(session, ticker)
+                if figi and execute_order(session, figi, int(qty), "BUY"):
                     try:
                         with connect_db() as conn:
                             with conn.cursor() as cur:
@@ -339,11 +286,10 @@ def main_trading_loop():
                                         updated_at = NOW()
                                 """, (ticker, price, qty))
                                 conn.commit()
-                        log_trade("BUY", ticker, price, qty, amount)
-                        send_telegram_message(f"*[ПЕСОЧНИЦА] [+] Купили* {ticker}, {qty} шт. по {price:.2f} руб.\nДата: {trade_date}")
+                        log_trade(session, "BUY", ticker, price, qty, amount)
+                        telegram_outbox.enqueue(f"*[ПЕСОЧНИЦА] [+] Купили* {ticker}, {qty} шт. по {price:.2f} руб.\nДата: {trade_date}", source="trader_executor")
                     except Exception as e:
                         print(f"[X ПЕСОЧНИЦА] Ошибка при обновлении позиции {ticker}: {e}")
-            time.sleep(2)
 
         # === Сигнал ДОКУПИТЬ ===
         elif dca_signal and avg_pos and in_market:
@@ -356,8 +302,8 @@ def main_trading_loop():
 
             balance_details = {'money': balance}
             if balance_details['money'] > amount:
-                figi = get_figi_by_ticker(ticker)
-                if figi and execute_order(figi, int(new_quantity), "BUY"):
+                figi = get_figi_by_ticker(session, ticker)
+                if figi and execute_order(session, figi, int(new_quantity), "BUY"):
                     try:
                         new_avg_price = (avg_pos * (1 - COMMISSION) + price * (1 + COMMISSION)) / 2
                         new_total_qty = avg_pos + new_quantity
@@ -369,11 +315,10 @@ def main_trading_loop():
                                     WHERE ticker = %s
                                 """, (new_avg_price, new_total_qty, ticker))
                                 conn.commit()
-                        log_trade("DCA", ticker, price, new_quantity, amount)
-                        send_telegram_message(f"*[ПЕСОЧНИЦА] [~] Докупили* {ticker}, {new_quantity} шт. по {price:.2f} руб.\nДата: {trade_date}")
+                        log_trade(session, "DCA", ticker, price, new_quantity, amount)
+                        telegram_outbox.enqueue(f"*[ПЕСОЧНИЦА] [~] Докупили* {ticker}, {new_quantity} шт. по {price:.2f} руб.\nДата: {trade_date}", source="trader_executor")
                     except Exception as e:
                         print(f"[X ПЕСОЧНИЦА] Ошибка при обновлении позиции {ticker}: {e}")
-            time.sleep(2)
 
         # === Сигнал ПРОДАТЬ ===
         elif sell_signal and avg_pos and in_market:
@@ -385,11 +330,11 @@ def main_trading_loop():
             amount = price * qty * (1 - COMMISSION)
             profit = (price - avg_pos) * qty * (1 - COMMISSION)
 
-            figi = get_figi_by_ticker(ticker)
-            if figi and execute_order(figi, int(qty), "SELL"):
+            figi = get_figi_by_ticker(session, ticker)
+            if figi and execute_order(session, figi, int(qty), "SELL"):
                 try:
-                    log_trade("SELL", ticker, price, qty, amount, profit)
-                    send_telegram_message(f"*[ПЕСОЧНИЦА] [-] Продали* {ticker}, {qty} шт. по {price:.2f} руб. Прибыль: {profit:.2f} руб.\nДата: {trade_date}")
+                    log_trade(session, "SELL", ticker, price, qty, amount, profit)
+                    telegram_outbox.enqueue(f"*[ПЕСОЧНИЦА] [-] Продали* {ticker}, {qty} шт. по {price:.2f} руб. Прибыль: {profit:.2f} руб.\nДата: {trade_date}", source="trader_executor")
                     with connect_db() as conn:
                         with conn.cursor() as cur:
                             cur.execute("""
@@ -400,40 +345,52 @@ def main_trading_loop():
                             conn.commit()
                 except Exception as e:
                     print(f"[X TELEGRAM] Ошибка при отправке сообщения о продаже {ticker}: {e}")
-            time.sleep(2)
 
     # === Финальная очистка ===
     reset_broken_positions()
     print("[OK ПЕСОЧНИЦА] Цикл торговли завершён")
-    send_telegram_message("*[ПЕСОЧНИЦА] Цикл торговли завершён*")
+    telegram_outbox.enqueue("*[ПЕСОЧНИЦА] Цикл торговли завершён*", source="trader_executor")
 
     # === Отправка сообщения, если не было сделок ===
     with connect_db() as conn:
         with conn.cursor() as cur:
             cur.execute("""
                 SELECT COUNT(*) FROM trade_logs
-                WHERE DATE(timestamp) = %s
-            """, (trade_date,))
+                WHERE timestamp >= %s AND timestamp < %s::date + 1
+            """, (trade_date, trade_date))
             trade_count = cur.fetchone()[0]
 
     if trade_count == 0:
         message = f"*[ПЕСОЧНИЦА] [!] Нет сделок* за сегодня.\nДата: {trade_date}"
-        send_telegram_message(message)
+        telegram_outbox.enqueue(message, source="trader_executor")
         print(f"[INFO ПЕСОЧНИЦА] Отправлено сообщение: {message}")
         logging.info(f"[INFO ПЕСОЧНИЦА] Отправлено сообщение: {message}")
 
 # === Запуск ===
-if __name__ == "__main__":
+def run():
+    """Торговый цикл и отчёт (этап конвейера или запуск скрипта)"""
+    setup_logging()
+    logging.info("=== Запуск торгового робота ===")
     print("[START ПЕСОЧНИЦА] Запуск торгового робота")
     # === Отправляем сообщение в Telegram о запуске ===
     start_msg = "*[ПЕСОЧНИЦА] Запускаем торгового робота*"
-    send_telegram_message(start_msg)
+    telegram_outbox.enqueue(start_msg, source="trader_executor")
     print(start_msg)
     # === Конец Отправляем сообщение в Telegram о запуске ===
     try:
-        main_trading_loop()
+        migrations.ensure_schema()
+        # Один канал API и один поиск счёта на весь торговый цикл
+        with BrokerSession() as session:
+            main_trading_loop(session)
         generate_balance_chart()
         print("[ПЕСОЧНИЦА] Отчёт сохранён")
     except Exception as e:
         print(f"[X ПЕСОЧНИЦА] Ошибка: {e}")
-        logging.error(f"[X ПЕСОЧНИЦА] Ошибка: {e}", exc_info=True)
\ No newline at end of file
+        logging.error(f"[X ПЕСОЧНИЦА] Ошибка: {e}", exc_info=True)
+    # Скрипт запускается и отдельно от main.py: сообщения о сделках отправляются сразу
+    telegram_outbox.send_now()
+
+
+if __name__ == "__main__":
+    run()
+    db.print_pool_stats()